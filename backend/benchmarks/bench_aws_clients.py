@@ -0,0 +1,74 @@
+"""
+Microbenchmark: per-call overhead of building a fresh boto3 client (the old
+behaviour of the S3/Bedrock services) versus reusing the pooled registry client.
+
+Signing a presigned URL is used as the "call" because it is purely local, so the
+numbers isolate client construction cost without any network traffic.
+
+Usage (from backend/):
+    python -m benchmarks.bench_aws_clients --iterations 200
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import boto3
+
+from services import aws_clients
+
+
+def _fresh_client_call():
+    s3 = boto3.client(
+        "s3",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_REGION"),
+    )
+    s3.generate_presigned_url("get_object", Params={"Bucket": "bench-bucket", "Key": "room.png"}, ExpiresIn=3600)
+
+
+def _pooled_client_call():
+    s3 = aws_clients.get_client("s3")
+    s3.generate_presigned_url("get_object", Params={"Bucket": "bench-bucket", "Key": "room.png"}, ExpiresIn=3600)
+
+
+def _measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<16} mean={statistics.mean(samples):8.3f} ms  p50={statistics.median(samples):8.3f} ms  p95={p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    # Dummy credentials so the benchmark runs offline; nothing is sent over the wire.
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+
+    aws_clients.reset_clients()
+    aws_clients.init_clients(services=("s3",))
+
+    fresh = _measure(_fresh_client_call, args.iterations)
+    pooled = _measure(_pooled_client_call, args.iterations)
+
+    _report("fresh client", fresh)
+    _report("pooled client", pooled)
+    print(f"speedup: {statistics.mean(fresh) / statistics.mean(pooled):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Load benchmark: drives /init-session, /generate and /session/{id} through the real
+FastAPI app (lifespan, graph, executors, caches) against the in-process fakes in
+benchmarks.fakes, at a fixed number of concurrent virtual users.
+
+Each virtual user repeatedly uploads a photo, generates a design on that session
+and reads the session back. Every upload and prompt is unique by default, so each
+/generate runs the full graph; --repeat-prompts measures the cached path instead.
+
+Reports p50/p95/p99 latency per endpoint, requests per second and peak RSS. Once
+the background image derivatives have finished, every session is viewed again and
+the image bytes that view downloads are reported: original plus the WebP/AVIF
+display copy, next to original plus the full PNG it replaces.
+--output writes the results as JSON; --baseline compares against an earlier
+--output file and exits with status 1 when a latency or throughput number is
+worse than the baseline by more than --tolerance.
+
+Usage (from backend/):
+    python -m benchmarks.bench_load --concurrency 16 --iterations 20 --output load.json
+    python -m benchmarks.bench_load --concurrency 16 --iterations 20 --baseline load.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from urllib.parse import urlparse
+
+from PIL import Image
+
+ENDPOINTS = ("init_session", "generate", "session")
+# Lower is better for these; requests_per_second is the only higher-is-better number
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def synthetic_photo(seed, size=(1024, 768)):
+    """
+    A small JPEG whose bytes differ per seed, so uploads don't deduplicate.
+    """
+    image = Image.effect_noise(size, 30).convert("RGB")
+    image.putpixel((0, 0), (seed % 256, (seed // 256) % 256, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples, errors):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "mean_ms": round(sum(samples) / len(samples), 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 0.50), 2),
+        "p95_ms": round(percentile(samples, 0.95), 2),
+        "p99_ms": round(percentile(samples, 0.99), 2),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _options(seed, repeat_prompts):
+    from services.catalog import FIELDS, catalog
+
+    rng = random.Random(seed)  # nosec B311
+    options = {field: rng.choice(catalog.options(field)) for field in FIELDS}
+    options["additional_prompt"] = "" if repeat_prompts else f"variation {seed}"
+    return options
+
+
+async def virtual_user(client, user, args, photos, latencies, errors, sessions):
+    for iteration in range(args.iterations):
+        seed = 0 if args.repeat_prompts else user * args.iterations + iteration
+        photo = photos[seed % len(photos)]
+
+        async def timed(endpoint, request):
+            started = time.perf_counter()
+            try:
+                response = await request
+                ok = response.status_code < 400
+            except Exception:
+                response, ok = None, False
+            elapsed = (time.perf_counter() - started) * 1000
+            if ok:
+                latencies[endpoint].append(elapsed)
+            else:
+                errors[endpoint] += 1
+            return response if ok else None
+
+        response = await timed("init_session", client.post("/init-session", files={"file": ("room.jpg", photo, "image/jpeg")}))
+        if response is None:
+            continue
+        thread_id = response.json()["thread_id"]
+        sessions.append(thread_id)
+
+        response = await timed("generate", client.post("/generate", data={**_options(seed, args.repeat_prompts), "thread_id": thread_id}))
+        if response is None:
+            continue
+        await timed("session", client.get(f"/session/{thread_id}"))
+
+
+def _object_bytes(s3, url):
+    # Fake presigned URLs are https://<bucket>.s3.local/<key>?...
+    return len(s3.objects.get(urlparse(url).path.lstrip("/"), b"")) if url else 0
+
+
+async def session_view_bytes(client, s3, sessions):
+    """
+    Mean image bytes one session view downloads, with the display copy and with the full PNG.
+    """
+    views = {"display": [], "png": [], "thumbnail": []}
+    for thread_id in sessions:
+        response = await client.get(f"/session/{thread_id}")
+        if response.status_code != 200 or not response.json().get("generated_url"):
+            continue
+        session = response.json()
+        original = _object_bytes(s3, session["original_url"])
+        png = _object_bytes(s3, session["generated_url"])
+        views["png"].append(original + png)
+        views["display"].append(original + (_object_bytes(s3, session.get("display_url")) or png))
+        views["thumbnail"].append(_object_bytes(s3, session.get("thumbnail_url")))
+    return {name: round(sum(values) / len(values)) if values else 0 for name, values in views.items()}
+
+
+async def run(args):
+    import httpx
+
+    import main
+    from benchmarks.fakes import in_process_backends
+    from graph import items_governor
+    from services.aws_bedrock import image_governor
+    from services.derivatives import derivatives
+
+    # The Bedrock governors would otherwise cap throughput at the production quotas
+    governors = {governor: governor.requests_per_minute for governor in (image_governor, items_governor)}
+    for governor in governors:
+        governor.requests_per_minute = args.bedrock_rpm
+        governor.reset()
+
+    photo_count = 1 if args.repeat_prompts else args.concurrency * args.iterations
+    photos = [synthetic_photo(seed) for seed in range(photo_count)]
+
+    try:
+        with in_process_backends(
+            s3_latency=args.s3_latency_ms / 1000,
+            image_latency=args.image_latency_ms / 1000,
+            image_size=args.image_px,
+            items_latency=args.items_latency_ms / 1000,
+        ) as fakes:
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+                    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+                    errors = dict.fromkeys(ENDPOINTS, 0)
+                    sessions = []
+                    started = time.perf_counter()
+                    users = (virtual_user(client, user, args, photos, latencies, errors, sessions) for user in range(args.concurrency))
+                    await asyncio.gather(*users)
+                    elapsed = time.perf_counter() - started
+
+                    # Outside the timed window: wait for the display copies, then view every session again
+                    await derivatives.drain()
+                    view_bytes = await session_view_bytes(client, fakes.s3, sessions)
+    finally:
+        for governor, requests_per_minute in governors.items():
+            governor.requests_per_minute = requests_per_minute
+            governor.reset()
+
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "repeat_prompts": args.repeat_prompts,
+            "s3_latency_ms": args.s3_latency_ms,
+            "image_latency_ms": args.image_latency_ms,
+            "items_latency_ms": args.items_latency_ms,
+            "image_px": args.image_px,
+            "python": platform.python_version(),
+        },
+        "endpoints": {endpoint: summarize(latencies[endpoint], errors[endpoint]) for endpoint in ENDPOINTS},
+        "requests_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "session_view_bytes": view_bytes,
+        "bedrock_image_calls": fakes.bedrock.calls,
+        "bedrock_items_calls": fakes.items.calls,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print results next to the baseline. Returns the list of regressions beyond tolerance.
+    """
+    regressions = []
+    print(f"{'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+
+    def row(name, before, after, higher_is_better=False):
+        change = (after - before) / before if before else 0.0
+        print(f"{name:<28} {before:>10.2f} {after:>10.2f} {change:>+8.1%}")
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(name)
+
+    for endpoint in ENDPOINTS:
+        for key in LATENCY_KEYS:
+            row(f"{endpoint}.{key}", baseline["endpoints"][endpoint][key], results["endpoints"][endpoint][key])
+    row("requests_per_second", baseline["requests_per_second"], results["requests_per_second"], higher_is_better=True)
+    row("peak_rss_mb", baseline["peak_rss_mb"], results["peak_rss_mb"])
+    if "session_view_bytes" in baseline:
+        row("session_view_bytes", baseline["session_view_bytes"]["display"], results["session_view_bytes"]["display"])
+    return regressions
+
+
+def report(results):
+    print(f"{'endpoint':<14} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<14} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    print(f"requests/s: {results['requests_per_second']:.1f}  peak RSS: {results['peak_rss_mb']:.1f} MB")
+    view = results["session_view_bytes"]
+    print(
+        f"bytes per session view: {view['display'] / 1024:.0f} KB with the display copy, "
+        f"{view['png'] / 1024:.0f} KB with the PNG; thumbnail {view['thumbnail'] / 1024:.1f} KB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=10, help="scenarios per virtual user")
+    parser.add_argument("--s3-latency-ms", type=float, default=20)
+    parser.add_argument("--image-latency-ms", type=float, default=500, help="simulated SD3.5 call time")
+    parser.add_argument("--image-px", type=int, default=1024, help="edge of the generated (square) image")
+    parser.add_argument("--items-latency-ms", type=float, default=300, help="simulated Haiku call time")
+    parser.add_argument("--bedrock-rpm", type=int, default=1_000_000, help="governor budget per model")
+    parser.add_argument("--repeat-prompts", action="store_true", help="same photo and options every time (cache hits)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare against an earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression vs the baseline (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    # Everything runs in-process; none of these reach AWS or MongoDB
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("WARM_ITEMS_MODEL", "false")
+    os.environ.setdefault("CHECKPOINT_RETENTION_INTERVAL_SECONDS", "0")
+    # One INFO line per request from the client would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
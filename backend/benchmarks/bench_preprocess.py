@@ -0,0 +1,72 @@
+"""
+Benchmark: bytes sent to Bedrock and end-to-end latency with and without the
+image preprocessing stage, for a synthetic full-resolution phone photo.
+
+The Bedrock call is a local stand-in whose latency models request upload time
+(payload size / bandwidth) plus server-side decode time (per megapixel), so the
+benchmark runs offline.
+
+Usage (from backend/):
+    python -m benchmarks.bench_preprocess --megapixels 12 --upload-mbps 50
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import time
+
+from PIL import Image
+
+from utils.image_helpers import preprocess_image
+
+
+def synthetic_photo(megapixels):
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    photo = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def fake_bedrock(body, upload_mbps, decode_ms_per_mp):
+    payload = json.loads(body)
+    image_bytes = base64.b64decode(payload["image"])
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        megapixels = image.size[0] * image.size[1] / 1_000_000
+    time.sleep(len(body) * 8 / (upload_mbps * 1_000_000) + megapixels * decode_ms_per_mp / 1000)
+
+
+def run(image_bytes, preprocess, args):
+    start = time.perf_counter()
+    if preprocess:
+        image_bytes = preprocess_image(image_bytes)
+    body = json.dumps({"prompt": "Japandi bedroom", "image": base64.b64encode(image_bytes).decode("utf-8")})
+    fake_bedrock(body, args.upload_mbps, args.decode_ms_per_mp)
+    return len(body), (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--upload-mbps", type=float, default=50)
+    parser.add_argument("--decode-ms-per-mp", type=float, default=40)
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    photo = synthetic_photo(args.megapixels)
+    print(f"source photo: {args.megapixels:.0f} MP, {len(photo) / 1e6:.2f} MB")
+
+    for label, preprocess in (("before (raw)", False), ("after (preprocessed)", True)):
+        results = [run(photo, preprocess, args) for _ in range(args.iterations)]
+        sent = results[0][0]
+        latency = sorted(r[1] for r in results)[len(results) // 2]
+        print(f"{label:<22} bytes sent={sent / 1e6:7.2f} MB  end-to-end p50={latency:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+In-process stand-ins for S3, Bedrock and MongoDB, so the app can be driven end to
+end offline. Latencies are simulated with time.sleep on the executor threads,
+which is what the real SDK calls block on.
+"""
+
+import base64
+import io
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+from langgraph.checkpoint.memory import InMemorySaver
+
+from services import aws_clients
+from services.result_cache import InMemoryResultStore
+from services.retention import InMemoryRetentionBackend
+from services.session_store import InMemorySessionStore
+from services.single_flight import InMemoryLeaseStore
+
+
+class FakeS3:
+    """
+    Dict-backed bucket implementing the client calls services.aws_s3 makes.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **headers):
+        time.sleep(self.latency)
+        data = bytes(Body)
+        with self._lock:
+            self.objects[Key] = data
+            self.bytes_in += len(data)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def head_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not Found"}}, "GetObject")
+        data = self.objects[Key]
+        with self._lock:
+            self.bytes_out += len(data)
+        return {"Body": io.BytesIO(data)}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+def synthetic_render(size=(1024, 1024)):
+    """
+    A PNG with smooth gradients and soft texture, roughly as compressible as an SD3.5 render.
+    """
+    from PIL import Image, ImageFilter
+
+    texture = Image.effect_noise(size, 64).filter(ImageFilter.GaussianBlur(0.6))
+    gradient = Image.linear_gradient("L").resize(size)
+    image = Image.merge("RGB", (gradient, texture, gradient.rotate(90)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _tag_png(png, tag):
+    # A tEXt chunk before IEND makes every response a distinct file that still decodes
+    data = b"bench\x00" + tag.encode()
+    chunk = struct.pack(">I", len(data)) + b"tEXt" + data + struct.pack(">I", zlib.crc32(b"tEXt" + data))
+    return png[:-12] + chunk + png[-12:]
+
+
+class FakeBedrockRuntime:
+    """
+    Image model stub: waits `latency` seconds and answers with a distinct size x size PNG per call.
+    """
+
+    def __init__(self, latency=0.0, image_size=1024):
+        self.latency = latency
+        self.calls = 0
+        self.bytes_sent = 0
+        self._image = synthetic_render((image_size, image_size))
+        self._lock = threading.Lock()
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None):
+        with self._lock:
+            self.calls += 1
+            self.bytes_sent += len(body)
+            call = self.calls
+        image = _tag_png(self._image, f"call-{call}")
+        time.sleep(self.latency)
+        return {"body": io.BytesIO(json.dumps({"images": [base64.b64encode(image).decode()]}).encode())}
+
+
+class FakeItemsModel:
+    """
+    Stand-in for the ChatBedrock items model.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(content='[{"name": "Oak Side Table", "price": "120"}, {"name": "Linen Sofa", "price": "900"}]')
+
+
+class FakeMongoClient:
+    def __init__(self, *args, **kwargs):
+        self.databases = defaultdict(lambda: defaultdict(dict))
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+    def close(self):
+        pass
+
+
+class FakeAsyncMongoClient:
+    def __init__(self, *args, **kwargs):
+        self.admin = SimpleNamespace(command=self._command)
+
+    async def _command(self, name):
+        return {"ok": 1}
+
+    async def close(self):
+        pass
+
+
+class BenchSaver(InMemorySaver):
+    async def setup(self):
+        pass
+
+
+class BenchResultStore(InMemoryResultStore):
+    def ensure_indexes(self):
+        pass
+
+
+class BenchSessionStore(InMemorySessionStore):
+    def ensure_indexes(self):
+        pass
+
+
+class BenchLeaseStore(InMemoryLeaseStore):
+    def ensure_indexes(self):
+        pass
+
+
+@contextmanager
+def in_process_backends(s3_latency=0.0, image_latency=0.0, image_size=1024, items_latency=0.0):
+    """
+    Point the app at the fakes for the duration of the block. Yields a namespace
+    with the fake S3, image model and items model, for their counters.
+    """
+    import graph
+    import main
+
+    os.environ.setdefault("S3_BUCKET_NAME", "bench-bucket")
+    fakes = SimpleNamespace(
+        s3=FakeS3(latency=s3_latency),
+        bedrock=FakeBedrockRuntime(latency=image_latency, image_size=image_size),
+        items=FakeItemsModel(latency=items_latency),
+        saver=BenchSaver(),
+    )
+
+    with (
+        patch.object(main, "MongoClient", FakeMongoClient),
+        patch.object(main, "AsyncMongoClient", FakeAsyncMongoClient),
+        patch("services.checkpointer.AsyncMongoDBSaver", lambda *args, **kwargs: fakes.saver),
+        patch.object(main, "MongoResultStore", lambda *args, **kwargs: BenchResultStore()),
+        patch.object(main, "MongoSessionStore", lambda *args, **kwargs: BenchSessionStore()),
+        patch.object(main, "MongoLeaseStore", lambda *args, **kwargs: BenchLeaseStore()),
+        patch.object(main, "MongoRetentionBackend", lambda *args, **kwargs: InMemoryRetentionBackend(fakes.saver)),
+        patch.object(main, "init_clients", lambda: None),
+    ):
+        aws_clients.set_client("s3", fakes.s3)
+        aws_clients.set_client("bedrock-runtime", fakes.bedrock)
+        graph._items_llm_instance = fakes.items
+        try:
+            yield fakes
+        finally:
+            graph.reset_items_llm()
+            aws_clients.reset_clients()
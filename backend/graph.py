@@ -1,19 +1,38 @@
+import asyncio
+import base64
+import functools
+import inspect
 import json
+import logging
 import os
+import threading
 from typing import List, Optional, TypedDict
 
-from langchain_aws import ChatBedrock
-from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.graph import END, StateGraph
+from services.aws_bedrock import DEFAULT_GENERATION_PARAMS, IMAGE_MODEL_ID, image_governor, invoke_model
+from services.aws_clients import get_client
+from services.bedrock_governor import BATCH, ModelGovernor, bedrock_priority
+from services.blob_store import GENERATED_PREFIX, blob_store, content_hash, hash_from_key
+from services.catalog import FIELDS, catalog
+from services.executors import run_in_executor
+from services.result_cache import generation_cache_key, result_cache
+from utils.cache import LRUCache
+from utils.image_helpers import preprocess_image, preprocess_signature
+from utils.metrics import histogram, timed
 
-from services.aws_bedrock import invoke_model
-from services.aws_s3 import get_file, upload_file
+logger = logging.getLogger(__name__)
+
+node_seconds = histogram("graph_node_seconds", "Design graph node duration", ("node",))
+
+# langchain_aws, langchain_core and langgraph are imported where they are first needed:
+# together they are most of the process's import time, and cold starts pay for it.
 
 
 # Define the State
+# Images are referenced by blob key only; raw bytes never enter the state, so
+# they are never serialized into checkpoints. Nodes resolve keys via blob_store,
+# and presigned URLs are minted from the keys at response time (services/url_signer.py).
 class RoomDesignState(TypedDict):
     # Inputs
-    original_image_bytes: Optional[bytes]
     original_image_key: Optional[str]
     original_filename: str
     style: str
@@ -22,101 +41,109 @@ class RoomDesignState(TypedDict):
     palette: str
     clutter: str
     additional_prompt: str
+    bypass_cache: bool  # Skip the generation result cache for this run
+
+    # Intermediate
+    original_image_hash: Optional[str]  # Content hash of the original; its encoded payload lives in prepared_images
+
+    # Legacy: sessions checkpointed before URLs were minted on read stored them here
+    original_image_url: Optional[str]
+    generated_image_url: Optional[str]
 
     # Outputs
     generated_prompt: str
-    generated_image_bytes: Optional[bytes]
-    generated_image_url: Optional[str]
-    original_image_url: Optional[str]
+    generated_image_key: Optional[str]
     items: List[dict]  # List of {name: str, link: str}
+    skipped_stages: List[str]  # Stages plan_run found nothing to redo for
 
+    # Inputs and reusable outputs of the thread's last successful run, compared by plan_run
+    last_run: Optional[dict]
 
-# Node 1: Prompt Builder
-def build_prompt(state: RoomDesignState):
-    print("--- Building Prompt ---")
-
-    # Construct the prompt based on user inputs
-    prompt_parts = []
-
-    # Style Mapping
-    style_map = {
-        "Modern Minimalist": "Modern Minimalist style, clean lines, neutral colors, less clutter, sleek furniture.",
-        "Industrial Loft": "Industrial Loft style, exposed brick, metal accents, raw wood, urban aesthetic.",
-        "Scandinavian / Hygge": "Scandinavian Hygge style, cozy, white and wood, soft textures, functional, warm lighting.",
-        "Cyberpunk / Futuristic": "Cyberpunk style, neon LED lighting, futuristic furniture, metallic surfaces, night time atmosphere, high-tech.",
-        "Bohemian": "Bohemian style, plants, patterns, rattan, eclectic, warm colors, layered textures.",
-        "Mid-Century Modern": "Mid-Century Modern style, retro 50s/60s, organic shapes, vibrant accents, teak wood.",
-        "Japandi": "Japandi style, blend of Japanese rustic and Scandinavian functionalism, natural materials, balanced.",
-    }
-    if state["style"] in style_map:
-        prompt_parts.append(style_map[state["style"]])
-
-    # Mood Mapping
-    mood_map = {
-        "Calm & Zen": "Calm and Zen atmosphere, soft lighting, uncluttered, peaceful, serene.",
-        "Energetic & Creative": "Energetic and Creative atmosphere, bright natural light, bold colors, inspiring.",
-        "Moody & Dramatic": "Moody and Dramatic atmosphere, cinematic lighting, chiaroscuro, shadows, dark tones.",
-        "Professional & Focused": "Professional and Focused atmosphere, cool lighting, organized, sharp contrast, office vibe.",
-        "Cozy & Warm": "Cozy and Warm atmosphere, warm lighting, blankets, soft shadows, inviting.",
-        "Luxury & Elegant": "Luxury and Elegant atmosphere, gold accents, marble, expensive textures, high-end.",
-    }
-    if state["mood"] in mood_map:
-        prompt_parts.append(mood_map[state["mood"]])
-
-    # Functionality Mapping
-    func_map = {
-        "Deep Focus / Work": "Home office setup, desk, ergonomic chair, bookshelf, organized workspace.",
-        "Relaxation / Lounge": "Living room setup, comfortable sofa, coffee table, TV, relaxation area.",
-        "Gaming / Streaming": "High-end gaming setup, triple monitor display, RGB ambient lighting, ergonomic gaming chair, soundproofing panels.",
-        "Creative Studio": "Creative studio setup, large table, storage, art supplies, easel, instruments.",
-        "Sleeping / Rest": "Bedroom setup, comfortable bed, nightstands, wardrobe, restful environment.",
-    }
-    if state["functionality"] in func_map:
-        prompt_parts.append(func_map[state["functionality"]])
-
-    # Palette Mapping
-    palette_map = {
-        "Earth Tones": "Earth Tones color palette, Beige, Olive, Terracotta, Brown.",
-        "Monochrome": "Monochrome color palette, Black, White, Grey.",
-        "Pastel": "Pastel color palette, Soft Pink, Mint Green, Baby Blue.",
-        "Dark & Bold": "Dark and Bold color palette, Navy Blue, Emerald Green, Charcoal.",
-        "Warm Neutrals": "Warm Neutrals color palette, Cream, Taupe, Sand.",
-        "Cool Blues": "Cool Blues color palette, Teal, Slate, Sky Blue.",
-    }
-    if state["palette"] in palette_map:
-        prompt_parts.append(palette_map[state["palette"]])
-
-    # Clutter Mapping
-    clutter_map = {
-        "Showroom Perfect": "Minimalist, clean surfaces, architectural digest style, pristine, no clutter.",
-        "Organized but Lived-in": "Organized but lived-in, a few books out, coffee cup, throw blanket, realistic.",
-        "Maximalist / Busy": "Maximalist, cluttered, highly detailed, filled with objects, lived-in, eclectic decor.",
+
+# Node 0: Run planner
+# On a resumed thread most inputs are usually unchanged (refining additional_prompt,
+# regenerating). Outputs that only depend on unchanged inputs are restored from last_run
+# instead of recomputed; the conditional edges below then route around their stages.
+PROMPT_INPUTS = FIELDS + ("additional_prompt",)
+PRE_GENERATION_STAGES = ("select_items", "prepare_image")
+
+
+def plan_run(state: RoomDesignState):
+    last = state.get("last_run") or {}
+    last_inputs = last.get("inputs") or {}
+    skipped = []
+    update = {}
+
+    # An edited catalog changes the fragments behind the same option values
+    same_options = (
+        bool(last_inputs) and last.get("catalog") == catalog.cache_version and all(state.get(field) == last_inputs.get(field) for field in FIELDS)
+    )
+    # The prompt also carries the additional details
+    if same_options and _normalized(state.get("additional_prompt")) == _normalized(last_inputs.get("additional_prompt")):
+        skipped.append("build_prompt")
+        update["generated_prompt"] = last["generated_prompt"]
+    # Items follow the catalog options: refining additional_prompt only changes the image
+    if same_options and last.get("items"):
+        skipped.append("select_items")
+        update["items"] = [dict(item) for item in last["items"]]
+    # generate_image fetches and encodes the photo itself if it turns out to need it
+    if last.get("original_image_hash") and state.get("original_image_key") == last.get("original_image_key"):
+        skipped.append("prepare_image")
+        update["original_image_hash"] = last["original_image_hash"]
+
+    update["skipped_stages"] = skipped
+    return update
+
+
+async def aplan_run(state: RoomDesignState):
+    return plan_run(state)
+
+
+def _normalized(text):
+    return " ".join((text or "").split())
+
+
+def _route_after_plan(state: RoomDesignState):
+    if "build_prompt" not in state["skipped_stages"]:
+        return ["build_prompt"]
+    return _route_after_prompt(state)
+
+
+def _route_after_prompt(state: RoomDesignState):
+    return [stage for stage in PRE_GENERATION_STAGES if stage not in state["skipped_stages"]] or ["generate_image"]
+
+
+def _last_run(state: RoomDesignState, image_hash):
+    return {
+        "inputs": {field: state.get(field) for field in PROMPT_INPUTS},
+        "catalog": catalog.cache_version,
+        "generated_prompt": state.get("generated_prompt"),
+        "items": state.get("items") or [],
+        "original_image_key": state.get("original_image_key"),
+        "original_image_hash": image_hash,
     }
-    if state["clutter"] in clutter_map:
-        prompt_parts.append(clutter_map[state["clutter"]])
 
-    # Additional Prompt
-    if state["additional_prompt"]:
-        prompt_parts.append(f"Additional details: {state['additional_prompt']}")
 
-    final_prompt = " ".join(prompt_parts)
-    print(f"Generated Prompt: {final_prompt}")
+# Node 1: Prompt Builder
+# Option values and their prompt fragments live in the versioned catalog (services/catalog.py)
+def build_prompt(state: RoomDesignState):
+    final_prompt = _compose_prompt(state)
+    logger.debug("Built prompt", extra={"prompt": final_prompt})
 
     return {"generated_prompt": final_prompt}
 
 
-# Node 2: Select Items (Runs BEFORE generation)
-def select_items(state: RoomDesignState):
-    print("--- Selecting Items ---")
+def _compose_prompt(state):
+    return catalog.compose(state, state.get("additional_prompt", ""))
 
-    # Use Bedrock Claude to suggest items based on the prompt
-    llm = ChatBedrock(
-        model_id="us.anthropic.claude-3-5-haiku-20241022-v1:0",
-        model_kwargs={"temperature": 0.5},
-        region_name=os.getenv("BEDROCK_REGION", os.getenv("AWS_REGION")),
-    )
 
-    system_prompt = """
+async def abuild_prompt(state: RoomDesignState):
+    # Pure string work, nothing to offload
+    return build_prompt(state)
+
+
+# Node 2: Select Items (Runs BEFORE generation)
+ITEMS_SYSTEM_PROMPT = """
     You are an interior design assistant. Based on the user's design prompt, list 3-5 key furniture and decor items
     that SHOULD be included in the generated room design.
     Search the current market to find the average price of each item.
@@ -125,44 +152,181 @@ def select_items(state: RoomDesignState):
     Do not include any other text.
     """
 
+
+ITEMS_MODEL_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+
+items_governor = ModelGovernor(
+    ITEMS_MODEL_ID,
+    requests_per_minute=int(os.getenv("ITEMS_MODEL_RPM", 120)),
+    max_concurrency=int(os.getenv("ITEMS_MODEL_MAX_CONCURRENCY", 8)),
+    max_wait=float(os.getenv("ITEMS_MODEL_MAX_WAIT_SECONDS", 30)),
+)
+
+# Parsed item lists keyed on the normalized design prompt. Prompts come from the
+# catalog's option combinations, so most requests repeat one seen before. Sized to hold
+# every combination (what the pre-warm fills) plus room for custom prompts.
+ITEMS_CACHE_EXTRA = 4096
+items_cache = LRUCache(
+    max_items=int(os.getenv("ITEMS_CACHE_SIZE", catalog.combination_count() + ITEMS_CACHE_EXTRA)),
+    ttl=int(os.getenv("ITEMS_CACHE_TTL_SECONDS", 24 * 60 * 60)),
+)
+
+_items_llm_instance = None
+_items_llm_lock = threading.Lock()
+
+
+def _items_llm():
+    """
+    One ChatBedrock per process, sharing the pooled bedrock-runtime client.
+    """
+    global _items_llm_instance
+    if _items_llm_instance is None:
+        with _items_llm_lock:
+            if _items_llm_instance is None:
+                from langchain_aws import ChatBedrock
+
+                # Use Bedrock Claude to suggest items based on the prompt
+                _items_llm_instance = ChatBedrock(
+                    model_id=ITEMS_MODEL_ID,
+                    model_kwargs={"temperature": 0.5},
+                    region_name=os.getenv("BEDROCK_REGION", os.getenv("AWS_REGION")),
+                    client=get_client("bedrock-runtime"),
+                )
+    return _items_llm_instance
+
+
+def warm_items_llm():
+    """
+    Import langchain_aws and build the items model ahead of the first request.
+    """
+    try:
+        _items_llm()
+    except Exception as e:
+        logger.warning("Could not warm up the items model: %s", e)
+
+
+def reset_items_llm():
+    global _items_llm_instance
+    with _items_llm_lock:
+        _items_llm_instance = None
+
+
+def _items_cache_key(prompt):
+    # Versioned, so editing the catalog doesn't serve items picked for its old fragments
+    return f"{catalog.cache_version}|{' '.join(prompt.split()).casefold()}"
+
+
+def _items_messages(state: RoomDesignState):
     user_message = f"Design Prompt: {state['generated_prompt']}"
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    return [SystemMessage(content=ITEMS_SYSTEM_PROMPT), HumanMessage(content=user_message)]
+
+
+def _parse_items(content):
+    # Extract JSON
+    start_idx = content.find("[")
+    end_idx = content.rfind("]") + 1
+    if start_idx != -1 and end_idx != -1:
+        json_str = content[start_idx:end_idx]
+        items_data = json.loads(json_str)
+
+        # Add Amazon links immediately
+        final_items = []
+        for item in items_data:
+            item_name = item["name"]
+            item_price = item["price"]
+            search_query = item_name.replace(" ", "+")
+            link = f"https://www.amazon.com/s?k={search_query}"
+            final_items.append({"name": item_name, "link": link, "price": item_price})
+
+        return final_items
+    else:
+        logger.warning("Could not find JSON in items response")
+        return []
 
-    messages = [SystemMessage(content=system_prompt), HumanMessage(content=user_message)]
+
+def select_items(state: RoomDesignState):
+    cache_key = _items_cache_key(state["generated_prompt"])
+    cached = items_cache.get(cache_key)
+    if cached is not None:
+        return {"items": [dict(item) for item in cached]}
 
     try:
-        response = llm.invoke(messages)
-        content = response.content
-
-        # Extract JSON
-        start_idx = content.find("[")
-        end_idx = content.rfind("]") + 1
-        if start_idx != -1 and end_idx != -1:
-            json_str = content[start_idx:end_idx]
-            items_data = json.loads(json_str)
-
-            # Add Amazon links immediately
-            final_items = []
-            for item in items_data:
-                item_name = item["name"]
-                item_price = item["price"]
-                search_query = item_name.replace(" ", "+")
-                link = f"https://www.amazon.com/s?k={search_query}"
-                final_items.append({"name": item_name, "link": link, "price": item_price})
-
-            return {"items": final_items}
-        else:
-            print("Could not find JSON in response")
-            return {"items": []}
+        response = items_governor.call(_items_llm().invoke, _items_messages(state))
+        items = _parse_items(response.content)
+    except Exception as e:
+        logger.warning("Error selecting items: %s", e)
+        return {"items": []}
 
+    # Only successful lists are memoized, so a transient failure is retried next time
+    if items:
+        items_cache.set(cache_key, items)
+    return {"items": [dict(item) for item in items]}
+
+
+async def aselect_items(state: RoomDesignState):
+    cache_key = _items_cache_key(state["generated_prompt"])
+    cached = items_cache.get(cache_key)
+    if cached is not None:
+        return {"items": [dict(item) for item in cached]}
+
+    try:
+        llm = _items_llm()
+        # Queue on the event loop, so a waiting call never holds a "bedrock" thread
+        async with items_governor.admission():
+            response = await run_in_executor("bedrock", items_governor.call, llm.invoke, _items_messages(state))
+        items = _parse_items(response.content)
     except Exception as e:
-        print(f"Error selecting items: {e}")
+        logger.warning("Error selecting items: %s", e)
         return {"items": []}
 
+    if items:
+        items_cache.set(cache_key, items)
+    return {"items": [dict(item) for item in items]}
 
-# Node 3: Image Generator (Uses selected items)
-def generate_image_node(state: RoomDesignState):
-    print("--- Generating Image ---")
 
+def option_combinations():
+    """
+    Every (style, mood, functionality, palette, clutter) choice the wizard can submit.
+    """
+    for options in catalog.combinations():
+        yield {**options, "additional_prompt": ""}
+
+
+async def prewarm_items_cache(concurrency=4):
+    """
+    Fill items_cache for every option combination without an additional prompt.
+    Runs at batch priority, so live requests are served first.
+    Returns the number of prompts newly cached.
+    """
+    combinations = list(option_combinations())
+    if len(combinations) > items_cache.max_items:
+        # Warming more than fits would only evict what was just warmed
+        logger.warning(
+            "Items cache too small to pre-warm every combination",
+            extra={"capacity": items_cache.max_items, "combinations": len(combinations)},
+        )
+        combinations = combinations[: items_cache.max_items]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(options):
+        prompt = _compose_prompt(options)
+        if _items_cache_key(prompt) in items_cache:
+            return False
+        async with semaphore:
+            result = await aselect_items({"generated_prompt": prompt})
+        return bool(result["items"])
+
+    with bedrock_priority(BATCH):
+        results = await asyncio.gather(*(warm(options) for options in combinations))
+    warmed = sum(results)
+    logger.info("Items cache pre-warmed", extra={"warmed": warmed, "prompts": len(results)})
+    return warmed
+
+
+# Node 3 helpers
+def _enhance_prompt(state: RoomDesignState):
     # Enhance prompt with selected items
     # System instructions to preserve structure
     system_instruction = (
@@ -179,50 +343,206 @@ def generate_image_node(state: RoomDesignState):
         items_str = ", ".join(item_names)
         enhanced_prompt += f" CRITICAL: The room MUST feature these key items: {items_str}."
 
-    print(f"Enhanced Prompt for Generation: {enhanced_prompt}")
+    logger.debug("Enhanced prompt for generation", extra={"prompt": enhanced_prompt})
+    return enhanced_prompt
 
-    original_bytes = state.get("original_image_bytes")
-    if not original_bytes and state.get("original_image_key"):
-        print(f"Fetching image from S3: {state['original_image_key']}")
-        original_bytes = get_file(state["original_image_key"])
 
+# Node 2b: Image Preparation (runs in parallel with select_items)
+# Preprocessed, encoded payloads stay in this process-local cache keyed by the original's
+# content hash; only the hash goes into the state, so checkpoints never carry image data.
+prepared_images = LRUCache(max_items=64, max_bytes=int(os.getenv("PREPARED_IMAGE_CACHE_BYTES", 128 * 1024 * 1024)))
+
+
+def _prepare(original_key):
+    """
+    Fetch the original image, preprocess it (orientation, downscale, metadata strip)
+    and base64-encode it for Bedrock. Returns (content_hash, encoded).
+    """
+    original_bytes = blob_store.get(original_key)
     if not original_bytes:
-        raise Exception("No original image bytes found in state or S3")
+        raise Exception("No original image found in blob store")
+
+    image_hash = hash_from_key(original_key) or content_hash(original_bytes)
+    processed = preprocess_image(original_bytes)
+    logger.debug("Preprocessed image", extra={"original_bytes": len(original_bytes), "processed_bytes": len(processed)})
+    encoded = base64.b64encode(processed)
+    prepared_images.set(image_hash, encoded)
+    return image_hash, encoded
+
+
+def prepare_image(state: RoomDesignState):
+    original_key = state.get("original_image_key")
+    if not original_key:
+        raise Exception("No original image found in blob store")
+
+    image_hash = hash_from_key(original_key)
+    if image_hash is None or image_hash not in prepared_images:
+        image_hash, _ = _prepare(original_key)
+
+    return {"original_image_hash": image_hash}
+
+
+async def aprepare_image(state: RoomDesignState):
+    # Download and encoding are both blocking; run them together on the S3 pool
+    return await run_in_executor("s3", prepare_image, state)
+
+
+# Node 3: Image Generator (Uses selected items and the prepared image)
+def _generation_cache_key(image_hash, enhanced_prompt):
+    params = {"model_id": IMAGE_MODEL_ID, "preprocess": preprocess_signature(), "catalog": catalog.cache_version, **DEFAULT_GENERATION_PARAMS}
+    return generation_cache_key(image_hash, enhanced_prompt, params)
+
+
+def _generated_filename():
+    return f"generated.{DEFAULT_GENERATION_PARAMS['output_format']}"
 
-    generated_bytes = invoke_model(enhanced_prompt, original_bytes)
 
-    if not generated_bytes:
-        raise Exception("Failed to generate image")
+def _prepared_payload(state: RoomDesignState, image_hash):
+    encoded = prepared_images.get(image_hash) if image_hash else None
+    if encoded is None:
+        # Evicted or prepared by another worker; redo it here
+        _, encoded = _prepare(state["original_image_key"])
+    return encoded
 
-    # Upload generated image
-    generated_filename = f"generated_{state['original_filename']}"
-    generated_key = upload_file(generated_bytes, generated_filename)
 
-    # Generate presigned URL
-    from services.aws_s3 import create_presigned_url
+def generate_image_node(state: RoomDesignState):
+    enhanced_prompt = _enhance_prompt(state)
+
+    original_key = state.get("original_image_key")
+    if not original_key:
+        raise Exception("No original image found in blob store")
+
+    image_hash = state.get("original_image_hash") or hash_from_key(original_key)
+    if image_hash is None:
+        image_hash, _ = _prepare(original_key)
+
+    cache_key = _generation_cache_key(image_hash, enhanced_prompt)
+    generated_key = None
+    if state.get("bypass_cache"):
+        result_cache.record_bypass()
+    else:
+        generated_key = result_cache.get(cache_key)
+
+    if generated_key:
+        logger.info("Generation cache hit", extra={"generated_key": generated_key})
+    else:
+        encoded_image = _prepared_payload(state, image_hash)
+        generated_bytes = invoke_model(enhanced_prompt, image_base64=encoded_image, **DEFAULT_GENERATION_PARAMS)
+
+        if not generated_bytes:
+            raise Exception("Failed to generate image")
+
+        # Upload generated image
+        generated_key = blob_store.put_content(generated_bytes, _generated_filename(), prefix=GENERATED_PREFIX)
+        if not generated_key:
+            raise Exception("Failed to upload generated image")
+        result_cache.set(cache_key, generated_key)
+
+    return {"generated_image_key": generated_key, "last_run": _last_run(state, image_hash)}
 
-    generated_url = create_presigned_url(generated_key)
 
-    return {"generated_image_bytes": generated_bytes, "generated_image_url": generated_url}
+async def agenerate_image_node(state: RoomDesignState):
+    enhanced_prompt = _enhance_prompt(state)
 
-    return {"generated_image_bytes": generated_bytes, "generated_image_url": generated_url}
+    original_key = state.get("original_image_key")
+    if not original_key:
+        raise Exception("No original image found in blob store")
+
+    image_hash = state.get("original_image_hash") or hash_from_key(original_key)
+    if image_hash is None:
+        image_hash, _ = await run_in_executor("s3", _prepare, original_key)
+
+    cache_key = _generation_cache_key(image_hash, enhanced_prompt)
+    generated_key = None
+    if state.get("bypass_cache"):
+        result_cache.record_bypass()
+    else:
+        generated_key = await result_cache.aget(cache_key)
+
+    if generated_key:
+        logger.info("Generation cache hit", extra={"generated_key": generated_key})
+    else:
+        encoded_image = prepared_images.get(image_hash)
+        if encoded_image is None:
+            encoded_image = await run_in_executor("s3", _prepared_payload, state, image_hash)
+        async with image_governor.admission():
+            generated_bytes = await run_in_executor("bedrock", invoke_model, enhanced_prompt, image_base64=encoded_image, **DEFAULT_GENERATION_PARAMS)
+
+        if not generated_bytes:
+            raise Exception("Failed to generate image")
+
+        # Upload generated image
+        generated_key = await blob_store.aput_content(generated_bytes, _generated_filename(), prefix=GENERATED_PREFIX)
+        if not generated_key:
+            raise Exception("Failed to upload generated image")
+        await result_cache.aset(cache_key, generated_key)
+
+    return {"generated_image_key": generated_key, "last_run": _last_run(state, image_hash)}
 
 
 # Build the Graph
+_compiled_graphs = {}
+_compiled_graphs_lock = threading.Lock()
+
+
 def get_app_graph(checkpointer=None):
-    workflow = StateGraph(RoomDesignState)
+    """
+    Return the compiled design graph for a checkpointer, compiling it only once per checkpointer.
+    """
+    key = id(checkpointer)
+    with _compiled_graphs_lock:
+        cached = _compiled_graphs.get(key)
+        if cached is None or cached[0] is not checkpointer:
+            cached = (checkpointer, _compile_graph(checkpointer))
+            _compiled_graphs[key] = cached
+    return cached[1]
+
+
+def _timed_node(name, func):
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def run(state):
+            with timed(node_seconds, f"node.{name}", node=name):
+                return await func(state)
+
+    else:
 
-    workflow.add_node("build_prompt", build_prompt)
-    workflow.add_node("select_items", select_items)
-    workflow.add_node("generate_image", generate_image_node)
+        @functools.wraps(func)
+        def run(state):
+            with timed(node_seconds, f"node.{name}", node=name):
+                return func(state)
 
-    workflow.set_entry_point("build_prompt")
-    workflow.add_edge("build_prompt", "select_items")
+    return run
+
+
+def _compile_graph(checkpointer):
+    from langchain_core.runnables import RunnableLambda
+    from langgraph.graph import END, StateGraph
+
+    workflow = StateGraph(RoomDesignState)
+
+    # Each node carries a sync and an async implementation: invoke() uses the former,
+    # ainvoke()/astream() the latter so blocking SDK calls stay off the event loop.
+    # Both are wrapped to record the node's duration in graph_node_seconds.
+    def node(name, func, afunc):
+        return RunnableLambda(_timed_node(name, func), afunc=_timed_node(name, afunc), name=name)
+
+    workflow.add_node("plan", node("plan", plan_run, aplan_run))
+    workflow.add_node("build_prompt", node("build_prompt", build_prompt, abuild_prompt))
+    workflow.add_node("select_items", node("select_items", select_items, aselect_items))
+    workflow.add_node("prepare_image", node("prepare_image", prepare_image, aprepare_image))
+    workflow.add_node("generate_image", node("generate_image", generate_image_node, agenerate_image_node))
+
+    workflow.set_entry_point("plan")
+    # plan decides which stages still have work; unchanged ones are routed around.
+    # Fan out: the Haiku call and the S3 fetch/encode run in the same step, and
+    # generate_image runs once in the step after, so latency is max(items, image) not the sum.
+    stages = ["build_prompt", *PRE_GENERATION_STAGES, "generate_image"]
+    workflow.add_conditional_edges("plan", _route_after_plan, stages)
+    workflow.add_conditional_edges("build_prompt", _route_after_prompt, stages[1:])
     workflow.add_edge("select_items", "generate_image")
+    workflow.add_edge("prepare_image", "generate_image")
     workflow.add_edge("generate_image", END)
 
     return workflow.compile(checkpointer=checkpointer)
-
-
-# Default compilation for backward compatibility or testing without persistence
-app_graph = get_app_graph()
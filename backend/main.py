@@ -1,63 +1,194 @@
+import asyncio
+import functools
+import json
+import logging
 import os
+import time
 import uuid
 from contextlib import asynccontextmanager
 from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from langgraph.checkpoint.mongodb import MongoDBSaver
-from pymongo import MongoClient
-
-from graph import get_app_graph
-from services.aws_s3 import create_presigned_url, upload_file
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pymongo import AsyncMongoClient, MongoClient
+
+from graph import aprepare_image, get_app_graph, items_cache, prewarm_items_cache, warm_items_llm
+from services.aws_clients import init_clients
+from services.bedrock_governor import BATCH, ModelBusy, bedrock_priority, governor_stats
+from services.blob_store import MAX_UPLOAD_BYTES, UploadTooLarge, blob_store
+from services.catalog import FIELDS, InvalidOptions, catalog
+from services.derivatives import derivatives
+from services.executors import run_in_executor, shutdown_executors
+from services.jobs import QueueFull, create_job_queue
+from services.mongo import DB_NAME, MONGODB_URI, client_options
+from services.result_cache import MongoResultStore, result_cache
+from services.retention import MongoRetentionBackend, create_retention
+from services.session_store import MongoSessionStore, session_summaries, session_summary
+from services.single_flight import MongoLeaseStore, generation_key, single_flight
+from services.url_signer import url_signer
+from utils import startup_profile
+from utils.log import configure_logging
+from utils.metrics import collect_timings, histogram, registry, server_timing_header
+from utils.startup_profile import phase
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
+
+http_seconds = histogram("http_request_seconds", "HTTP request duration, to the end of the response headers", ("method", "route", "status"))
+
+# SERVER_TIMING=1 lets a client ask for a per-request Server-Timing breakdown with "X-Server-Timing: 1"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+# Batch generation limits (POST /generate/batch)
+BATCH_MAX_VARIANTS = int(os.getenv("BATCH_MAX_VARIANTS", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+PREFERENCE_FIELDS = FIELDS
 
-# MongoDB Setup
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-DB_NAME = "room_designer"
+# Room for the multipart boundaries and the non-file form fields around an upload
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup (Sync client)
-    client = MongoClient(MONGODB_URI)
-    db = client[DB_NAME]
+    with phase("mongo clients"):
+        # Sync client: only used from the executors (result cache, session summaries, retention)
+        client = MongoClient(MONGODB_URI, **client_options())
+        db = client[DB_NAME]
+        # Async client: checkpoints are read and written on the event loop without blocking it
+        async_client = AsyncMongoClient(MONGODB_URI, **client_options())
+
+    # Checkpoint retention: MongoDBSaver keeps every checkpoint and write, and a TTL index on
+    # "ts" never fires (it is stored inside the serialized checkpoint, not as a BSON date).
+    # A background pass trims each thread to its last checkpoints and drops idle threads.
+    app.state.retention = create_retention(MongoRetentionBackend(db["checkpoints"], db["checkpoint_writes"]))
+    retention_interval = int(os.getenv("CHECKPOINT_RETENTION_INTERVAL_SECONDS", 600))
+    retention_task = asyncio.create_task(app.state.retention.run_forever(retention_interval)) if retention_interval > 0 else None
+
+    # Generation results are shared across workers through Mongo
+    result_store = MongoResultStore(db["generation_cache"], ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60)))
+    result_cache.persistent = result_store
+
+    # Small per-thread summaries back the /session read path
+    session_store = MongoSessionStore(db["session_summaries"])
+    session_summaries.store = session_store
+
+    # Leases that let one worker run a generation while its duplicates wait for the result
+    lease_store = MongoLeaseStore(db["generation_leases"])
+    single_flight.store = lease_store
+
+    # Build the pooled AWS clients once; every service call reuses them
+    with phase("aws clients"):
+        init_clients()
+
+    # Imported here rather than at the top: it pulls in langgraph and langchain_core
+    from services.checkpointer import AsyncMongoDBSaver
+
+    checkpointer = AsyncMongoDBSaver(async_client, db_name=DB_NAME)
+
+    # Initialize the graph with the checkpointer (the only compilation in the process)
+    with phase("graph compile"):
+        app.state.graph = get_app_graph(checkpointer)
+    app.state.mongo_client = client
+    app.state.async_mongo_client = async_client
 
-    # Set 1-day TTL index on checkpoints collection
-    # The 'ts' field is usually used by LangGraph for timestamps, or we can use a custom createdAt if needed.
-    # LangGraph checkpoints usually have a 'ts' (timestamp) field in the 'checkpoints' collection.
-    try:
-        # Ensure index on 'ts' field with expireAfterSeconds
-        # 1 day = 24 * 60 * 60 = 86400 seconds
-        db["checkpoints"].create_index("ts", expireAfterSeconds=86400)
-    except Exception as e:
-        # Check if it is an IndexOptionsConflict (code 85)
-        # We need to import OperationFailure to check properly or check the code attribute safely
-        if hasattr(e, "code") and e.code == 85:
-            print("IndexOptionsConflict detected. Dropping old index and recreating...")
-            db["checkpoints"].drop_index("ts_1")
-            db["checkpoints"].create_index("ts", expireAfterSeconds=86400)
-            print("TTL index recreated successfully.")
-        else:
-            print(f"Warning: Could not create TTL index: {e}")
+    # Index management is off the startup path; /ready reports when it has finished
+    app.state.startup = {"indexes": "pending"}
+    index_task = asyncio.create_task(ensure_indexes(app.state.startup, checkpointer, [result_store, session_store, lease_store]))
 
-    checkpointer = MongoDBSaver(client, db_name=DB_NAME)
+    # Optionally fill the select_items memo for every option combination in the background
+    prewarm_task = None
+    if os.getenv("PREWARM_ITEMS_CACHE", "").lower() in ("1", "true", "yes"):
+        prewarm_task = asyncio.create_task(prewarm_items_cache(concurrency=int(os.getenv("PREWARM_ITEMS_CONCURRENCY", 4))))
+    elif os.getenv("WARM_ITEMS_MODEL", "true").lower() in ("1", "true", "yes"):
+        # langchain_aws is imported lazily; load it after startup instead of on the first request
+        prewarm_task = asyncio.create_task(run_in_executor("bedrock", warm_items_llm))
 
-    # Initialize the graph with the checkpointer
-    app.state.graph = get_app_graph(checkpointer)
-    app.state.mongo_client = client
+    # Background generation jobs (POST /generate with async_job=true)
+    with phase("job queue"):
+        app.state.job_queue = create_job_queue()
+        await app.state.job_queue.start(run_generation)
+
+    if startup_profile.ENABLED:
+        startup_profile.report()
 
     yield
 
     # Shutdown
+    await app.state.job_queue.stop()
+    derivatives.cancel()
+    if prewarm_task:
+        prewarm_task.cancel()
+    if retention_task:
+        retention_task.cancel()
+    index_task.cancel()
+    await async_client.close()
     client.close()
+    shutdown_executors(wait=False)
+
+
+async def ensure_indexes(status, checkpointer, stores):
+    """
+    Create the checkpoint and store indexes in the background. A failure is reported
+    by /ready but doesn't stop the app: queries still work, only slower.
+    """
+    errors = []
+    try:
+        await checkpointer.setup()
+    except Exception as e:
+        errors.append(f"checkpoints: {e}")
+    for store in stores:
+        try:
+            await run_in_executor("mongo", store.ensure_indexes)
+        except Exception as e:
+            errors.append(f"{type(store).__name__}: {e}")
+
+    for error in errors:
+        logger.warning("Could not create index: %s", error)
+    status["indexes"] = "failed" if errors else "ok"
 
 
 app = FastAPI(lifespan=lifespan)
 
-# CORS Configuration
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """
+    Refuse a body whose declared size is already over the upload limit, before the
+    multipart parser spools it. Bodies without Content-Length are checked while hashing.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+        return JSONResponse(status_code=413, content={"detail": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit"})
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """
+    Record every request in http_request_seconds, labelled by route template.
+    With SERVER_TIMING on, "X-Server-Timing: 1" adds a Server-Timing header breaking the
+    request down by graph node, S3, Bedrock and checkpoint call. Streaming responses
+    only include what finished before their headers were sent.
+    """
+    timings = collect_timings() if SERVER_TIMING and request.headers.get("x-server-timing") == "1" else None
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    http_seconds.observe(elapsed, method=request.method, route=route.path if route else "unmatched", status=response.status_code)
+    if timings is not None:
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+
+# CORS Configuration. Added last so it wraps the middleware above: their early
+# responses (413s) need the CORS headers too, or the browser hides them.
 origins = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -72,41 +203,155 @@ app.add_middleware(
 )
 
 
+async def store_upload(file):
+    """
+    Stream an UploadFile to S3 under its content hash. Raises 413 over the size limit.
+    """
+    try:
+        uploaded_key = await blob_store.aput_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not uploaded_key:
+        raise HTTPException(status_code=500, detail="Failed to upload image to S3")
+    return uploaded_key
+
+
 @app.get("/")
 def read_root():
     return {"message": "AI Room Designer API is running"}
 
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: Mongo answers a ping and startup index management has finished.
+    """
+    checks = {"indexes": app.state.startup["indexes"]}
+    try:
+        await asyncio.wait_for(app.state.async_mongo_client.admin.command("ping"), timeout=float(os.getenv("READY_TIMEOUT_SECONDS", 2)))
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = f"error: {e!r}"
+
+    is_ready = checks["mongo"] == "ok" and checks["indexes"] != "pending"
+    return JSONResponse(status_code=200 if is_ready else 503, content={"status": "ready" if is_ready else "not_ready", "checks": checks})
+
+
 @app.post("/init-session")
 async def init_session(file: UploadFile = File(...)):
     try:
         thread_id = str(uuid.uuid4())
 
-        file_content = await file.read()
-        object_key = f"{thread_id}-{file.filename}"
-
-        uploaded_key = upload_file(file_content, object_key)
-        if not uploaded_key:
-            raise HTTPException(status_code=500, detail="Failed to upload image to S3")
+        # Content-addressed: re-uploading the same photo reuses the stored object
+        uploaded_key = await store_upload(file)
 
-        original_url = create_presigned_url(uploaded_key)
+        original_url = await url_signer.aurl(uploaded_key)
         if not original_url:
             raise HTTPException(status_code=500, detail="Failed to generate presigned URL")
 
-        # Initialize state in LangGraph
+        # Initialize state in LangGraph (only the key is stored; URLs are minted per response)
         config = {"configurable": {"thread_id": thread_id}}
-        initial_state = {"original_image_url": original_url, "original_image_key": uploaded_key, "user_preferences": {}}
+        initial_state = {"original_image_key": uploaded_key, "user_preferences": {}}
 
         # Update state directly (just save it)
-        app.state.graph.update_state(config, initial_state)
+        await app.state.graph.aupdate_state(config, initial_state)
+        await save_session_summary(thread_id)
 
         return {"thread_id": thread_id, "original_url": original_url}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in /init-session: {e}")
+        logger.exception("Error in /init-session")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def resolve_original(file, thread_id):
+    """
+    Find the source image for a request: the uploaded file if any, else the session's.
+    Returns (thread_id, original_key, original_filename).
+    """
+    # Use provided thread_id or generate new
+    final_thread_id = thread_id or str(uuid.uuid4())
+    config = {"configurable": {"thread_id": final_thread_id}}
+
+    legacy_url = None
+    original_key = None
+    # Check for existing state if no file provided
+    current_state = (await app.state.graph.aget_state(config)).values
+    if current_state:
+        legacy_url = current_state.get("original_image_url")
+        original_key = current_state.get("original_image_key")
+
+    # If file provided, upload and update (override)
+    if file:
+        # Stream the file to S3 under its content hash; a byte-identical re-send is not re-PUT
+        original_key = await store_upload(file)
+
+    # Fallback: If we have URL but no Key (legacy session), try to extract key
+    if legacy_url and not original_key:
+        try:
+            # URL format expected: https://<bucket>.s3.<region>.amazonaws.com/<key>?...
+            # or https://s3.<region>.amazonaws.com/<bucket>/<key>?...
+            from urllib.parse import urlparse
+
+            path = urlparse(legacy_url).path
+            # Remove leading slash
+            if path.startswith("/"):
+                path = path[1:]
+            # If path contains bucket name (second format), we might need logic,
+            # but usually boto3 generates virtual-hosted style by default.
+            # Let's assume the key is the path.
+
+            # Check if it looks like a valid key (uuid-filename)
+            # Just use it as best guess
+            original_key = path
+            logger.info("Fallback: extracted key from URL", extra={"key": original_key})
+        except Exception as e:
+            logger.warning("Failed to extract key from URL: %s", e)
+
+    if not original_key:
+        raise HTTPException(status_code=400, detail="No image provided or found in session.")
+
+    return final_thread_id, original_key, file.filename if file else "restored_image.jpg"
+
+
+def validate_options(options, loc=("body",)):
+    """
+    Check options against the catalog; raises 422 in FastAPI's validation error format.
+    """
+    try:
+        catalog.validate(options)
+    except InvalidOptions as e:
+        detail = [{"loc": [*loc, field], "msg": message, "type": "value_error"} for field, message in e.errors.items()]
+        raise HTTPException(status_code=422, detail=detail)
+
+
+async def prepare_generation(file, style, mood, functionality, palette, clutter, additional_prompt, thread_id, bypass_cache):
+    """
+    Resolve the session and source image for a generation request and build the graph inputs.
+    Returns (thread_id, initial_state). Shared by /generate and /generate/stream.
+    """
+    # Reject unknown options before anything is uploaded or generated
+    validate_options({"style": style, "mood": mood, "functionality": functionality, "palette": palette, "clutter": clutter})
+    final_thread_id, original_key, original_filename = await resolve_original(file, thread_id)
+
+    # Prepare Inputs (image bytes stay in the blob store, only the key goes into state)
+    initial_state = {
+        "original_image_key": original_key,
+        "original_filename": original_filename,
+        "style": style,
+        "mood": mood,
+        "functionality": functionality,
+        "palette": palette,
+        "clutter": clutter,
+        "additional_prompt": additional_prompt,
+        "bypass_cache": bypass_cache,
+        "items": [],  # Initialize empty items list if needed by TypedDict, though Optional would be better
+    }
+    return final_thread_id, initial_state
+
+
 @app.post("/generate")
 async def generate_room(
     file: Optional[UploadFile] = File(None),
@@ -117,108 +362,435 @@ async def generate_room(
     clutter: str = Form(...),
     additional_prompt: str = Form(""),
     thread_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+    async_job: bool = Form(False),
 ):
     try:
-        # Use provided thread_id or generate new
-        final_thread_id = thread_id or str(uuid.uuid4())
-        config = {"configurable": {"thread_id": final_thread_id}}
-
-        original_url = None
-        original_key = None
-        # Check for existing state if no file provided
-        current_state = app.state.graph.get_state(config).values
-        if current_state:
-            original_url = current_state.get("original_image_url")
-            original_key = current_state.get("original_image_key")
-
-        # If file provided, upload and update (override)
-        file_bytes = None
-        if file:
-            file_bytes = await file.read()
-            # Generate a unique key for the S3 object
-            object_key = f"{uuid.uuid4()}-{file.filename}"
-
-            # Upload the file to S3
-            uploaded_key = upload_file(file_bytes, object_key)
-            if not uploaded_key:
-                raise HTTPException(status_code=500, detail="Failed to upload image to S3")
-
-            # Generate presigned URL for the newly uploaded image
-            original_url = create_presigned_url(uploaded_key)
-            original_key = uploaded_key
-
-        if not original_url:
-            raise HTTPException(status_code=400, detail="No image provided or found in session.")
+        final_thread_id, initial_state = await prepare_generation(
+            file, style, mood, functionality, palette, clutter, additional_prompt, thread_id, bypass_cache
+        )
 
-        # Fallback: If we have URL but no Key (legacy session), try to extract key
-        if original_url and not original_key:
+        if async_job:
+            # Job mode: hand the graph run to the worker pool and answer immediately
             try:
-                # URL format expected: https://<bucket>.s3.<region>.amazonaws.com/<key>?...
-                # or https://s3.<region>.amazonaws.com/<bucket>/<key>?...
-                from urllib.parse import urlparse
-
-                path = urlparse(original_url).path
-                # Remove leading slash
-                if path.startswith("/"):
-                    path = path[1:]
-                # If path contains bucket name (second format), we might need logic,
-                # but usually boto3 generates virtual-hosted style by default.
-                # Let's assume the key is the path.
-
-                # Check if it looks like a valid key (uuid-filename)
-                # Just use it as best guess
-                original_key = path
-                print(f"Fallback: Extracted key from URL: {original_key}")
-            except Exception as e:
-                print(f"Failed to extract key from URL: {e}")
-
-        # Prepare Inputs
-        # Prepare Inputs
-        initial_state = {
-            "original_image_url": original_url,
-            "original_image_key": original_key,
-            "original_filename": file.filename if file else "restored_image.jpg",
-            "style": style,
-            "mood": mood,
-            "functionality": functionality,
-            "palette": palette,
-            "clutter": clutter,
-            "additional_prompt": additional_prompt,
-            "items": [],  # Initialize empty items list if needed by TypedDict, though Optional would be better
-        }
+                job_id = await app.state.job_queue.submit(final_thread_id, initial_state)
+            except QueueFull as e:
+                return JSONResponse(
+                    status_code=503,
+                    content={"detail": "Generation queue is full, retry later"},
+                    headers={"Retry-After": str(e.retry_after)},
+                )
+            return JSONResponse(
+                status_code=202,
+                content={"job_id": job_id, "status": "queued", "thread_id": final_thread_id, "status_url": f"/jobs/{job_id}"},
+            )
+
+        return await run_generation(final_thread_id, initial_state)
+
+    except HTTPException:
+        raise
+    except ModelBusy as e:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Image model is busy, retry later"},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except Exception as e:
+        logger.exception("Error in /generate")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if file_bytes:
-            initial_state["original_image_bytes"] = file_bytes
 
-        print(f"Invoking LangGraph with thread_id: {final_thread_id} ...")
+@app.post("/generate/stream")
+async def generate_room_stream(
+    file: Optional[UploadFile] = File(None),
+    style: str = Form(...),
+    mood: str = Form(...),
+    functionality: str = Form(...),
+    palette: str = Form(...),
+    clutter: str = Form(...),
+    additional_prompt: str = Form(""),
+    thread_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+):
+    """
+    Same inputs as /generate, answered as Server-Sent Events emitted while the graph runs:
+    started, prompt_built, items_selected, generation_started, image_ready, done (or error).
+    """
+    try:
+        final_thread_id, initial_state = await prepare_generation(
+            file, style, mood, functionality, palette, clutter, additional_prompt, thread_id, bypass_cache
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in /generate/stream")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Use invoke (sync)
-        # Since this is a FastAPI async route, blocking calls will block the event loop.
-        # Ideally we run this in a threadpool, but for now strict sync invocation is consistent with existing code.
-        result = app.state.graph.invoke(initial_state, config=config)
-        print("LangGraph finished.")
+    return StreamingResponse(
+        generation_events(final_thread_id, initial_state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def generation_events(thread_id, initial_state):
+    """
+    Translate graph node updates into SSE events. Only whitelisted, JSON-safe fields
+    are forwarded, so nothing from the state (e.g. image data) leaks into the stream.
+    A duplicate of a generation already in flight waits for it and only gets "done".
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    original_key = initial_state["original_image_key"]
+    yield _sse("started", {"thread_id": thread_id, "original_url": await url_signer.aurl(original_key)})
+
+    events = asyncio.Queue()
+
+    async def produce():
+        # Stages the planner skipped count as finished; their reused outputs arrive with "plan"
+        finished = set()
+        final = {}
+        started = False
+        async for update in app.state.graph.astream(initial_state, config=config, stream_mode="updates"):
+            for node, values in update.items():
+                values = values or {}
+                final.update(values)
+                finished.add(node)
+
+                if node == "plan":
+                    finished.update(values.get("skipped_stages", []))
+                if node in ("plan", "build_prompt") and "generated_prompt" in values:
+                    events.put_nowait(_sse("prompt_built", {"prompt": values.get("generated_prompt")}))
+                if node in ("plan", "select_items") and "items" in values:
+                    events.put_nowait(_sse("items_selected", {"items": values.get("items", [])}))
+                if node == "generate_image":
+                    events.put_nowait(_sse("image_ready", {"generated_url": await url_signer.aurl(values.get("generated_image_key"))}))
+
+                # generate_image starts as soon as the prompt and both parallel branches are in
+                if not started and node != "generate_image" and {"build_prompt", "select_items", "prepare_image"} <= finished:
+                    started = True
+                    events.put_nowait(_sse("generation_started", {}))
+
+        await save_session_summary(thread_id)
+        return generation_outcome(initial_state, final)
+
+    run = asyncio.create_task(single_flight.run(generation_key(thread_id, initial_state), produce))
+    try:
+        while not run.done():
+            next_event = asyncio.create_task(events.get())
+            await asyncio.wait({run, next_event}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                yield next_event.result()
+            else:
+                next_event.cancel()
+        while not events.empty():
+            yield events.get_nowait()
+
+        yield _sse("done", await generation_response(thread_id, run.result()))
+    except ModelBusy as e:
+        yield _sse("error", {"detail": "Image model is busy, retry later", "retry_after": e.retry_after})
+    except Exception as e:
+        logger.exception("Error in /generate/stream")
+        yield _sse("error", {"detail": str(e)})
+    finally:
+        # Client went away: the run stops unless a duplicate request is still waiting on it
+        run.cancel()
 
-        return {"original_url": original_url, "generated_url": result["generated_image_url"], "items": result["items"], "thread_id": final_thread_id}
 
+@app.post("/generate/batch")
+async def generate_room_batch(
+    file: Optional[UploadFile] = File(None),
+    variants: str = Form(...),
+    additional_prompt: str = Form(""),
+    thread_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False),
+):
+    """
+    Generate several designs of the same room in one request.
+    variants is a JSON list of preference sets ({"style", "mood", "functionality", "palette",
+    "clutter"} and optionally "additional_prompt"). The image is uploaded and preprocessed
+    once, then up to BATCH_MAX_CONCURRENCY graphs run at a time, each on its own thread
+    ("<thread_id>-v<index>"). Results are streamed as Server-Sent Events as they finish:
+    started, variant_ready / variant_error per variant, then done. The base thread's
+    session lists the variant threads.
+    """
+    preference_sets = parse_variants(variants)
+
+    try:
+        final_thread_id, original_key, original_filename = await resolve_original(file, thread_id)
+        await link_variant_threads(final_thread_id, original_key, len(preference_sets))
+        # Fetch, preprocess and encode the photo once; every variant's prepare_image then hits the cache
+        await aprepare_image({"original_image_key": original_key})
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in /generate: {e}")
+        logger.exception("Error in /generate/batch")
         raise HTTPException(status_code=500, detail=str(e))
 
+    base_state = {
+        "original_image_key": original_key,
+        "original_filename": original_filename,
+        "additional_prompt": additional_prompt,
+        "bypass_cache": bypass_cache,
+        "items": [],
+    }
+    return StreamingResponse(
+        batch_events(final_thread_id, base_state, preference_sets),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def link_variant_threads(thread_id, original_key, count):
+    """
+    Record a batch's variant threads in its base thread's session summary. The graph
+    only runs on the variant threads, so without this a batch started without a
+    thread_id would hand back a base thread that /session has never heard of.
+    """
+    summary = await session_summaries.aget(thread_id)
+    if summary is None:
+        snapshot = await app.state.graph.aget_state({"configurable": {"thread_id": thread_id}})
+        if snapshot.values:
+            summary = session_summary(thread_id, snapshot)
+        else:
+            summary = {"thread_id": thread_id, "checkpoint_id": None, "original_image_key": original_key, "generated_image_key": None, "items": []}
+    summary["variant_thread_ids"] = [f"{thread_id}-v{index}" for index in range(count)]
+    await session_summaries.aset(summary)
 
-@app.get("/session/{thread_id}")
-async def get_session(thread_id: str):
+
+def parse_variants(variants):
+    """
+    Validate the variants form field; raises 400 on anything that is not a usable list
+    and 422 on options the catalog doesn't know.
+    """
     try:
-        config = {"configurable": {"thread_id": thread_id}}
-        snapshot = app.state.graph.get_state(config)
+        preference_sets = json.loads(variants)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="variants must be a JSON list")
+
+    if not isinstance(preference_sets, list) or not preference_sets:
+        raise HTTPException(status_code=400, detail="variants must be a non-empty JSON list")
+    if len(preference_sets) > BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_VARIANTS} variants per batch")
+
+    for index, preferences in enumerate(preference_sets):
+        if not isinstance(preferences, dict):
+            raise HTTPException(status_code=400, detail=f"Variant {index} must be an object")
+        missing = [field for field in PREFERENCE_FIELDS if not isinstance(preferences.get(field), str)]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Variant {index} is missing {', '.join(missing)}")
+        validate_options(preferences, loc=("body", "variants", index))
+    return preference_sets
+
+
+async def batch_events(thread_id, base_state, preference_sets):
+    original_url = await url_signer.aurl(base_state["original_image_key"])
+    yield _sse("started", {"thread_id": thread_id, "original_url": original_url, "variants": len(preference_sets)})
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run_variant(index, preferences):
+        variant_state = {**base_state, **{field: preferences[field] for field in PREFERENCE_FIELDS}}
+        if preferences.get("additional_prompt"):
+            variant_state["additional_prompt"] = preferences["additional_prompt"]
+        async with semaphore:
+            try:
+                result = await run_generation(f"{thread_id}-v{index}", variant_state)
+                return index, result, None
+            except Exception as e:
+                logger.warning("Error in batch variant: %s", e, extra={"thread_id": thread_id, "variant": index})
+                return index, None, str(e)
+
+    # Variants queue for Bedrock behind single /generate requests
+    with bedrock_priority(BATCH):
+        tasks = [asyncio.create_task(run_variant(index, preferences)) for index, preferences in enumerate(preference_sets)]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result, error = await next_done
+            if error is None:
+                succeeded += 1
+                yield _sse("variant_ready", {"index": index, "preferences": preference_sets[index], **result})
+            else:
+                yield _sse("variant_error", {"index": index, "detail": error})
+        yield _sse("done", {"thread_id": thread_id, "succeeded": succeeded, "failed": len(tasks) - succeeded})
+    finally:
+        # Client went away mid-stream: don't keep generating images nobody will see
+        for task in tasks:
+            task.cancel()
+
+
+async def mint_urls(original_key, generated_key):
+    """
+    Presigned URLs for a response's original and generated images, signed together.
+    """
+    signed = await url_signer.asign([original_key, generated_key])
+    return tuple(signed[key][0] if key in signed else None for key in (original_key, generated_key))
+
+
+async def derivative_urls(keys):
+    """
+    display_url and thumbnail_url for a generated image's derivative keys; None until they exist.
+    """
+    if not keys:
+        return {"display_url": None, "thumbnail_url": None}
+    signed = await url_signer.asign(keys.values())
+    return {f"{name}_url": signed[key][0] if key in signed else None for name, key in keys.items()}
+
+
+def generation_outcome(initial_state, result):
+    """
+    What a finished generation is remembered by: keys and items only, so it can be
+    shared through the lease store and re-signed for every caller.
+    """
+    return {
+        "original_image_key": initial_state["original_image_key"],
+        "generated_image_key": result.get("generated_image_key"),
+        "items": result.get("items", []),
+        "skipped_stages": result.get("skipped_stages", []),
+    }
+
+
+async def generation_response(thread_id, outcome):
+    # Display copies are encoded in the background; a repeat of an earlier image already has them.
+    # Either way their keys end up in the thread's session summary for /session to serve.
+    generated_key = outcome["generated_image_key"]
+    derivatives.schedule(generated_key, on_ready=functools.partial(session_summaries.aset_derivatives, thread_id, generated_key))
+
+    original_url, generated_url = await mint_urls(outcome["original_image_key"], generated_key)
+    return {
+        "original_url": original_url,
+        "generated_url": generated_url,
+        **await derivative_urls(derivatives.lookup(generated_key)),
+        "items": outcome["items"],
+        "skipped_stages": outcome.get("skipped_stages", []),
+        "thread_id": thread_id,
+    }
+
+
+async def run_generation(thread_id, initial_state):
+    """
+    Run the design graph for prepared inputs and shape the /generate response.
+    Used inline by /generate, by batch variants and by the job queue workers.
+    Identical requests (same thread, options and image) share one run, on any worker.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+
+    async def produce():
+        logger.debug("Invoking graph", extra={"thread_id": thread_id})
+        # The async nodes push every blocking SDK call onto the bounded executors,
+        # so other requests keep being served while this generation is in flight.
+        result = await app.state.graph.ainvoke(initial_state, config=config)
+        await save_session_summary(thread_id)
+        return generation_outcome(initial_state, result)
+
+    outcome = await single_flight.run(generation_key(thread_id, initial_state), produce)
+    return await generation_response(thread_id, outcome)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await app.state.job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/catalog")
+def get_catalog(if_none_match: Optional[str] = Header(None)):
+    """
+    The wizard's fields and options, so the frontend doesn't have to hard-code them.
+    Prompt fragments stay server-side.
+    """
+    etag = f'"{catalog.cache_version}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=catalog.public(), headers=headers)
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus text exposition of the latency, size and throttle histograms.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "generation": result_cache.stats(),
+        "items": items_cache.stats(),
+        "jobs": app.state.job_queue.stats(),
+        "checkpoint_retention": app.state.retention.stats(),
+        "derivatives": derivatives.stats(),
+        "single_flight": single_flight.stats(),
+        "bedrock": governor_stats(),
+    }
+
+
+async def save_session_summary(thread_id):
+    """
+    Refresh the thread's /session summary from its latest checkpoint.
+    Runs once per write to the thread, so session reads never have to load a checkpoint.
+    """
+    try:
+        snapshot = await app.state.graph.aget_state({"configurable": {"thread_id": thread_id}})
+        if snapshot.values:
+            derived = derivatives.lookup(snapshot.values.get("generated_image_key"))
+            await session_summaries.aset(session_summary(thread_id, snapshot, derived))
+    except Exception as e:
+        logger.warning("Could not save session summary: %s", e, extra={"thread_id": thread_id})
 
-        if not snapshot.values:
-            raise HTTPException(status_code=404, detail="Session not found")
 
-        values = snapshot.values
-        return {
-            "original_url": values.get("original_image_url"),
-            "generated_url": values.get("generated_image_url"),
-            "items": values.get("items", []),
+@app.get("/session/{thread_id}")
+async def get_session(thread_id: str, if_none_match: Optional[str] = Header(None)):
+    try:
+        summary = await session_summaries.aget(thread_id)
+
+        if summary is None:
+            # Sessions written before summaries existed: read the checkpoint once and backfill
+            snapshot = await app.state.graph.aget_state({"configurable": {"thread_id": thread_id}})
+            if not snapshot.values:
+                raise HTTPException(status_code=404, detail="Session not found")
+            summary = session_summary(thread_id, snapshot)
+            await session_summaries.aset(summary)
+
+        # Taken before signing: the URLs signed below are from this epoch or a later one
+        epoch = url_signer.epoch()
+        # Re-mint on read; the stored URLs only exist for legacy sessions without keys
+        keys = {"original_url": summary.get("original_image_key"), "generated_url": summary.get("generated_image_key")}
+        # WebP/AVIF display copy and thumbnail, recorded once the background stage stored them
+        derived = summary.get("derivative_keys") or {}
+        keys.update({f"{name}_url": key for name, key in derived.items()})
+        signed = await url_signer.asign(keys.values())
+        urls = {
+            "original_url": signed[keys["original_url"]][0] if keys["original_url"] in signed else summary.get("original_image_url"),
+            "generated_url": signed[keys["generated_url"]][0] if keys["generated_url"] in signed else summary.get("generated_image_url"),
+            "display_url": signed.get(keys.get("display_url"), (None,))[0],
+            "thumbnail_url": signed.get(keys.get("thumbnail_url"), (None,))[0],
         }
+
+        headers = {"Cache-Control": "no-cache"}
+        if summary.get("checkpoint_id"):
+            # The tag changes with the signing epoch, so a 304 never keeps a client on a dead link
+            # (every worker agrees on it, unlike the expiry of the URLs it happened to mint),
+            # and when the derivatives appear, so clients switch to them
+            suffix = "-d" if derived else ""
+            etag = f'"{summary["checkpoint_id"]}-{epoch}{suffix}"'
+            headers["ETag"] = etag
+            if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                return Response(status_code=304, headers=headers)
+
+        content = {**urls, "items": summary.get("items", [])}
+        if summary.get("variant_thread_ids"):
+            content["variant_thread_ids"] = summary["variant_thread_ids"]
+        return JSONResponse(content=content, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,55 +1,62 @@
-import base64
-import json
+import logging
 import os
 
-import boto3
+from services.aws_clients import get_client
+from services.bedrock_codec import decode_response, encode_request
+from services.bedrock_governor import ModelBusy, ModelGovernor
+from utils.metrics import SIZE_BUCKETS, histogram
 
+logger = logging.getLogger(__name__)
 
-def invoke_model(prompt, image_bytes):
+bedrock_payload_bytes = histogram(
+    "bedrock_payload_bytes", "Image request body and generated image sizes", ("model", "direction"), buckets=SIZE_BUCKETS
+)
+
+IMAGE_MODEL_ID = "stability.sd3-5-large-v1:0"
+
+# SD3.5 Large has a low per-account quota; keep under it instead of bouncing off it
+image_governor = ModelGovernor(
+    IMAGE_MODEL_ID,
+    requests_per_minute=int(os.getenv("IMAGE_MODEL_RPM", 30)),
+    max_concurrency=int(os.getenv("IMAGE_MODEL_MAX_CONCURRENCY", 4)),
+    max_wait=float(os.getenv("IMAGE_MODEL_MAX_WAIT_SECONDS", 60)),
+)
+
+# Generation parameters sent with every request; also part of the result cache key
+DEFAULT_GENERATION_PARAMS = {
+    "strength": 0.7,  # Control strength of the prompt vs original image (0.0 to 1.0)
+    "output_format": "png",
+}
+
+
+def invoke_model(prompt, image_bytes=None, strength=0.7, output_format="png", image_base64=None):
     """
     Invokes the Bedrock model (Stable Diffusion 3.5 Large) to generate an image.
+    Pass image_base64 (ASCII bytes) to reuse an image that was already encoded.
+    Raises ModelBusy when Bedrock keeps throttling; other failures return None.
     """
-    bedrock_runtime = boto3.client(
-        "bedrock-runtime",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("BEDROCK_REGION", os.getenv("AWS_REGION")),
-    )
-
-    model_id = "stability.sd3-5-large-v1:0"
-
-    # Encode image to base64
-    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    bedrock_runtime = get_client("bedrock-runtime")
 
-    # Payload for Stable Diffusion 3.5 Large
-    payload = {
-        "prompt": prompt,
-        "image": base64_image,
-        "strength": 0.7,  # Control strength of the prompt vs original image (0.0 to 1.0)
-        "output_format": "png",
-    }
+    model_id = IMAGE_MODEL_ID
 
-    body = json.dumps(payload)
+    # Build the request body in a single buffer, encoding the image in place
+    body = encode_request(prompt, image_bytes=image_bytes, image_base64=image_base64, strength=strength, output_format=output_format)
+    bedrock_payload_bytes.observe(len(body), model=model_id, direction="request")
 
     try:
-        response = bedrock_runtime.invoke_model(body=body, modelId=model_id, accept="application/json", contentType="application/json")
-
-        response_body = json.loads(response.get("body").read())
-
-        # SD3.5 response usually contains 'images' list with base64 strings
-        # Check documentation or response structure if different
-        # Based on typical Stability API on Bedrock:
-        if "images" in response_body:
-            base64_generated_image = response_body["images"][0]
-        elif "artifacts" in response_body:  # Fallback for older/different formats
-            base64_generated_image = response_body.get("artifacts")[0].get("base64")
-        else:
-            # Fallback or direct bytes? SD3 usually returns 'images'
-            # Let's assume 'images' for now based on recent updates
-            base64_generated_image = response_body.get("images")[0]
-
-        return base64.b64decode(base64_generated_image)
-
-    except Exception as e:
-        print(f"Error invoking Bedrock model: {e}")
+        response = image_governor.call(
+            bedrock_runtime.invoke_model, body=body, modelId=model_id, accept="application/json", contentType="application/json"
+        )
+
+        # Stream the response and decode images[0] incrementally instead of
+        # materializing the full JSON text, the parsed string and the decoded bytes at once
+        image = decode_response(response.get("body"))
+        if image is not None:
+            bedrock_payload_bytes.observe(len(image), model=model_id, direction="response")
+        return image
+
+    except ModelBusy:
+        raise
+    except Exception:
+        logger.exception("Error invoking Bedrock model", extra={"model": model_id})
         return None
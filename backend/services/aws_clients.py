@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per-service defaults. SD3.5 image-to-image can take well over a minute,
+# so the Bedrock runtime gets a longer read timeout than S3. Bedrock throttling is
+# retried by services.bedrock_governor, so botocore only retries it once itself.
+_SERVICE_DEFAULTS = {
+    "s3": {"region_env": "AWS_REGION", "read_timeout": 30},
+    "bedrock-runtime": {"region_env": "BEDROCK_REGION", "read_timeout": 120, "max_attempts": 1},
+}
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _env_prefix(service):
+    return service.split("-")[0].upper()
+
+
+def _client_config(service):
+    """
+    Build the botocore Config for a service. Every knob can be overridden globally
+    (AWS_MAX_POOL_CONNECTIONS) or per service (S3_MAX_POOL_CONNECTIONS, BEDROCK_READ_TIMEOUT, ...).
+    """
+    prefix = _env_prefix(service)
+    defaults = _SERVICE_DEFAULTS.get(service, {})
+
+    def setting(name, default):
+        return os.getenv(f"{prefix}_{name}", os.getenv(f"AWS_{name}", default))
+
+    return Config(
+        max_pool_connections=int(setting("MAX_POOL_CONNECTIONS", 50)),
+        connect_timeout=float(setting("CONNECT_TIMEOUT", 5)),
+        read_timeout=float(setting("READ_TIMEOUT", defaults.get("read_timeout", 60))),
+        tcp_keepalive=True,
+        retries={"max_attempts": int(setting("MAX_ATTEMPTS", defaults.get("max_attempts", 5))), "mode": "adaptive"},
+    )
+
+
+def _region(service):
+    region_env = _SERVICE_DEFAULTS.get(service, {}).get("region_env", "AWS_REGION")
+    return os.getenv(region_env, os.getenv("AWS_REGION"))
+
+
+def _build_client(service):
+    return boto3.client(
+        service,
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=_region(service),
+        config=_client_config(service),
+    )
+
+
+def get_client(service):
+    """
+    Return the process-wide client for an AWS service, building it on first use.
+    boto3 clients are thread-safe once created; creation itself is serialized here.
+    """
+    client = _clients.get(service)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(service)
+        if client is None:
+            client = _build_client(service)
+            _clients[service] = client
+    return client
+
+
+def init_clients(services=("s3", "bedrock-runtime")):
+    """
+    Eagerly build the clients at startup so the first request doesn't pay for it.
+    A failure here is not fatal: the client is built lazily on first use instead.
+    """
+    for service in services:
+        try:
+            get_client(service)
+        except Exception as e:
+            logger.warning("Could not initialize %s client: %s", service, e)
+
+
+def set_client(service, client):
+    """
+    Install a client (e.g. a stub or local stand-in) for a service.
+    """
+    with _lock:
+        _clients[service] = client
+
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
@@ -1,40 +1,108 @@
+import logging
 import os
 
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from dotenv import load_dotenv
 
+from services.aws_clients import get_client
+from utils.metrics import SIZE_BUCKETS, counter, histogram, timed
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+s3_seconds = histogram("s3_operation_seconds", "S3 call duration", ("operation",))
+s3_bytes = histogram("s3_object_bytes", "Bytes moved per S3 upload or download", ("operation",), buckets=SIZE_BUCKETS)
+s3_errors = counter("s3_errors_total", "Failed S3 calls", ("operation",))
+
+# Streamed uploads go up in parts of this size (S3's minimum part size is 5 MB), so an
+# upload never holds more than UPLOAD_CHUNK_BYTES * UPLOAD_MAX_CONCURRENCY in memory.
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", 2))
+
 
 def get_s3_client():
-    return boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("AWS_REGION"),
-    )
+    return get_client("s3")
 
 
-def upload_file(file_bytes, filename):
+def upload_file(file_bytes, filename, content_type=None, cache_control=None):
     """
     Uploads a file to S3 and returns the filename (key) on success.
+    content_type and cache_control become the headers S3 serves the object with.
     """
     s3 = get_s3_client()
     bucket_name = os.getenv("S3_BUCKET_NAME")
-    print(f"DEBUG: S3_BUCKET_NAME = '{bucket_name}'")
+    headers = {}
+    if content_type:
+        headers["ContentType"] = content_type
+    if cache_control:
+        headers["CacheControl"] = cache_control
 
     try:
-        s3.put_object(Bucket=bucket_name, Key=filename, Body=file_bytes)
+        with timed(s3_seconds, "s3.put_object", operation="put_object"):
+            s3.put_object(Bucket=bucket_name, Key=filename, Body=file_bytes, **headers)
+        s3_bytes.observe(len(file_bytes), operation="put_object")
         return filename
     except NoCredentialsError:
-        print("Credentials not available")
+        s3_errors.inc(operation="put_object")
+        logger.error("S3 credentials not available")
         return None
-    except Exception as e:
-        print(f"Error uploading to S3: {e}")
+    except Exception:
+        s3_errors.inc(operation="put_object")
+        logger.exception("Error uploading to S3", extra={"key": filename})
         return None
 
 
+def upload_fileobj(fileobj, object_name):
+    """
+    Stream a file-like object to S3 (multipart above UPLOAD_CHUNK_BYTES) and return the key on success.
+    """
+    s3 = get_s3_client()
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    config = TransferConfig(
+        multipart_threshold=UPLOAD_CHUNK_BYTES,
+        multipart_chunksize=UPLOAD_CHUNK_BYTES,
+        max_concurrency=UPLOAD_MAX_CONCURRENCY,
+    )
+
+    start = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END) - start
+    fileobj.seek(start)
+
+    try:
+        with timed(s3_seconds, "s3.upload_fileobj", operation="upload_fileobj"):
+            s3.upload_fileobj(fileobj, bucket_name, object_name, Config=config)
+        s3_bytes.observe(size, operation="upload_fileobj")
+        return object_name
+    except NoCredentialsError:
+        s3_errors.inc(operation="upload_fileobj")
+        logger.error("S3 credentials not available")
+        return None
+    except Exception:
+        s3_errors.inc(operation="upload_fileobj")
+        logger.exception("Error uploading to S3", extra={"key": object_name})
+        return None
+
+
+def object_exists(object_name):
+    """
+    Check whether an object exists in S3 with a HEAD request (no body transfer).
+    """
+    s3 = get_s3_client()
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+
+    try:
+        with timed(s3_seconds, "s3.head_object", operation="head_object"):
+            s3.head_object(Bucket=bucket_name, Key=object_name)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            s3_errors.inc(operation="head_object")
+            logger.error("Error checking object in S3: %s", e, extra={"key": object_name})
+        return False
+
+
 def create_presigned_url(object_name, expiration=3600):
     """
     Generate a presigned URL to share an S3 object
@@ -45,7 +113,7 @@ def create_presigned_url(object_name, expiration=3600):
     try:
         response = s3.generate_presigned_url("get_object", Params={"Bucket": bucket_name, "Key": object_name}, ExpiresIn=expiration)
     except ClientError as e:
-        print(f"Error generating presigned URL: {e}")
+        logger.error("Error generating presigned URL: %s", e, extra={"key": object_name})
         return None
 
     return response
@@ -59,8 +127,12 @@ def get_file(object_name):
     bucket_name = os.getenv("S3_BUCKET_NAME")
 
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=object_name)
-        return response["Body"].read()
+        with timed(s3_seconds, "s3.get_object", operation="get_object"):
+            response = s3.get_object(Bucket=bucket_name, Key=object_name)
+            data = response["Body"].read()
+        s3_bytes.observe(len(data), operation="get_object")
+        return data
     except ClientError as e:
-        print(f"Error getting file from S3: {e}")
+        s3_errors.inc(operation="get_object")
+        logger.error("Error getting file from S3: %s", e, extra={"key": object_name})
         return None
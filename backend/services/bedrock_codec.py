@@ -0,0 +1,133 @@
+import binascii
+import json
+
+# Raw bytes per base64 chunk; a multiple of 3 so chunks encode without padding
+ENCODE_CHUNK_BYTES = 3 * 256 * 1024
+READ_CHUNK_BYTES = 256 * 1024
+
+
+def encode_request(prompt, image_bytes=None, image_base64=None, **params):
+    """
+    Build the JSON request body for an image-to-image call in one preallocated buffer.
+    The image is base64-encoded chunk by chunk straight into place, so the only
+    full-size allocation is the body itself. Pass image_base64 to copy an
+    already-encoded image instead.
+    """
+    fields = {"prompt": prompt, **params}
+    head = (json.dumps(fields)[:-1] + ', "image": "').encode("utf-8")
+    tail = b'"}'
+
+    if image_base64 is not None:
+        encoded_len = len(image_base64)
+    else:
+        encoded_len = 4 * ((len(image_bytes) + 2) // 3)
+
+    body = bytearray(len(head) + encoded_len + len(tail))
+    body[: len(head)] = head
+    offset = len(head)
+
+    if image_base64 is not None:
+        body[offset : offset + encoded_len] = image_base64
+        offset += encoded_len
+    else:
+        view = memoryview(image_bytes)
+        for start in range(0, len(view), ENCODE_CHUNK_BYTES):
+            chunk = binascii.b2a_base64(view[start : start + ENCODE_CHUNK_BYTES], newline=False)
+            body[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+    body[offset:] = tail
+    return body
+
+
+class _ImageStreamDecoder:
+    """
+    Incremental base64 decoder for the characters of a JSON string value.
+    """
+
+    def __init__(self):
+        self.output = bytearray()
+        self._carry = b""
+
+    def feed(self, chars):
+        if b"\\" in chars:
+            # JSON may escape "/" as "\/"; backslash is never a base64 character
+            chars = chars.replace(b"\\", b"")
+        chars = self._carry + chars
+        usable = len(chars) - len(chars) % 4
+        if usable:
+            self.output += binascii.a2b_base64(chars[:usable])
+        self._carry = chars[usable:]
+
+    def finish(self):
+        if self._carry:
+            self.output += binascii.a2b_base64(self._carry)
+            self._carry = b""
+        # Handed out as-is (bytes-like) to avoid one more full-size copy
+        return self.output
+
+
+def decode_response(stream, chunk_size=READ_CHUNK_BYTES):
+    """
+    Return the first generated image (as a bytearray) from a Bedrock image response.
+    The body is streamed: bytes up to the start of images[0] are scanned in a small
+    buffer and the base64 string is decoded as it arrives, without ever holding the
+    whole response text. Responses in another shape (e.g. "artifacts") fall back to
+    a full JSON parse.
+    """
+    marker = b'"images"'
+    buffer = bytearray()
+    decoder = None
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        if decoder is None:
+            buffer += chunk
+            start = _find_image_start(buffer, marker)
+            if start is None:
+                continue
+            decoder = _ImageStreamDecoder()
+            chunk = bytes(buffer[start:])
+            buffer = bytearray()
+
+        end = chunk.find(b'"')
+        if end == -1:
+            decoder.feed(chunk)
+            continue
+        decoder.feed(chunk[:end])
+        # Fields after images[0] (seeds, finish_reasons) are not needed
+        return decoder.finish()
+
+    if decoder is not None:
+        raise ValueError("Truncated image in Bedrock response")
+
+    return _decode_buffered(buffer)
+
+
+def _find_image_start(buffer, marker):
+    key = buffer.find(marker)
+    if key == -1:
+        return None
+    bracket = buffer.find(b"[", key + len(marker))
+    if bracket == -1:
+        return None
+    rest = buffer[bracket + 1 :].lstrip()
+    if not rest:
+        return None
+    if rest[:1] != b'"':
+        raise ValueError("No image in Bedrock response")
+    return len(buffer) - len(rest) + 1
+
+
+def _decode_buffered(buffer):
+    response_body = json.loads(buffer)
+    if response_body.get("artifacts"):  # Fallback for older/different formats
+        encoded = response_body["artifacts"][0]["base64"]
+    elif response_body.get("images"):
+        encoded = response_body["images"][0]
+    else:
+        raise ValueError(f"No image in Bedrock response: {list(response_body)}")
+    return binascii.a2b_base64(encoded)
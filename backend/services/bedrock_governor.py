@@ -0,0 +1,348 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from botocore.exceptions import ClientError
+
+from utils.metrics import counter, gauge, histogram, record_timing, timed
+
+INTERACTIVE = 0
+BATCH = 1
+
+THROTTLE_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException")
+TRANSIENT_CODES = ("ServiceUnavailableException", "ModelNotReadyException", "InternalServerException")
+
+# Priority of Bedrock calls made from the current context; the executors copy it into worker threads
+_priority = contextvars.ContextVar("bedrock_priority", default=INTERACTIVE)
+
+# A slot granted on the event loop by ModelGovernor.admission(), handed to the call() it wraps
+_admission = contextvars.ContextVar("bedrock_admission", default=None)
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+bedrock_seconds = histogram("bedrock_request_seconds", "Bedrock call duration, per attempt", ("model",))
+bedrock_wait_seconds = histogram("bedrock_queue_wait_seconds", "Time spent queued in the governor before a call", ("model",))
+bedrock_throttles = counter("bedrock_throttles_total", "Calls Bedrock answered with a throttling or quota error", ("model",))
+bedrock_retries = counter("bedrock_retries_total", "Throttled or transient calls retried by the governor", ("model",))
+bedrock_rejected = counter("bedrock_rejected_total", "Calls given up on with ModelBusy", ("model",))
+
+
+class ModelBusy(Exception):
+    """
+    Raised when a call could not get through: throttled on every retry, or queued too long.
+    retry_after is a hint in seconds.
+    """
+
+    def __init__(self, model_id, retry_after):
+        super().__init__(f"{model_id} is busy, retry later")
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+@contextmanager
+def bedrock_priority(priority):
+    """
+    Run the enclosed Bedrock calls at the given priority (INTERACTIVE or BATCH).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code")
+    # langchain_aws re-raises Bedrock errors as ValueError with the code in the message
+    text = str(error)
+    for code in THROTTLE_CODES + TRANSIENT_CODES:
+        if code in text:
+            return code
+    return None
+
+
+class ModelGovernor:
+    """
+    Admission control for one Bedrock model.
+
+    Calls wait in a priority queue (INTERACTIVE before BATCH, then arrival order) for a
+    concurrency slot and a token from a requests-per-minute bucket. The bucket's rate
+    adapts AIMD-style: halved on every throttle, raised by a twentieth of the budget on
+    every success. Throttled and transient failures are retried with full-jitter
+    exponential backoff and keep their original place in the queue.
+
+    Async callers queue with admission() on the event loop before handing the call to
+    an executor, so waiting never holds a pool thread: otherwise queued batch calls
+    would fill the pool and interactive ones would wait in its FIFO, never reaching the
+    priority queue.
+    """
+
+    def __init__(
+        self,
+        model_id,
+        requests_per_minute=60,
+        max_concurrency=4,
+        max_retries=4,
+        base_delay=0.5,
+        max_delay=20.0,
+        max_wait=60.0,
+    ):
+        self.model_id = model_id
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+
+        self.burst = max(1, max_concurrency)
+        self._active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        # (loop, event) for each admission() waiting on an event loop
+        self._async_waiters = set()
+        self.reset()
+
+        with _governors_lock:
+            _governors[model_id] = self
+
+    def reset(self):
+        """
+        Back to the full budget with a full bucket and zeroed metrics.
+        """
+        with self._cond:
+            self.rate = self.requests_per_minute / 60.0  # current tokens per second
+            self.min_rate = self.rate / 16
+            self._tokens = float(self.burst)
+            self._refilled_at = time.monotonic()
+            self._counters = {"requests": 0, "throttled": 0, "retries": 0, "rejected": 0}
+            self._waits = deque(maxlen=1000)
+            self._notify()
+
+    def call(self, func, *args, priority=None, **kwargs):
+        """
+        Run func(*args, **kwargs) under the governor; retries throttled calls.
+        Raises ModelBusy when the call cannot get through, or func's own non-retryable error.
+        """
+        admission = _admission.get()
+        admitted = admission is not None and admission["governor"] is self and self._claim(admission)
+        entry = admission["entry"] if admitted else (_priority.get() if priority is None else priority, next(self._sequence))
+        for attempt in range(self.max_retries + 1):
+            if attempt or not admitted:
+                self._acquire(entry)
+            try:
+                with timed(bedrock_seconds, f"bedrock.{self.model_id}", model=self.model_id):
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                code = _error_code(e)
+                throttled = code in THROTTLE_CODES
+                self._release(throttled=throttled)
+                if code not in THROTTLE_CODES + TRANSIENT_CODES:
+                    raise
+                if attempt == self.max_retries:
+                    self._count("rejected")
+                    bedrock_rejected.inc(model=self.model_id)
+                    raise ModelBusy(self.model_id, retry_after=self._retry_after()) from e
+                self._count("retries")
+                bedrock_retries.inc(model=self.model_id)
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt)))  # nosec B311
+            else:
+                self._release(throttled=False)
+                return result
+
+    @asynccontextmanager
+    async def admission(self, priority=None):
+        """
+        Wait for a slot on the event loop, then let the first call() in the enclosed
+        block (typically on an executor thread; the slot travels in a context variable)
+        use it without queueing again. A slot no call() claimed is returned on exit.
+        """
+        entry = (_priority.get() if priority is None else priority, next(self._sequence))
+        await self._aacquire(entry)
+        admission = {"governor": self, "entry": entry, "claimed": False}
+        token = _admission.set(admission)
+        try:
+            yield
+        finally:
+            _admission.reset(token)
+            if self._claim(admission):
+                self._release(throttled=None)
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            stats = {
+                **self._counters,
+                "queue_depth": len(self._waiters),
+                "active": self._active,
+                "requests_per_minute": round(self.rate * 60, 2),
+                "max_requests_per_minute": self.requests_per_minute,
+                "max_concurrency": self.max_concurrency,
+            }
+        stats["wait_seconds_p50"] = round(waits[len(waits) // 2], 4) if waits else 0.0
+        stats["wait_seconds_p95"] = round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0
+        stats["wait_seconds_max"] = round(waits[-1], 4) if waits else 0.0
+        return stats
+
+    def _acquire(self, entry):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            while True:
+                admitted, timeout = self._admit(entry, started)
+                if admitted:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(entry)
+                self._cond.wait(min(timeout, remaining) if timeout is not None else remaining)
+
+    async def _aacquire(self, entry):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._cond:
+                    waiter[1].clear()
+                    admitted, timeout = self._admit(entry, started)
+                    if admitted:
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._give_up(entry)
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(timeout, remaining) if timeout is not None else remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # The request went away while queued: give up its place
+            with self._cond:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._notify()
+            raise
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def _admit(self, entry, started):
+        """
+        With the lock held: take a slot and a token if entry is first in line.
+        Returns (admitted, seconds until a token is due, or None when waiting for a slot).
+        """
+        if self._waiters[0] != entry or self._active >= self.max_concurrency:
+            return False, None
+        self._refill()
+        if self._tokens < 1:
+            return False, (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._active += 1
+        heapq.heappop(self._waiters)
+        self._counters["requests"] += 1
+        waited = time.monotonic() - started
+        self._waits.append(waited)
+        bedrock_wait_seconds.observe(waited, model=self.model_id)
+        if waited >= 0.001:
+            record_timing(f"bedrock_queue.{self.model_id}", waited)
+        # The next waiter may be able to go too
+        self._notify()
+        return True, None
+
+    def _give_up(self, entry):
+        # With the lock held: leave the queue after waiting max_wait
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+        self._counters["rejected"] += 1
+        bedrock_rejected.inc(model=self.model_id)
+        self._notify()
+        raise ModelBusy(self.model_id, retry_after=self._retry_after())
+
+    def _claim(self, admission):
+        # Exactly one of call() and admission()'s exit gets to use or return the slot
+        with self._cond:
+            if admission["claimed"]:
+                return False
+            admission["claimed"] = True
+            return True
+
+    def _notify(self):
+        # With the lock held: wake threads in _acquire and coroutines in _aacquire
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Its loop has closed
+                self._async_waiters.discard((loop, event))
+
+    def _release(self, throttled):
+        """
+        Give back a slot. throttled is None for a slot that was never used for a call.
+        """
+        with self._cond:
+            self._active -= 1
+            max_rate = self.requests_per_minute / 60.0
+            if throttled:
+                self._counters["throttled"] += 1
+                bedrock_throttles.inc(model=self.model_id)
+                self.rate = max(self.min_rate, self.rate / 2)
+                # Drop the burst too, or the queue would immediately re-offend
+                self._tokens = min(self._tokens, 0.0)
+            elif throttled is not None:
+                self.rate = min(max_rate, self.rate + max_rate / 20)
+            self._notify()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _retry_after(self):
+        # Time for the current queue to drain at the current rate, at least one second
+        return max(1, int((len(self._waiters) + 1) / self.rate))
+
+    def _count(self, name):
+        with self._cond:
+            self._counters[name] += 1
+
+
+def reset_governors():
+    with _governors_lock:
+        governors = list(_governors.values())
+    for governor in governors:
+        governor.reset()
+
+
+def governor_stats():
+    with _governors_lock:
+        governors = dict(_governors)
+    return {model_id: governor.stats() for model_id, governor in governors.items()}
+
+
+def _governor_gauge(field):
+    def read():
+        with _governors_lock:
+            governors = list(_governors.values())
+        return {(governor.model_id,): governor.stats()[field] for governor in governors}
+
+    return read
+
+
+gauge("bedrock_queue_depth", "Calls waiting in the governor", ("model",), _governor_gauge("queue_depth"))
+gauge("bedrock_active_requests", "Calls in flight", ("model",), _governor_gauge("active"))
+gauge("bedrock_requests_per_minute", "Current AIMD rate limit", ("model",), _governor_gauge("requests_per_minute"))
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import re
+
+from services.aws_s3 import get_file, object_exists, upload_file, upload_fileobj
+from services.executors import run_in_executor
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Graph state only ever carries blob keys; the bytes live in S3 and, while hot,
+# in this process-local cache so a node right after an upload doesn't refetch.
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Uploads larger than this are rejected with 413
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+UPLOAD_PREFIX = "uploads/"
+GENERATED_PREFIX = "generated/"
+
+_CONTENT_KEY_RE = re.compile(r"^[\w-]+/([0-9a-f]{64})(\.\w+)?$")
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_key(data, filename, prefix=UPLOAD_PREFIX):
+    """
+    Content-addressed key: identical bytes always map to the same object, whatever the filename.
+    """
+    return _key_for_hash(content_hash(data), filename, prefix)
+
+
+def _key_for_hash(digest, filename, prefix):
+    extension = os.path.splitext(filename or "")[1].lower()
+    return f"{prefix}{digest}{extension}"
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
+
+def hash_stream(fileobj, max_bytes):
+    """
+    Hash a file-like object chunk by chunk. Raises UploadTooLarge as soon as more than
+    max_bytes have been read. Returns (sha256 hex digest, size).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := fileobj.read(HASH_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+def hash_from_key(key):
+    """
+    Recover the content hash from a content-addressed key, or None for legacy keys.
+    """
+    match = _CONTENT_KEY_RE.match(key or "")
+    return match.group(1) if match else None
+
+
+class BlobStore:
+    """
+    Resolves blob keys (S3 object keys) to bytes, with an in-process LRU cache in front of S3.
+    """
+
+    def __init__(self, max_cache_bytes=DEFAULT_CACHE_BYTES):
+        self.cache = LRUCache(max_items=512, max_bytes=max_cache_bytes)
+        # Keys known to already exist in S3, so repeat uploads skip even the HEAD request
+        self.known_keys = LRUCache(max_items=100_000)
+
+    def put(self, data, key, **headers):
+        """
+        Upload bytes under the given key and keep them cached. Returns the key, or None on failure.
+        headers (content_type, cache_control) are passed through to S3.
+        """
+        uploaded_key = upload_file(data, key, **headers)
+        if uploaded_key:
+            self.cache.set(uploaded_key, data)
+            self.known_keys.set(uploaded_key, True)
+        return uploaded_key
+
+    def put_content(self, data, filename, prefix=UPLOAD_PREFIX):
+        """
+        Store bytes under their content-addressed key, skipping the upload when the
+        object is already stored. Returns the key, or None on failure.
+        """
+        return self._put_content_key(data, content_key(data, filename, prefix))
+
+    def _put_content_key(self, data, key):
+        if key in self.known_keys or object_exists(key):
+            logger.debug("Blob already stored, skipping upload", extra={"key": key})
+            self.known_keys.set(key, True)
+            self.cache.set(key, data)
+            return key
+        return self.put(data, key)
+
+    def put_stream(self, fileobj, filename, prefix=UPLOAD_PREFIX, max_bytes=None):
+        """
+        Store a file-like object (e.g. an UploadFile's spooled file) under its content-addressed
+        key without reading it into memory: one pass hashes and size-checks it, a second
+        streams it to S3 in parts. Raises UploadTooLarge; returns the key, or None on failure.
+        The bytes are not cached; the graph fetches them once when it first prepares the image.
+        """
+        fileobj.seek(0)
+        digest, _ = hash_stream(fileobj, MAX_UPLOAD_BYTES if max_bytes is None else max_bytes)
+        key = _key_for_hash(digest, filename, prefix)
+        if key in self.known_keys or object_exists(key):
+            logger.debug("Blob already stored, skipping upload", extra={"key": key})
+            self.known_keys.set(key, True)
+            return key
+
+        fileobj.seek(0)
+        uploaded_key = upload_fileobj(fileobj, key)
+        if uploaded_key:
+            self.known_keys.set(uploaded_key, True)
+        return uploaded_key
+
+    def get(self, key):
+        """
+        Return the bytes for a key, fetching from S3 on a cache miss. Returns None if not found.
+        """
+        data = self.cache.get(key)
+        if data is None:
+            data = self._fetch(key)
+        return data
+
+    def remember(self, key, data):
+        """
+        Seed the cache with bytes already known to be stored under key.
+        """
+        self.cache.set(key, data)
+
+    async def aput(self, data, key, **headers):
+        return await run_in_executor("s3", self.put, data, key, **headers)
+
+    async def aexists(self, key):
+        """
+        Whether key is stored, answered from known_keys when possible and otherwise with a HEAD.
+        """
+        if key in self.known_keys:
+            return True
+        if await run_in_executor("s3", object_exists, key):
+            self.known_keys.set(key, True)
+            return True
+        return False
+
+    async def aput_content(self, data, filename, prefix=UPLOAD_PREFIX):
+        key = content_key(data, filename, prefix)
+        if key in self.known_keys:
+            self.cache.set(key, data)
+            return key
+        return await run_in_executor("s3", self._put_content_key, data, key)
+
+    async def aput_upload(self, upload, prefix=UPLOAD_PREFIX, max_bytes=None):
+        """
+        put_stream() for a FastAPI UploadFile, run on the "s3" executor.
+        """
+        return await run_in_executor("s3", self.put_stream, upload.file, upload.filename, prefix, max_bytes)
+
+    async def aget(self, key):
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        return await run_in_executor("s3", self._fetch, key)
+
+    def _fetch(self, key):
+        logger.debug("Fetching blob from S3", extra={"key": key})
+        data = get_file(key)
+        if data is not None:
+            self.cache.set(key, data)
+        return data
+
+
+blob_store = BlobStore(max_cache_bytes=int(os.getenv("BLOB_CACHE_BYTES", DEFAULT_CACHE_BYTES)))
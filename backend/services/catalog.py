@@ -0,0 +1,119 @@
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Wizard fields in prompt order
+FIELDS = ("style", "mood", "functionality", "palette", "clutter")
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(__file__), "catalog.json")
+
+
+class InvalidOptions(ValueError):
+    """
+    Raised when submitted options are not in the catalog. `errors` maps each bad
+    field to a message.
+    """
+
+    def __init__(self, errors):
+        super().__init__("; ".join(f"{field}: {message}" for field, message in errors.items()))
+        self.errors = errors
+
+
+class Catalog:
+    """
+    The wizard's options and the prompt fragment each one contributes. Built once
+    from the catalog file; lookups and prompt composition are plain dict reads.
+    """
+
+    def __init__(self, data):
+        self.version = str(data["version"])
+        fields = {field["id"]: field for field in data["fields"]}
+        missing = [field for field in FIELDS if field not in fields]
+        if missing:
+            raise ValueError(f"Catalog {self.version} has no options for {', '.join(missing)}")
+
+        # value -> fragment per field, with whitespace normalized once here instead of per prompt
+        self.fragments = {
+            field: {option["value"]: " ".join(option.get("prompt", "").split()) for option in fields[field]["options"]} for field in FIELDS
+        }
+
+        # Changes whenever a fragment does, even if someone forgets to bump the version
+        canonical = json.dumps(self.fragments, sort_keys=True, separators=(",", ":"))
+        self.digest = hashlib.sha256(canonical.encode()).hexdigest()[:12]
+        self.cache_version = f"{self.version}:{self.digest}"
+
+        # What GET /catalog serves: everything but the prompt text
+        self._public = {
+            "version": self.version,
+            "fields": [
+                {
+                    "id": field,
+                    "title": fields[field].get("title", field.title()),
+                    "question": fields[field].get("question", ""),
+                    "options": [
+                        {key: option[key] for key in ("value", "label", "description") if key in option} for option in fields[field]["options"]
+                    ],
+                }
+                for field in FIELDS
+            ],
+        }
+
+    def public(self):
+        return self._public
+
+    def options(self, field):
+        return list(self.fragments[field])
+
+    def validate(self, options):
+        """
+        Raise InvalidOptions unless every field has a value the catalog knows.
+        """
+        errors = {}
+        for field in FIELDS:
+            value = options.get(field)
+            if value is None or value == "":
+                errors[field] = "field required"
+            elif value not in self.fragments[field]:
+                errors[field] = f"unknown option {value!r} (catalog {self.version})"
+        if errors:
+            raise InvalidOptions(errors)
+
+    def compose(self, options, additional_prompt=""):
+        """
+        Build the design prompt. Values outside the catalog contribute nothing, as
+        before; requests are validated before they get this far.
+        """
+        parts = []
+        for field in FIELDS:
+            fragment = self.fragments[field].get(options.get(field))
+            if fragment:
+                parts.append(fragment)
+        if additional_prompt:
+            parts.append(f"Additional details: {additional_prompt}")
+        return " ".join(parts)
+
+    def combination_count(self):
+        return math.prod(len(self.fragments[field]) for field in FIELDS)
+
+    def combinations(self):
+        """
+        Every (style, mood, functionality, palette, clutter) choice the wizard can submit.
+        """
+        for values in itertools.product(*(self.fragments[field] for field in FIELDS)):
+            yield dict(zip(FIELDS, values))
+
+
+def load_catalog(path=None):
+    path = path or os.getenv("CATALOG_PATH", DEFAULT_CATALOG_PATH)
+    with open(path) as f:
+        loaded = Catalog(json.load(f))
+    logger.info("Loaded option catalog", extra={"version": loaded.version, "digest": loaded.digest, "path": path})
+    return loaded
+
+
+catalog = load_catalog()
@@ -0,0 +1,163 @@
+from langgraph.checkpoint.base import WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata
+from langgraph.checkpoint.mongodb.utils import _validate_filter, _validate_identifier, dumps_metadata, loads_metadata
+from pymongo import UpdateOne
+
+from utils.metrics import histogram, timed
+
+CHECKPOINT_INDEX = [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)]
+WRITES_INDEX = [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1), ("task_id", 1), ("idx", 1)]
+
+checkpoint_seconds = histogram("checkpoint_operation_seconds", "Checkpointer read and write duration", ("operation",))
+
+
+class AsyncMongoDBSaver(BaseCheckpointSaver):
+    """
+    Checkpointer on a PyMongo AsyncMongoClient: every read and write is a native
+    awaitable, so graph runs never block the event loop or hold a thread on Mongo.
+
+    Documents use the same layout as langgraph's MongoDBSaver, so both can read the
+    same collections. Only the async API is implemented (the app only calls
+    ainvoke/astream/aget_state/aupdate_state). Indexes are created by setup(), which
+    callers run in the background rather than in the constructor.
+    """
+
+    def __init__(self, client, db_name, checkpoint_collection_name="checkpoints", writes_collection_name="checkpoint_writes", serde=None):
+        super().__init__(serde=serde)
+        self.client = client
+        self.db = client[db_name]
+        self.checkpoint_collection = self.db[checkpoint_collection_name]
+        self.writes_collection = self.db[writes_collection_name]
+
+    async def setup(self):
+        await self.checkpoint_collection.create_index(CHECKPOINT_INDEX, unique=True)
+        await self.writes_collection.create_index(WRITES_INDEX, unique=True)
+
+    async def aget_tuple(self, config):
+        thread_id = _validate_identifier(config["configurable"]["thread_id"], "thread_id")
+        checkpoint_ns = _validate_identifier(config["configurable"].get("checkpoint_ns", ""), "checkpoint_ns")
+        checkpoint_id = _validate_identifier(get_checkpoint_id(config), "checkpoint_id", optional=True)
+
+        query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        if checkpoint_id:
+            query["checkpoint_id"] = checkpoint_id
+
+        with timed(checkpoint_seconds, "checkpoint.get", operation="get_tuple"):
+            doc = await self.checkpoint_collection.find_one(query, sort=[("checkpoint_id", -1)])
+            if doc is None:
+                return None
+            writes = await self._pending_writes(thread_id, checkpoint_ns, [doc["checkpoint_id"]])
+        return self._to_tuple(doc, writes.get(doc["checkpoint_id"], []))
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        query = {}
+        if config is not None:
+            if "thread_id" in config["configurable"]:
+                query["thread_id"] = _validate_identifier(config["configurable"]["thread_id"], "thread_id")
+            if "checkpoint_ns" in config["configurable"]:
+                query["checkpoint_ns"] = _validate_identifier(config["configurable"]["checkpoint_ns"], "checkpoint_ns")
+
+        if filter:
+            _validate_filter(filter)
+            for key, value in filter.items():
+                query[f"metadata.{key}"] = dumps_metadata(self.serde, value)
+
+        if before is not None:
+            query["checkpoint_id"] = {"$lt": _validate_identifier(before["configurable"]["checkpoint_id"], "before checkpoint_id")}
+
+        with timed(checkpoint_seconds, "checkpoint.list", operation="list"):
+            docs = await self.checkpoint_collection.find(query, limit=limit or 0, sort=[("checkpoint_id", -1)]).to_list()
+
+            # One writes query per (thread, namespace) instead of one per checkpoint
+            groups = {}
+            for doc in docs:
+                groups.setdefault((doc["thread_id"], doc["checkpoint_ns"]), []).append(doc["checkpoint_id"])
+            writes = {}
+            for (thread_id, checkpoint_ns), checkpoint_ids in groups.items():
+                for checkpoint_id, pending in (await self._pending_writes(thread_id, checkpoint_ns, checkpoint_ids)).items():
+                    writes[(thread_id, checkpoint_ns, checkpoint_id)] = pending
+
+        for doc in docs:
+            yield self._to_tuple(doc, writes.get((doc["thread_id"], doc["checkpoint_ns"], doc["checkpoint_id"]), []))
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        thread_id = _validate_identifier(config["configurable"]["thread_id"], "thread_id")
+        checkpoint_ns = _validate_identifier(config["configurable"]["checkpoint_ns"], "checkpoint_ns")
+        checkpoint_id = _validate_identifier(checkpoint["id"], "checkpoint id")
+        parent_checkpoint_id = _validate_identifier(config["configurable"].get("checkpoint_id"), "checkpoint_id", optional=True)
+
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        doc = {
+            "parent_checkpoint_id": parent_checkpoint_id,
+            "type": type_,
+            "checkpoint": serialized_checkpoint,
+            "metadata": dumps_metadata(self.serde, get_checkpoint_metadata(config, metadata)),
+        }
+        with timed(checkpoint_seconds, "checkpoint.put", operation="put"):
+            await self.checkpoint_collection.update_one(
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id},
+                {"$set": doc},
+                upsert=True,
+            )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        thread_id = _validate_identifier(config["configurable"]["thread_id"], "thread_id")
+        checkpoint_ns = _validate_identifier(config["configurable"]["checkpoint_ns"], "checkpoint_ns")
+        checkpoint_id = _validate_identifier(config["configurable"]["checkpoint_id"], "checkpoint_id")
+        _validate_identifier(task_id, "task_id")
+        _validate_identifier(task_path, "task_path")
+
+        # Replace existing writes only for special channels (errors, interrupts), as MongoDBSaver does
+        set_method = "$set" if all(w[0] in WRITES_IDX_MAP for w in writes) else "$setOnInsert"
+        operations = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized_value = self.serde.dumps_typed(value)
+            operations.append(
+                UpdateOne(
+                    {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": checkpoint_id,
+                        "task_id": task_id,
+                        "task_path": task_path,
+                        "idx": WRITES_IDX_MAP.get(channel, idx),
+                    },
+                    {set_method: {"channel": channel, "type": type_, "value": serialized_value}},
+                    upsert=True,
+                )
+            )
+        if operations:
+            with timed(checkpoint_seconds, "checkpoint.put_writes", operation="put_writes"):
+                await self.writes_collection.bulk_write(operations)
+
+    async def adelete_thread(self, thread_id):
+        _validate_identifier(thread_id, "thread_id")
+        await self.checkpoint_collection.delete_many({"thread_id": thread_id})
+        await self.writes_collection.delete_many({"thread_id": thread_id})
+
+    async def _pending_writes(self, thread_id, checkpoint_ns, checkpoint_ids):
+        """
+        Return {checkpoint_id: [(task_id, channel, value), ...]} for the given checkpoints.
+        """
+        cursor = self.writes_collection.find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": {"$in": checkpoint_ids}},
+            sort=[("task_id", 1), ("idx", 1)],
+        )
+        pending = {}
+        async for doc in cursor:
+            value = self.serde.loads_typed((doc["type"], doc["value"]))
+            pending.setdefault(doc["checkpoint_id"], []).append((doc["task_id"], doc["channel"], value))
+        return pending
+
+    def _to_tuple(self, doc, pending_writes):
+        config_values = {"thread_id": doc["thread_id"], "checkpoint_ns": doc["checkpoint_ns"], "checkpoint_id": doc["checkpoint_id"]}
+        parent_config = None
+        if doc.get("parent_checkpoint_id"):
+            parent_config = {"configurable": {**config_values, "checkpoint_id": doc["parent_checkpoint_id"]}}
+        return CheckpointTuple(
+            config={"configurable": config_values},
+            checkpoint=self.serde.loads_typed((doc["type"], doc["checkpoint"])),
+            metadata=loads_metadata(self.serde, doc["metadata"]),
+            parent_config=parent_config,
+            pending_writes=pending_writes,
+        )
@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+
+from services.blob_store import blob_store, hash_from_key
+from services.executors import run_in_process
+from utils.cache import LRUCache
+from utils.image_helpers import encode_derivatives
+from utils.metrics import SIZE_BUCKETS, histogram, timed
+
+logger = logging.getLogger(__name__)
+
+derivative_seconds = histogram("image_derivative_seconds", "Time to encode the display and thumbnail derivatives of one image")
+derivative_bytes = histogram("image_derivative_bytes", "Size of each encoded derivative", ("derivative",), buckets=SIZE_BUCKETS)
+
+DERIVED_PREFIX = "derived/"
+
+# webp or avif; avif falls back to webp when Pillow was built without it
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "webp").lower()
+
+# Derived keys are content-addressed (source hash + settings), so the objects never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@functools.cache
+def derivative_format():
+    from PIL import features
+
+    if DERIVATIVE_FORMAT == "avif" and not features.check("avif"):
+        logger.warning("Pillow has no AVIF support, encoding derivatives as WebP")
+        return "webp"
+    return DERIVATIVE_FORMAT if DERIVATIVE_FORMAT in ("webp", "avif") else "webp"
+
+
+def derivative_specs():
+    """
+    What gets produced for every generated image: a display copy for the before/after
+    view and a thumbnail for history lists.
+    """
+    image_format = derivative_format()
+    return {
+        "display": {
+            "format": image_format,
+            "max_edge": int(os.getenv("DISPLAY_MAX_EDGE", 1024)),
+            "quality": int(os.getenv("DISPLAY_QUALITY", 80)),
+        },
+        "thumbnail": {
+            "format": image_format,
+            "max_edge": int(os.getenv("THUMBNAIL_MAX_EDGE", 320)),
+            "quality": int(os.getenv("THUMBNAIL_QUALITY", 70)),
+        },
+    }
+
+
+def derivative_keys(generated_key, specs=None):
+    """
+    Deterministic S3 keys for a generated image's derivatives, or {} for legacy keys that
+    carry no content hash. Changing a spec changes its key, so stale copies are never served.
+    """
+    source_hash = hash_from_key(generated_key)
+    if source_hash is None:
+        return {}
+    keys = {}
+    for name, spec in (specs or derivative_specs()).items():
+        signature = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:8]
+        keys[name] = f"{DERIVED_PREFIX}{source_hash}-{name}-{signature}.{spec['format']}"
+    return keys
+
+
+class DerivativePipeline:
+    """
+    Produces derivatives in the background after a generated image is stored: the
+    source is read from the blob store (normally still cached from its upload),
+    encoded in the "images" process pool and the results uploaded next to it.
+    Requests never wait for it; the keys are recorded in the session summary once
+    the derivatives exist, and served from there.
+    """
+
+    def __init__(self):
+        # generated key -> {name: derived key}, for images whose derivatives are stored
+        self.ready = LRUCache(max_items=100_000)
+        # Sources that could not be decoded; not retried for the life of the process
+        self.failed = LRUCache(max_items=10_000)
+        self._pending = {}
+        self._callbacks = {}
+        self.counters = {"scheduled": 0, "completed": 0, "failed": 0, "source_bytes": 0, "derived_bytes": 0}
+
+    def lookup(self, generated_key):
+        """
+        The derivative keys if they are known to be stored, else None. Memory only.
+        """
+        return self.ready.get(generated_key)
+
+    def schedule(self, generated_key, on_ready=None):
+        """
+        Start building derivatives for a generated image unless they exist or are in progress.
+        on_ready(keys) is awaited once they are stored, including when they already were,
+        so callers can record the keys where readers will look for them.
+        Must be called on the event loop.
+        """
+        if not generated_key or generated_key in self.failed or not derivative_keys(generated_key):
+            return
+        if on_ready is not None:
+            self._callbacks.setdefault(generated_key, []).append(on_ready)
+        elif self.lookup(generated_key) is not None:
+            return
+        if generated_key not in self._pending:
+            self._pending[generated_key] = asyncio.create_task(self._run(generated_key))
+
+    async def _run(self, generated_key):
+        try:
+            keys = self.lookup(generated_key)
+            if keys is None:
+                self.counters["scheduled"] += 1
+                keys = await self._build(generated_key)
+            # Callbacks can arrive while earlier ones run; stop only once none are left
+            while keys and self._callbacks.get(generated_key):
+                for on_ready in self._callbacks.pop(generated_key):
+                    try:
+                        await on_ready(keys)
+                    except Exception as e:
+                        logger.warning("Could not record image derivatives: %s", e, extra={"generated_key": generated_key})
+        finally:
+            self._callbacks.pop(generated_key, None)
+            self._pending.pop(generated_key, None)
+
+    async def _build(self, generated_key):
+        specs = derivative_specs()
+        keys = derivative_keys(generated_key, specs)
+        try:
+            if all(await asyncio.gather(*(blob_store.aexists(key) for key in keys.values()))):
+                self.ready.set(generated_key, keys)
+                return keys
+
+            source = await blob_store.aget(generated_key)
+            if source is None:
+                raise ValueError("generated image not found")
+            with timed(derivative_seconds):
+                derived = await run_in_process("images", encode_derivatives, source, specs)
+
+            for name, data in derived.items():
+                content_type = f"image/{specs[name]['format']}"
+                if not await blob_store.aput(data, keys[name], content_type=content_type, cache_control=IMMUTABLE_CACHE_CONTROL):
+                    raise RuntimeError(f"could not upload {keys[name]}")
+                derivative_bytes.observe(len(data), derivative=name)
+
+            self.ready.set(generated_key, keys)
+            self.counters["completed"] += 1
+            self.counters["source_bytes"] += len(source)
+            self.counters["derived_bytes"] += sum(len(data) for data in derived.values())
+            return keys
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            self.failed.set(generated_key, True)
+            logger.warning("Could not build image derivatives: %s", e, extra={"generated_key": generated_key})
+            return None
+
+    async def drain(self):
+        """
+        Wait for every build in progress (benchmarks and tests).
+        """
+        while self._pending:
+            await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+
+    def cancel(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        self._pending.clear()
+        self._callbacks.clear()
+
+    def stats(self):
+        return {**self.counters, "pending": len(self._pending), "ready": len(self.ready), "format": derivative_format()}
+
+
+derivatives = DerivativePipeline()
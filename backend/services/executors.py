@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+# Each blocking dependency gets its own bounded pool so a slow Bedrock call
+# can never starve S3 uploads or checkpoint reads of threads.
+DEFAULT_POOL_SIZES = {
+    "s3": 16,
+    "bedrock": 32,
+    "mongo": 16,
+}
+
+# CPU-bound work (image encoding) gets processes instead, so it holds neither the GIL
+# nor an I/O thread while it runs
+DEFAULT_PROCESS_POOL_SIZES = {
+    "images": max(1, min(4, (os.cpu_count() or 2) // 2)),
+}
+
+_executors = {}
+_process_pools = {}
+_lock = threading.Lock()
+
+
+def get_executor(name):
+    """
+    Return the shared executor for a dependency, creating it on first use.
+    Pool size can be overridden with <NAME>_EXECUTOR_WORKERS (e.g. S3_EXECUTOR_WORKERS).
+    """
+    executor = _executors.get(name)
+    if executor is not None:
+        return executor
+
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            if name not in DEFAULT_POOL_SIZES:
+                raise ValueError(f"Unknown executor: {name}")
+            max_workers = int(os.getenv(f"{name.upper()}_EXECUTOR_WORKERS", DEFAULT_POOL_SIZES[name]))
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-io")
+            _executors[name] = executor
+    return executor
+
+
+async def run_in_executor(name, func, *args, **kwargs):
+    """
+    Run a blocking call on the named executor without blocking the event loop.
+    Context variables are carried over so per-request state survives the hop.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(name), partial(ctx.run, func, *args, **kwargs))
+
+
+def get_process_pool(name):
+    """
+    Return the shared process pool for a kind of CPU-bound work, creating it on first use.
+    Pool size can be overridden with <NAME>_PROCESS_WORKERS (e.g. IMAGES_PROCESS_WORKERS).
+    Workers are spawned rather than forked: the parent runs many threads by then.
+    """
+    with _lock:
+        pool = _process_pools.get(name)
+        if pool is None:
+            if name not in DEFAULT_PROCESS_POOL_SIZES:
+                raise ValueError(f"Unknown process pool: {name}")
+            max_workers = int(os.getenv(f"{name.upper()}_PROCESS_WORKERS", DEFAULT_PROCESS_POOL_SIZES[name]))
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pools[name] = pool
+    return pool
+
+
+async def run_in_process(name, func, *args):
+    """
+    Run a CPU-bound call in the named process pool. func and its arguments are pickled,
+    so func must be a module-level function; context variables do not cross over.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(name), func, *args)
+
+
+def shutdown_executors(wait=True):
+    with _lock:
+        executors = list(_executors.values()) + list(_process_pools.values())
+        _executors.clear()
+        _process_pools.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,163 @@
+import abc
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """
+    Raised by submit() when the queue is at capacity; retry_after is a hint in seconds.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Generation queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue(abc.ABC):
+    """
+    Interface for generation job backends.
+
+    A backend accepts jobs with submit(), runs them through the handler passed to
+    start() (called as handler(thread_id, payload)) on a bounded set of workers, and
+    reports them through get(). Jobs are plain dicts so they can be stored as-is in a
+    shared backend (e.g. a Mongo collection polled by several API replicas).
+    """
+
+    @abc.abstractmethod
+    async def start(self, handler):
+        """
+        Begin running queued jobs through handler.
+        """
+
+    @abc.abstractmethod
+    async def stop(self):
+        """
+        Stop the workers; jobs still queued are abandoned.
+        """
+
+    @abc.abstractmethod
+    async def submit(self, thread_id, payload):
+        """
+        Queue a job and return it. Raises QueueFull when at capacity.
+        """
+
+    @abc.abstractmethod
+    async def get(self, job_id):
+        """
+        The job's current dict, or None if unknown or expired.
+        """
+
+    @abc.abstractmethod
+    def stats(self):
+        """
+        Counters for /cache/stats.
+        """
+
+
+class LocalJobQueue(JobQueue):
+    """
+    In-process backend: a bounded asyncio.Queue drained by max_workers tasks.
+    Jobs for the same thread_id run one at a time so their checkpoints don't race.
+    """
+
+    def __init__(self, max_workers=4, max_queue=100, retry_after=5, job_ttl=3600):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.jobs = LRUCache(max_items=10_000, ttl=job_ttl)
+        self._queue = None
+        self._workers = []
+        self._thread_locks = {}
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, thread_id, payload):
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "thread_id": thread_id,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        try:
+            self._queue.put_nowait((job, payload))
+        except asyncio.QueueFull:
+            raise QueueFull(self.retry_after)
+        self.jobs.set(job["job_id"], job)
+        return job["job_id"]
+
+    async def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "workers": self.max_workers,
+        }
+
+    async def _worker(self):
+        while True:
+            job, payload = await self._queue.get()
+            thread_id = job["thread_id"]
+            lock, pending = self._thread_locks.get(thread_id, (asyncio.Lock(), 0))
+            self._thread_locks[thread_id] = (lock, pending + 1)
+            try:
+                async with lock:
+                    job["status"] = RUNNING
+                    job["started_at"] = time.time()
+                    try:
+                        job["result"] = await self._handler(thread_id, payload)
+                        job["status"] = SUCCEEDED
+                    except Exception as e:
+                        logger.exception("Error in generation job", extra={"job_id": job["job_id"], "thread_id": thread_id})
+                        job["error"] = str(e)
+                        job["status"] = FAILED
+                    job["finished_at"] = time.time()
+            finally:
+                lock, pending = self._thread_locks[thread_id]
+                if pending == 1:
+                    del self._thread_locks[thread_id]
+                else:
+                    self._thread_locks[thread_id] = (lock, pending - 1)
+                self._queue.task_done()
+
+
+def create_job_queue():
+    """
+    Build the configured job queue backend (JOB_QUEUE_BACKEND, default "local").
+    """
+    backend = os.getenv("JOB_QUEUE_BACKEND", "local")
+    if backend == "local":
+        return LocalJobQueue(
+            max_workers=int(os.getenv("JOB_WORKERS", 4)),
+            max_queue=int(os.getenv("JOB_QUEUE_SIZE", 100)),
+            retry_after=int(os.getenv("JOB_RETRY_AFTER_SECONDS", 5)),
+        )
+    raise ValueError(f"Unknown job queue backend: {backend}")
@@ -0,0 +1,24 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+DB_NAME = "room_designer"
+
+
+def client_options():
+    """
+    Connection pool and timeout settings shared by the sync and async Mongo clients.
+    Each can be overridden with MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS and MONGO_SOCKET_TIMEOUT_MS.
+    """
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 100)),
+        # Keep a few warm connections so the first requests after idle don't pay the handshake
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 5)),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000)),
+    }
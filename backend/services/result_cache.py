@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from services.executors import run_in_executor
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_ITEMS = 100_000
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+def generation_cache_key(image_hash, prompt, params):
+    """
+    Stable key for a generation: same source image, same enhanced prompt and same
+    model parameters always produce the same key.
+    """
+    payload = json.dumps({"image": image_hash, "prompt": prompt, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InMemoryResultStore:
+    """
+    Persistent-tier stand-in for tests and single-process runs without MongoDB.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            return self._data.get(cache_key)
+
+    def set(self, cache_key, generated_key):
+        with self._lock:
+            self._data[cache_key] = generated_key
+
+
+class MongoResultStore:
+    """
+    Persistent tier: maps a generation cache key to the S3 key of its earlier output.
+    """
+
+    def __init__(self, collection, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    def get(self, cache_key):
+        doc = self.collection.find_one({"_id": cache_key}, {"generated_key": 1})
+        return doc["generated_key"] if doc else None
+
+    def set(self, cache_key, generated_key):
+        self.collection.update_one(
+            {"_id": cache_key},
+            {"$set": {"generated_key": generated_key, "created_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+
+class ResultCache:
+    """
+    Two-tier cache of generated images, mapping a generation cache key to the S3 key
+    of the image produced for it. Tier 1 is an in-process LRU that saves the Mongo
+    round trip; tier 2 is the shared store. Neither holds image bytes: a hit only needs
+    the key, and the image itself is served from S3.
+    """
+
+    def __init__(self, max_memory_items=DEFAULT_MEMORY_ITEMS, persistent=None):
+        self.memory = LRUCache(max_items=max_memory_items)
+        self.persistent = persistent or InMemoryResultStore()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "bypassed": 0}
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        """
+        Return the generated S3 key on a hit, or None on a miss.
+        """
+        generated_key = self.memory.get(cache_key)
+        if generated_key is not None:
+            self._count("memory_hits")
+            return generated_key
+        return self._get_persistent(cache_key)
+
+    def set(self, cache_key, generated_key):
+        self.memory.set(cache_key, generated_key)
+        try:
+            self.persistent.set(cache_key, generated_key)
+        except Exception as e:
+            logger.warning("Error writing generation cache: %s", e)
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    async def aget(self, cache_key):
+        generated_key = self.memory.get(cache_key)
+        if generated_key is not None:
+            self._count("memory_hits")
+            return generated_key
+        return await run_in_executor("mongo", self._get_persistent, cache_key)
+
+    async def aset(self, cache_key, generated_key):
+        await run_in_executor("mongo", self.set, cache_key, generated_key)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        memory = self.memory.stats()
+        counters["memory_items"] = memory["items"]
+        return counters
+
+    def _get_persistent(self, cache_key):
+        try:
+            generated_key = self.persistent.get(cache_key)
+        except Exception as e:
+            logger.warning("Error reading generation cache: %s", e)
+            generated_key = None
+
+        if generated_key:
+            self._count("persistent_hits")
+            self.memory.set(cache_key, generated_key)
+            return generated_key
+
+        self._count("misses")
+        return None
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+result_cache = ResultCache(max_memory_items=int(os.getenv("RESULT_CACHE_ITEMS", DEFAULT_MEMORY_ITEMS)))
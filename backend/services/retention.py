@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from pymongo import DeleteMany
+
+from services.executors import run_in_executor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEEP_LAST = 10
+DEFAULT_IDLE_SECONDS = 24 * 60 * 60
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_INTERVAL_SECONDS = 10 * 60
+
+# 100ns intervals between the UUID epoch (1582-10-15) and the Unix epoch
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_time(checkpoint_id):
+    """
+    Unix time a checkpoint was created, read from its time-ordered (v6) UUID.
+    """
+    # langgraph's UUID parses v6 ids; imported here so importing this module doesn't load langgraph
+    from langgraph.checkpoint.base.id import UUID
+
+    return (UUID(checkpoint_id).time - _UUID_EPOCH_OFFSET) / 1e7
+
+
+class MongoRetentionBackend:
+    """
+    Retention operations on the collections written by MongoDBSaver.
+
+    Deletion filters are {"thread_id", "checkpoint_ns"} (a whole thread namespace) plus an
+    optional {"checkpoint_id": {"$lt": cutoff}}; checkpoint ids sort by creation time.
+    """
+
+    def __init__(self, checkpoint_collection, writes_collection):
+        self.checkpoint_collection = checkpoint_collection
+        self.writes_collection = writes_collection
+
+    def threads(self):
+        """
+        Yield (thread_id, checkpoint_ns, checkpoint_count, latest_checkpoint_id).
+        """
+        pipeline = [
+            {
+                "$group": {
+                    "_id": {"thread_id": "$thread_id", "checkpoint_ns": "$checkpoint_ns"},
+                    "count": {"$sum": 1},
+                    "latest": {"$max": "$checkpoint_id"},
+                }
+            }
+        ]
+        for doc in self.checkpoint_collection.aggregate(pipeline, allowDiskUse=True):
+            yield doc["_id"]["thread_id"], doc["_id"]["checkpoint_ns"], doc["count"], doc["latest"]
+
+    def nth_newest(self, thread_id, checkpoint_ns, n):
+        cursor = (
+            self.checkpoint_collection.find({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}, {"checkpoint_id": 1})
+            .sort("checkpoint_id", -1)
+            .skip(n - 1)
+            .limit(1)
+        )
+        doc = next(iter(cursor), None)
+        return doc["checkpoint_id"] if doc else None
+
+    def delete(self, filters):
+        """
+        Delete everything matching any of filters from both collections in bulk.
+        Returns {"checkpoints", "writes", "bytes"}; bytes are measured just before deletion.
+        """
+        reclaimed = {"checkpoints": 0, "writes": 0, "bytes": 0}
+        for name, collection in (("checkpoints", self.checkpoint_collection), ("writes", self.writes_collection)):
+            sizes = collection.aggregate(
+                [
+                    {"$match": {"$or": filters}},
+                    {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+                ]
+            )
+            reclaimed["bytes"] += next(iter(sizes), {}).get("bytes", 0)
+            result = collection.bulk_write([DeleteMany(f) for f in filters], ordered=False)
+            reclaimed[name] = result.deleted_count
+        return reclaimed
+
+
+class InMemoryRetentionBackend:
+    """
+    Same operations over an InMemorySaver, for tests and single-process runs without MongoDB.
+    """
+
+    def __init__(self, saver):
+        self.saver = saver
+
+    def threads(self):
+        for thread_id, namespaces in list(self.saver.storage.items()):
+            for checkpoint_ns, checkpoints in list(namespaces.items()):
+                if checkpoints:
+                    yield thread_id, checkpoint_ns, len(checkpoints), max(checkpoints)
+
+    def nth_newest(self, thread_id, checkpoint_ns, n):
+        ids = sorted(self.saver.storage[thread_id][checkpoint_ns], reverse=True)
+        return ids[n - 1] if len(ids) >= n else None
+
+    def delete(self, filters):
+        reclaimed = {"checkpoints": 0, "writes": 0, "bytes": 0}
+        for f in filters:
+            thread_id, checkpoint_ns = f["thread_id"], f["checkpoint_ns"]
+            cutoff = f.get("checkpoint_id", {}).get("$lt")
+
+            checkpoints = self.saver.storage[thread_id][checkpoint_ns]
+            for checkpoint_id in [c for c in checkpoints if cutoff is None or c < cutoff]:
+                checkpoint, metadata, _ = checkpoints.pop(checkpoint_id)
+                reclaimed["checkpoints"] += 1
+                reclaimed["bytes"] += len(checkpoint[1]) + len(metadata[1])
+
+            for key in [k for k in self.saver.writes if k[:2] == (thread_id, checkpoint_ns) and (cutoff is None or k[2] < cutoff)]:
+                writes = self.saver.writes.pop(key)
+                reclaimed["writes"] += len(writes)
+                reclaimed["bytes"] += sum(len(w[2][1]) for w in writes.values())
+
+            reclaimed["bytes"] += self._drop_unreferenced_blobs(thread_id, checkpoint_ns)
+            if not checkpoints:
+                del self.saver.storage[thread_id][checkpoint_ns]
+        return reclaimed
+
+    def _drop_unreferenced_blobs(self, thread_id, checkpoint_ns):
+        # Channel values are stored once per version and shared between checkpoints
+        live = set()
+        for checkpoint, _, _ in self.saver.storage[thread_id][checkpoint_ns].values():
+            live.update(self.saver.serde.loads_typed(checkpoint)["channel_versions"].items())
+
+        freed = 0
+        for key in [k for k in self.saver.blobs if k[:2] == (thread_id, checkpoint_ns) and k[2:] not in live]:
+            freed += len(self.saver.blobs.pop(key)[1])
+        return freed
+
+
+class CheckpointRetention:
+    """
+    Enforces "keep the last keep_last checkpoints per thread, drop threads idle for
+    longer than idle_seconds" on a checkpoint backend. Deletions are collected into
+    batches of batch_size filters and applied with one bulk operation per collection.
+    """
+
+    def __init__(self, backend, keep_last=DEFAULT_KEEP_LAST, idle_seconds=DEFAULT_IDLE_SECONDS, batch_size=DEFAULT_BATCH_SIZE):
+        self.backend = backend
+        self.keep_last = keep_last
+        self.idle_seconds = idle_seconds
+        self.batch_size = batch_size
+        self._counters = {
+            "runs": 0,
+            "threads_pruned": 0,
+            "threads_expired": 0,
+            "checkpoints_deleted": 0,
+            "writes_deleted": 0,
+            "bytes_reclaimed": 0,
+            "last_run_at": None,
+            "last_run_seconds": None,
+        }
+        self._lock = threading.Lock()
+
+    def run_once(self, now=None):
+        """
+        One full pass over all threads. Returns what this pass reclaimed.
+        """
+        started = time.monotonic()
+        now = now or time.time()
+        run = {"threads_pruned": 0, "threads_expired": 0, "checkpoints_deleted": 0, "writes_deleted": 0, "bytes_reclaimed": 0}
+        filters = []
+
+        def flush():
+            if filters:
+                reclaimed = self.backend.delete(filters)
+                run["checkpoints_deleted"] += reclaimed["checkpoints"]
+                run["writes_deleted"] += reclaimed["writes"]
+                run["bytes_reclaimed"] += reclaimed["bytes"]
+                filters.clear()
+
+        for thread_id, checkpoint_ns, count, latest_id in list(self.backend.threads()):
+            scope = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+            if self.idle_seconds and now - checkpoint_time(latest_id) > self.idle_seconds:
+                filters.append(scope)
+                run["threads_expired"] += 1
+            elif self.keep_last and count > self.keep_last:
+                cutoff = self.backend.nth_newest(thread_id, checkpoint_ns, self.keep_last)
+                if cutoff is None:
+                    continue
+                filters.append({**scope, "checkpoint_id": {"$lt": cutoff}})
+                run["threads_pruned"] += 1
+            if len(filters) >= self.batch_size:
+                flush()
+        flush()
+
+        with self._lock:
+            for name, value in run.items():
+                self._counters[name] += value
+            self._counters["runs"] += 1
+            self._counters["last_run_at"] = now
+            self._counters["last_run_seconds"] = round(time.monotonic() - started, 3)
+        return run
+
+    async def run_forever(self, interval=DEFAULT_INTERVAL_SECONDS):
+        while True:
+            # First pass one interval after startup, so it never competes with boot
+            await asyncio.sleep(interval)
+            try:
+                run = await run_in_executor("mongo", self.run_once)
+                if run["checkpoints_deleted"] or run["writes_deleted"]:
+                    logger.info("Checkpoint retention pass", extra=run)
+            except Exception:
+                logger.exception("Error in checkpoint retention")
+
+    def stats(self):
+        with self._lock:
+            return {"keep_last": self.keep_last, "idle_seconds": self.idle_seconds, **self._counters}
+
+
+def create_retention(backend):
+    """
+    Build the retention engine from CHECKPOINT_KEEP_LAST, CHECKPOINT_IDLE_SECONDS and
+    CHECKPOINT_RETENTION_BATCH_SIZE (0 disables the corresponding rule).
+    """
+    return CheckpointRetention(
+        backend,
+        keep_last=int(os.getenv("CHECKPOINT_KEEP_LAST", DEFAULT_KEEP_LAST)),
+        idle_seconds=int(os.getenv("CHECKPOINT_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)),
+        batch_size=int(os.getenv("CHECKPOINT_RETENTION_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+    )
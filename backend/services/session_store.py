@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime, timezone
+
+from services.executors import run_in_executor
+
+# Summaries should not outlive the checkpoints they describe (1-day TTL on "ts")
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+def session_summary(thread_id, snapshot, derivative_keys=None):
+    """
+    Build the small per-thread document /session serves from a graph state snapshot.
+    URLs are minted from the keys on read; the URL fields are only set for legacy sessions.
+    derivative_keys are the generated image's display copy and thumbnail, once stored.
+    """
+    values = snapshot.values or {}
+    return {
+        "thread_id": thread_id,
+        "checkpoint_id": (snapshot.config or {}).get("configurable", {}).get("checkpoint_id"),
+        "original_image_key": values.get("original_image_key"),
+        "original_image_url": values.get("original_image_url"),
+        "generated_image_key": values.get("generated_image_key"),
+        "generated_image_url": values.get("generated_image_url"),
+        "items": values.get("items", []),
+        "derivative_keys": derivative_keys,
+    }
+
+
+class InMemorySessionStore:
+    """
+    Summary store for tests and single-process runs without MongoDB.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, thread_id):
+        with self._lock:
+            summary = self._data.get(thread_id)
+            return dict(summary) if summary else None
+
+    def set(self, summary):
+        with self._lock:
+            self._data[summary["thread_id"]] = {**self._data.get(summary["thread_id"], {}), **summary}
+
+    def set_derivatives(self, thread_id, generated_key, keys):
+        with self._lock:
+            summary = self._data.get(thread_id)
+            if summary is not None and summary.get("generated_image_key") == generated_key:
+                summary["derivative_keys"] = dict(keys)
+
+
+class MongoSessionStore:
+    """
+    One document per thread, keyed by thread_id, so a read is a single _id lookup.
+    """
+
+    def __init__(self, collection, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index("updated_at", expireAfterSeconds=self.ttl_seconds)
+
+    def get(self, thread_id):
+        return self.collection.find_one({"_id": thread_id}, {"_id": 0, "updated_at": 0})
+
+    def set(self, summary):
+        # $set, not a replace: fields written by others (a batch's variant_thread_ids) survive a refresh
+        self.collection.update_one(
+            {"_id": summary["thread_id"]},
+            {"$set": {**summary, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def set_derivatives(self, thread_id, generated_key, keys):
+        # Only while the thread still shows that image; a newer generation has its own
+        self.collection.update_one(
+            {"_id": thread_id, "generated_image_key": generated_key},
+            {"$set": {"derivative_keys": keys}},
+        )
+
+
+class SessionSummaries:
+    """
+    Read/write front for the summary store; calls run on the "mongo" executor.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or InMemorySessionStore()
+
+    async def aget(self, thread_id):
+        return await run_in_executor("mongo", self.store.get, thread_id)
+
+    async def aset(self, summary):
+        await run_in_executor("mongo", self.store.set, summary)
+
+    async def aset_derivatives(self, thread_id, generated_key, keys):
+        await run_in_executor("mongo", self.store.set_derivatives, thread_id, generated_key, keys)
+
+
+session_summaries = SessionSummaries()
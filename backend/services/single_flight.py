@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from services.blob_store import hash_from_key
+from services.catalog import FIELDS, catalog
+from services.executors import run_in_executor
+from utils.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+single_flight_requests = counter("single_flight_requests_total", "Generation requests by how they were served", ("role",))
+
+RUNNING = "running"
+DONE = "done"
+
+DEFAULT_LEASE_SECONDS = 120
+# How long a finished run's result waits for the requests polling its lease
+DEFAULT_RESULT_SECONDS = 30
+
+
+def generation_key(thread_id, state):
+    """
+    Idempotency key for a generation request: the thread, the normalized options and
+    the source image. A double-click or a client retry produces the same key.
+    """
+    original_key = state.get("original_image_key")
+    payload = {
+        "thread_id": thread_id,
+        "options": {field: state.get(field) for field in FIELDS},
+        "additional_prompt": " ".join((state.get("additional_prompt") or "").split()),
+        "image": hash_from_key(original_key) or original_key,
+        "bypass_cache": bool(state.get("bypass_cache")),
+        "catalog": catalog.cache_version,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class InMemoryLeaseStore:
+    """
+    Lease store for tests and single-process runs without MongoDB.
+    """
+
+    def __init__(self):
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, owner, ttl):
+        """
+        Start a run unless someone else's is live. A finished run doesn't count: its
+        result is only there for the requests that waited on it.
+        Returns (acquired, lease); lease is ours when acquired, else the holder's.
+        """
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease["expires_at"] <= now or lease["state"] == DONE:
+                lease = {"owner": owner, "run": uuid.uuid4().hex, "state": RUNNING, "expires_at": now + ttl}
+                self._leases[key] = lease
+                return True, dict(lease)
+            return False, dict(lease)
+
+    def get(self, key):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease["expires_at"] <= time.time():
+                return None
+            return dict(lease)
+
+    def renew(self, key, run, ttl):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease["run"] != run or lease["state"] != RUNNING:
+                return False
+            lease["expires_at"] = time.time() + ttl
+            return True
+
+    def complete(self, key, run, result, ttl):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease["run"] == run:
+                lease.update(state=DONE, result=result, expires_at=time.time() + ttl)
+
+    def release(self, key, run):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease["run"] == run and lease["state"] == RUNNING:
+                del self._leases[key]
+
+
+class MongoLeaseStore:
+    """
+    One document per in-flight generation, keyed by its idempotency key. The unique _id
+    makes acquiring atomic across workers and replicas; a holder that stops renewing
+    (crashed worker) loses the lease once expires_at passes.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        # Finished runs and abandoned leases are cleaned up by Mongo
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def acquire(self, key, owner, ttl):
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.now(timezone.utc)
+        lease = {"owner": owner, "run": uuid.uuid4().hex, "state": RUNNING, "expires_at": now + timedelta(seconds=ttl)}
+        try:
+            self.collection.insert_one({"_id": key, **lease})
+            return True, lease
+        except DuplicateKeyError:
+            pass
+
+        # Finished, or expired (the TTL monitor only runs once a minute): take it over
+        taken = self.collection.find_one_and_update(
+            {"_id": key, "$or": [{"state": DONE}, {"expires_at": {"$lte": now}}]},
+            {"$set": lease, "$unset": {"result": ""}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is not None:
+            return True, lease
+        existing = self.collection.find_one({"_id": key})
+        if existing is None:
+            # Released between our two writes; let the caller try again
+            return False, None
+        return False, existing
+
+    def get(self, key):
+        return self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+
+    def renew(self, key, run, ttl):
+        result = self.collection.update_one(
+            {"_id": key, "run": run, "state": RUNNING},
+            {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+        )
+        return result.matched_count == 1
+
+    def complete(self, key, run, result, ttl):
+        self.collection.update_one(
+            {"_id": key, "run": run},
+            {"$set": {"state": DONE, "result": result, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+        )
+
+    def release(self, key, run):
+        self.collection.delete_one({"_id": key, "run": run, "state": RUNNING})
+
+
+class SingleFlight:
+    """
+    Runs each idempotency key at most once at a time, across the whole deployment.
+    Only runs still in flight are shared; a request that arrives after one finished
+    starts a new run, so retries and "regenerate" clicks always generate again.
+
+    In-process duplicates wait on the first request's task. The task holds a lease in
+    the store while it runs (renewed every lease_seconds / 3), so requests for the same
+    key on other workers poll it until it finishes. The finished lease keeps the result
+    for result_seconds, long enough for those pollers to pick it up; it is never handed
+    to a request that didn't wait for that run. A failed run releases the lease and a
+    waiting request takes over. Results must be small and JSON-safe.
+    """
+
+    def __init__(self, store=None, lease_seconds=DEFAULT_LEASE_SECONDS, result_seconds=DEFAULT_RESULT_SECONDS, poll_interval=0.5):
+        self.store = store or InMemoryLeaseStore()
+        self.lease_seconds = lease_seconds
+        self.result_seconds = result_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._inflight = {}
+        self.counters = {"leaders": 0, "local_followers": 0, "remote_followers": 0, "store_errors": 0}
+
+    async def run(self, key, produce):
+        """
+        Return produce()'s result for key, running it only if no one else currently is.
+        Cancelling a caller cancels the shared run only when no other caller is waiting.
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(self._lead_or_wait(key, produce)), "waiters": 0}
+            self._inflight[key] = entry
+            entry["task"].add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._count("local_followers")
+
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        except asyncio.CancelledError:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0:
+                entry["task"].cancel()
+            raise
+
+    async def _lead_or_wait(self, key, produce):
+        # The run on another worker this request is waiting for, once there is one
+        waiting_for = None
+        while True:
+            if waiting_for is None:
+                try:
+                    acquired, lease = await run_in_executor("mongo", self.store.acquire, key, self.owner, self.lease_seconds)
+                except Exception as e:
+                    # Without the store we can still serve the request, just not deduplicate it
+                    self.counters["store_errors"] += 1
+                    logger.warning("Lease store unavailable, running without a lease: %s", e)
+                    self._count("leaders")
+                    return await produce()
+
+                if acquired:
+                    self._count("leaders")
+                    return await self._lead(key, lease["run"], produce)
+                if lease is not None:
+                    waiting_for = lease["run"]
+                    self._count("remote_followers")
+                    logger.info("Waiting for a duplicate generation on another worker", extra={"owner": lease.get("owner")})
+                    await asyncio.sleep(self.poll_interval)
+                continue
+
+            lease = await self._store_call(self.store.get, key)
+            if lease is None or lease["run"] != waiting_for:
+                # It failed, expired or was replaced: try to run it ourselves
+                waiting_for = None
+                continue
+            if lease["state"] == DONE:
+                return lease["result"]
+            await asyncio.sleep(self.poll_interval)
+
+    async def _lead(self, key, run, produce):
+        renewer = asyncio.create_task(self._renew(key, run))
+        try:
+            result = await produce()
+        except BaseException:
+            renewer.cancel()
+            await self._store_call(self.store.release, key, run)
+            raise
+        renewer.cancel()
+        await self._store_call(self.store.complete, key, run, result, self.result_seconds)
+        return result
+
+    async def _renew(self, key, run):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self._store_call(self.store.renew, key, run, self.lease_seconds):
+                logger.warning("Lost the generation lease; another worker may run it too", extra={"key": key})
+
+    async def _store_call(self, method, *args):
+        try:
+            return await run_in_executor("mongo", method, *args)
+        except Exception as e:
+            self.counters["store_errors"] += 1
+            logger.warning("Lease store call failed: %s", e)
+            return None
+
+    def _count(self, role):
+        self.counters[role] += 1
+        single_flight_requests.inc(role=role)
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self._inflight)}
+
+
+single_flight = SingleFlight(
+    lease_seconds=int(os.getenv("GENERATION_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)),
+    result_seconds=int(os.getenv("GENERATION_RESULT_SECONDS", DEFAULT_RESULT_SECONDS)),
+)
@@ -0,0 +1,87 @@
+import os
+import time
+
+from services.aws_s3 import create_presigned_url
+from services.executors import run_in_executor
+from utils.cache import LRUCache
+
+DEFAULT_EXPIRES_IN = 3600
+DEFAULT_REFRESH_MARGIN = 300
+
+
+class UrlSigner:
+    """
+    Mints presigned GET URLs for S3 keys at response time.
+
+    Time is cut into epochs of (expires_in - refresh_margin) seconds, the same on every
+    worker. A signed URL is reused until its epoch ends, so hot keys are signed about
+    once per epoch, and everything minted in an epoch stays valid for at least
+    refresh_margin seconds after it. That makes the epoch usable in ETags: a client
+    holding a response from the current epoch holds working URLs, whichever worker
+    minted them. Graph state and summaries hold only keys; URLs never go into a checkpoint.
+    """
+
+    def __init__(self, expires_in=DEFAULT_EXPIRES_IN, refresh_margin=DEFAULT_REFRESH_MARGIN, max_items=10_000):
+        self.expires_in = expires_in
+        self.refresh_margin = min(refresh_margin, expires_in)
+        # Entries drop out of the cache exactly when they are due for re-minting
+        self.period = max(1, expires_in - self.refresh_margin)
+        self.urls = LRUCache(max_items=max_items, ttl=self.period)
+        self._epoch = None
+
+    def epoch(self):
+        """
+        The current signing epoch; workers with synchronized clocks agree on it.
+        """
+        return int(time.time() // self.period)
+
+    def _start_epoch(self):
+        # URLs from an earlier epoch may expire within this one; never hand them out again
+        epoch = self.epoch()
+        if epoch != self._epoch:
+            self.urls.clear()
+            self._epoch = epoch
+
+    def sign(self, keys):
+        """
+        Return {key: (url, expires_at)} for the given keys, signing only the ones not cached.
+        Falsy keys are skipped; keys that fail to sign are left out.
+        """
+        self._start_epoch()
+        signed = {}
+        for key in dict.fromkeys(k for k in keys if k):
+            entry = self.urls.get(key)
+            if entry is None:
+                expires_at = int(time.time()) + self.expires_in
+                url = create_presigned_url(key, expiration=self.expires_in)
+                if not url:
+                    continue
+                entry = (url, expires_at)
+                self.urls.set(key, entry)
+            signed[key] = entry
+        return signed
+
+    def url(self, key):
+        entry = self.sign([key]).get(key)
+        return entry[0] if entry else None
+
+    async def asign(self, keys):
+        keys = [k for k in keys if k]
+        self._start_epoch()
+        if all(k in self.urls for k in keys):
+            # Everything is cached: no need for an executor hop
+            return self.sign(keys)
+        return await run_in_executor("s3", self.sign, keys)
+
+    async def aurl(self, key):
+        entry = (await self.asign([key])).get(key)
+        return entry[0] if entry else None
+
+    def stats(self):
+        return self.urls.stats()
+
+
+url_signer = UrlSigner(
+    expires_in=int(os.getenv("PRESIGNED_URL_TTL_SECONDS", DEFAULT_EXPIRES_IN)),
+    refresh_margin=int(os.getenv("PRESIGNED_URL_REFRESH_SECONDS", DEFAULT_REFRESH_MARGIN)),
+)
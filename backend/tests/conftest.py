@@ -1,5 +1,37 @@
 import os
 import sys
 
+import pytest
+
 # Add the project root to sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# boto3 clients can be built offline, but need a region
+os.environ.setdefault("AWS_REGION", "us-east-1")
+# Don't build the real items model in the background of every app startup
+os.environ.setdefault("WARM_ITEMS_MODEL", "false")
+
+
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    # Caches are process-wide singletons; keep tests independent of each other
+    from graph import items_cache, prepared_images, reset_items_llm
+    from services.bedrock_governor import reset_governors
+    from services.blob_store import blob_store
+    from services.result_cache import InMemoryResultStore, result_cache
+    from services.session_store import InMemorySessionStore, session_summaries
+    from services.single_flight import InMemoryLeaseStore, single_flight
+    from services.url_signer import url_signer
+
+    blob_store.cache.clear()
+    blob_store.known_keys.clear()
+    result_cache.memory.clear()
+    result_cache.persistent = InMemoryResultStore()
+    session_summaries.store = InMemorySessionStore()
+    single_flight.store = InMemoryLeaseStore()
+    url_signer.urls.clear()
+    items_cache.clear()
+    prepared_images.clear()
+    reset_items_llm()
+    reset_governors()
+    yield
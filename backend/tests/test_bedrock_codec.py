@@ -0,0 +1,69 @@
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+from services.bedrock_codec import decode_response, encode_request
+
+
+def _legacy_roundtrip(image_bytes, response_bytes):
+    # The pre-codec implementation: str payload, json.dumps, full read + json.loads + b64decode
+    body = json.dumps({"prompt": "room", "image": base64.b64encode(image_bytes).decode("utf-8"), "strength": 0.7})
+    response_body = json.loads(io.BytesIO(response_bytes).read())
+    return body, base64.b64decode(response_body["images"][0])
+
+
+def _codec_roundtrip(image_bytes, response_bytes):
+    body = encode_request("room", image_bytes=image_bytes, strength=0.7)
+    return body, decode_response(io.BytesIO(response_bytes))
+
+
+def _peak(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_encode_request_is_valid_json():
+    image = os.urandom(1_000_003)
+    body = encode_request('a "quoted" prompt', image_bytes=image, strength=0.7, output_format="png")
+
+    payload = json.loads(body)
+    assert payload["prompt"] == 'a "quoted" prompt'
+    assert payload["strength"] == 0.7
+    assert base64.b64decode(payload["image"]) == image
+
+    pre_encoded = encode_request("p", image_base64=base64.b64encode(image))
+    assert base64.b64decode(json.loads(pre_encoded)["image"]) == image
+
+
+def test_decode_response_streams_images_and_handles_other_shapes():
+    image = os.urandom(500_001)
+    encoded = base64.b64encode(image).decode("ascii")
+
+    streamed = json.dumps({"seeds": [1], "finish_reasons": [None], "images": [encoded]}).encode()
+    assert decode_response(io.BytesIO(streamed), chunk_size=4097) == image
+
+    escaped = json.dumps({"images": [encoded.replace("/", "\\/")]}).encode().replace(b"\\\\/", b"\\/")
+    assert decode_response(io.BytesIO(escaped), chunk_size=1000) == image
+
+    artifacts = json.dumps({"artifacts": [{"base64": encoded}]}).encode()
+    assert decode_response(io.BytesIO(artifacts)) == image
+
+
+def test_codec_peak_memory_per_call():
+    image = os.urandom(4 * 1024 * 1024)
+    generated = os.urandom(6 * 1024 * 1024)
+    response = json.dumps({"seeds": [7], "finish_reasons": [None], "images": [base64.b64encode(generated).decode()]}).encode()
+
+    assert _codec_roundtrip(image, response)[1] == generated
+
+    legacy_peak = _peak(_legacy_roundtrip, image, response)
+    codec_peak = _peak(_codec_roundtrip, image, response)
+    print(f"\npeak per call: legacy={legacy_peak / 1e6:.1f} MB codec={codec_peak / 1e6:.1f} MB")
+
+    assert codec_peak < 0.6 * legacy_peak
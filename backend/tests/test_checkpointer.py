@@ -0,0 +1,128 @@
+from typing import TypedDict
+
+import pytest
+from langgraph.graph import END, StateGraph
+
+from services.checkpointer import AsyncMongoDBSaver, checkpoint_seconds
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeAsyncCollection:
+    """
+    Just enough of PyMongo's AsyncCollection for the saver's queries.
+    """
+
+    def __init__(self):
+        self.docs = []
+        self.queries = 0
+
+    async def create_index(self, keys, **kwargs):
+        return "_".join(name for name, _ in keys)
+
+    def find(self, query, limit=0, sort=None):
+        self.queries += 1
+        docs = [dict(d) for d in self.docs if _matches(d, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda d: d[key], reverse=direction == -1)
+        return FakeCursor(docs[:limit] if limit else docs)
+
+    async def find_one(self, query, sort=None):
+        return next(iter(self.find(query, limit=1, sort=sort).docs), None)
+
+    async def update_one(self, filter, update, upsert=False):
+        for doc in self.docs:
+            if _matches(doc, filter):
+                doc.update(update.get("$set", {}))
+                return
+        if upsert:
+            self.docs.append({**filter, **update.get("$set", {}), **update.get("$setOnInsert", {})})
+
+    async def bulk_write(self, operations):
+        for op in operations:
+            await self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    async def delete_many(self, query):
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeAsyncCollection())
+
+
+class CounterState(TypedDict):
+    count: int
+
+
+def _counter_graph(checkpointer):
+    workflow = StateGraph(CounterState)
+    workflow.add_node("bump", lambda state: {"count": state["count"] + 1})
+    workflow.set_entry_point("bump")
+    workflow.add_edge("bump", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+@pytest.mark.asyncio
+async def test_async_saver_round_trips_graph_state():
+    database = FakeDatabase()
+    puts_before = checkpoint_seconds.count(operation="put")
+    saver = AsyncMongoDBSaver({"room_designer": database}, db_name="room_designer")
+    await saver.setup()
+    app = _counter_graph(saver)
+
+    config = {"configurable": {"thread_id": "t1"}}
+    assert (await app.ainvoke({"count": 1}, config))["count"] == 2
+    await app.aupdate_state(config, {"count": 10})
+
+    snapshot = await app.aget_state(config)
+    assert snapshot.values == {"count": 10}
+    assert snapshot.config["configurable"]["checkpoint_id"]
+
+    history = [state async for state in app.aget_state_history(config)]
+    assert [state.values.get("count") for state in history[:2]] == [10, 2]
+
+    # Listing fetches pending writes once per thread, not once per checkpoint
+    writes = database["checkpoint_writes"]
+    writes.queries = 0
+    assert len([t async for t in saver.alist(config)]) == len(history)
+    assert writes.queries == 1
+
+    # Every checkpoint write is timed for /metrics
+    assert checkpoint_seconds.count(operation="put") - puts_before == len(history)
+    assert checkpoint_seconds.count(operation="get_tuple") > 0
+
+    await saver.adelete_thread("t1")
+    assert (await app.aget_state(config)).values == {}
@@ -1,6 +1,17 @@
+import base64
+import json
+import os
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
-from graph import build_prompt, select_items
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+from graph import _generation_cache_key, _items_cache_key, build_prompt, get_app_graph, items_cache, prewarm_items_cache, select_items
+from services.blob_store import GENERATED_PREFIX, content_key
+from services.catalog import DEFAULT_CATALOG_PATH, Catalog, catalog
+from services.result_cache import result_cache
 
 
 def test_build_prompt():
@@ -25,7 +36,7 @@ def test_build_prompt():
     assert "A big window" in prompt
 
 
-@patch("graph.ChatBedrock")
+@patch("langchain_aws.ChatBedrock")
 def test_select_items(mock_chat_bedrock):
     # Mock the LLM response
     mock_llm_instance = MagicMock()
@@ -40,3 +51,290 @@ def test_select_items(mock_chat_bedrock):
     assert result["items"][0]["name"] == "Test Item"
     assert result["items"][0]["price"] == "100"
     assert "amazon.com" in result["items"][0]["link"]
+
+
+@pytest.mark.asyncio
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_file")
+@patch("graph.invoke_model")
+@patch("services.blob_store.get_file")
+@patch("langchain_aws.ChatBedrock")
+async def test_graph_ainvoke_offloads_blocking_calls(mock_chat_bedrock, mock_get_file, mock_invoke_model, mock_upload_file, mock_object_exists):
+    threads = {}
+
+    def record(name, value):
+        def call(*args, **kwargs):
+            threads[name] = threading.current_thread().name
+            return value
+
+        return call
+
+    mock_chat_bedrock.return_value.invoke.side_effect = record("llm", MagicMock(content='[{"name": "Lamp", "price": "20"}]'))
+    mock_get_file.side_effect = record("get_file", b"original")
+    mock_invoke_model.side_effect = record("invoke_model", b"generated")
+    mock_upload_file.side_effect = lambda data, key: key
+
+    state = {
+        "original_image_key": "room.png",
+        "original_filename": "room.png",
+        "style": "Japandi",
+        "mood": "Calm & Zen",
+        "functionality": "Sleeping / Rest",
+        "palette": "Earth Tones",
+        "clutter": "Showroom Perfect",
+        "additional_prompt": "",
+        "items": [],
+    }
+    result = await get_app_graph().ainvoke(state)
+
+    assert result["generated_image_key"].startswith("generated/")
+    # URLs are minted per response, never checkpointed
+    assert "generated_image_url" not in result
+    assert result["items"][0]["name"] == "Lamp"
+    assert threads["llm"].startswith("bedrock-io")
+    assert threads["invoke_model"].startswith("bedrock-io")
+    assert threads["get_file"].startswith("s3-io")
+
+
+@pytest.mark.asyncio
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_file")
+@patch("graph.invoke_model")
+@patch("services.blob_store.get_file")
+@patch("langchain_aws.ChatBedrock")
+async def test_checkpoints_hold_blob_keys_not_image_bytes(mock_chat_bedrock, mock_get_file, mock_invoke_model, mock_upload_file, mock_object_exists):
+    original = os.urandom(2 * 1024 * 1024)
+    generated = os.urandom(3 * 1024 * 1024)
+    mock_chat_bedrock.return_value.invoke.return_value.content = '[{"name": "Rug", "price": "50"}]'
+    mock_get_file.return_value = original
+    mock_invoke_model.return_value = generated
+    mock_upload_file.side_effect = lambda data, key: key
+
+    saver = InMemorySaver()
+    graph = get_app_graph(saver)
+    config = {"configurable": {"thread_id": "size-thread"}}
+    state = {
+        "original_image_key": "room.png",
+        "original_filename": "room.png",
+        "style": "Bohemian",
+        "mood": "Cozy & Warm",
+        "functionality": "Relaxation / Lounge",
+        "palette": "Pastel",
+        "clutter": "Organized but Lived-in",
+        "additional_prompt": "",
+        "items": [],
+    }
+    result = await graph.ainvoke(state, config=config)
+    assert result["generated_image_key"] == content_key(generated, "generated.png", prefix=GENERATED_PREFIX)
+
+    total_bytes = 0
+    for checkpoint in saver.list(config):
+        total_bytes += len(saver.serde.dumps_typed(checkpoint.checkpoint)[1])
+        for _, _, value in checkpoint.pending_writes:
+            total_bytes += len(saver.serde.dumps_typed(value)[1])
+
+    # Several checkpoints for the whole run, still only a few KB in total
+    assert total_bytes < 32 * 1024
+
+
+@pytest.mark.asyncio
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_file")
+@patch("graph.invoke_model")
+@patch("services.blob_store.get_file")
+@patch("langchain_aws.ChatBedrock")
+async def test_generation_cache_skips_bedrock_on_repeat(mock_chat_bedrock, mock_get_file, mock_invoke_model, mock_upload_file, mock_object_exists):
+    mock_chat_bedrock.return_value.invoke.return_value.content = '[{"name": "Desk", "price": "150"}]'
+    mock_get_file.return_value = b"photo"
+    mock_invoke_model.return_value = b"generated"
+    mock_upload_file.side_effect = lambda data, key: key
+
+    graph = get_app_graph()
+    state = {
+        "original_image_key": content_key(b"photo", "room.png"),
+        "original_filename": "room.png",
+        "style": "Industrial Loft",
+        "mood": "Professional & Focused",
+        "functionality": "Deep Focus / Work",
+        "palette": "Monochrome",
+        "clutter": "Showroom Perfect",
+        "additional_prompt": "",
+        "items": [],
+    }
+    before = result_cache.stats()
+
+    first = await graph.ainvoke(state)
+    second = await graph.ainvoke(state)
+    assert first["generated_image_key"] == second["generated_image_key"]
+    assert mock_invoke_model.call_count == 1
+    # The photo is downloaded and encoded once; later runs reuse the prepared payload
+    assert mock_get_file.call_count == 1
+
+    await graph.ainvoke({**state, "bypass_cache": True})
+    assert mock_invoke_model.call_count == 2
+
+    after = result_cache.stats()
+    assert after["memory_hits"] - before["memory_hits"] == 1
+    assert after["bypassed"] - before["bypassed"] == 1
+
+
+@patch("langchain_aws.ChatBedrock")
+def test_select_items_memoizes_by_normalized_prompt(mock_chat_bedrock):
+    mock_chat_bedrock.return_value.invoke.return_value.content = '[{"name": "Bean Bag", "price": "80"}]'
+
+    first = select_items({"generated_prompt": "Bohemian style, plants."})
+    second = select_items({"generated_prompt": "  bohemian STYLE,   plants. "})
+
+    assert first == second
+    assert mock_chat_bedrock.return_value.invoke.call_count == 1
+    # A single LLM client is kept for the process
+    assert mock_chat_bedrock.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_file")
+@patch("graph.invoke_model")
+@patch("services.blob_store.get_file")
+@patch("langchain_aws.ChatBedrock")
+async def test_resumed_thread_skips_unchanged_stages(mock_chat_bedrock, mock_get_file, mock_invoke_model, mock_upload_file, mock_object_exists):
+    mock_chat_bedrock.return_value.invoke.return_value.content = '[{"name": "Floor Lamp", "price": "90"}]'
+    mock_get_file.return_value = b"photo"
+    mock_invoke_model.side_effect = lambda prompt, **kwargs: prompt.encode()
+    mock_upload_file.side_effect = lambda data, key: key
+
+    graph = get_app_graph(InMemorySaver())
+    config = {"configurable": {"thread_id": "refine-thread"}}
+    state = {
+        "original_image_key": "room.png",
+        "original_filename": "room.png",
+        "style": "Scandinavian / Hygge",
+        "mood": "Cozy & Warm",
+        "functionality": "Relaxation / Lounge",
+        "palette": "Warm Neutrals",
+        "clutter": "Organized but Lived-in",
+        "additional_prompt": "",
+        "items": [],
+    }
+
+    first = await graph.ainvoke(state, config=config)
+    assert first["skipped_stages"] == []
+
+    # Refining the details: new prompt and image, same items and photo
+    refined = await graph.ainvoke({**state, "additional_prompt": "add a reading nook"}, config=config)
+    assert refined["skipped_stages"] == ["select_items", "prepare_image"]
+    assert "reading nook" in refined["generated_prompt"]
+    assert refined["items"] == first["items"]
+    assert mock_invoke_model.call_count == 2
+    assert mock_chat_bedrock.return_value.invoke.call_count == 1
+    assert mock_get_file.call_count == 1
+
+    # Same inputs again: nothing before generate_image runs, and the image is a cache hit
+    again = await graph.ainvoke({**state, "additional_prompt": " add a  reading nook "}, config=config)
+    assert again["skipped_stages"] == ["build_prompt", "select_items", "prepare_image"]
+    assert again["generated_image_key"] == refined["generated_image_key"]
+    assert mock_invoke_model.call_count == 2
+
+    # A different option picks new items; the photo is still reused
+    restyled = await graph.ainvoke({**state, "style": "Japandi"}, config=config)
+    assert restyled["skipped_stages"] == ["prepare_image"]
+    assert mock_chat_bedrock.return_value.invoke.call_count == 2
+    assert mock_get_file.call_count == 1
+
+
+def test_prompt_cache_keys_follow_the_catalog_version():
+    with open(DEFAULT_CATALOG_PATH) as f:
+        data = json.load(f)
+    items_key, generation_key = _items_cache_key("Japandi style."), _generation_cache_key("abc123", "Japandi style.")
+
+    # Same prompt, new catalog version: nothing cached under the old one may be served
+    with patch("graph.catalog", Catalog({**data, "version": "test-2"})):
+        assert _items_cache_key("Japandi style.") != items_key
+        assert _generation_cache_key("abc123", "Japandi style.") != generation_key
+
+    # An edited fragment changes the key even if the version wasn't bumped
+    data["fields"][0]["options"][0]["prompt"] += " Extra."
+    with patch("graph.catalog", Catalog(data)):
+        assert _items_cache_key("Japandi style.") != items_key
+
+
+@pytest.mark.asyncio
+@patch("graph.option_combinations")
+@patch("langchain_aws.ChatBedrock")
+async def test_prewarm_items_cache_fills_every_combination(mock_chat_bedrock, mock_option_combinations):
+    mock_chat_bedrock.return_value.invoke.return_value.content = '[{"name": "Shelf", "price": "60"}]'
+    combos = [
+        {
+            "style": "Japandi",
+            "mood": mood,
+            "functionality": "Creative Studio",
+            "palette": "Pastel",
+            "clutter": "Maximalist / Busy",
+            "additional_prompt": "",
+        }
+        for mood in ("Calm & Zen", "Cozy & Warm", "Luxury & Elegant")
+    ]
+    mock_option_combinations.side_effect = lambda: iter(combos)
+
+    assert await prewarm_items_cache(concurrency=2) == 3
+    assert await prewarm_items_cache(concurrency=2) == 0
+
+    result = select_items(build_prompt(combos[1]))
+    assert result["items"][0]["name"] == "Shelf"
+    assert mock_chat_bedrock.return_value.invoke.call_count == 3
+
+
+def test_items_cache_holds_every_catalog_combination():
+    combinations = len(list(catalog.combinations()))
+    assert catalog.combination_count() == combinations
+    # Otherwise the pre-warm evicts the prompts it just cached
+    assert items_cache.max_items >= combinations
+
+
+@pytest.mark.asyncio
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_file")
+@patch("graph.invoke_model")
+@patch("services.blob_store.get_file")
+@patch("langchain_aws.ChatBedrock")
+async def test_image_fetch_overlaps_item_selection(mock_chat_bedrock, mock_get_file, mock_invoke_model, mock_upload_file, mock_object_exists):
+    delay = 0.3
+
+    def slow_llm(messages):
+        time.sleep(delay)
+        return MagicMock(content='[{"name": "Armchair", "price": "300"}]')
+
+    def slow_get_file(key):
+        time.sleep(delay)
+        return b"photo"
+
+    mock_chat_bedrock.return_value.invoke.side_effect = slow_llm
+    mock_get_file.side_effect = slow_get_file
+    mock_invoke_model.return_value = b"generated"
+    mock_upload_file.side_effect = lambda data, key: key
+
+    state = {
+        "original_image_key": "legacy-room.jpg",
+        "original_filename": "legacy-room.jpg",
+        "style": "Mid-Century Modern",
+        "mood": "Energetic & Creative",
+        "functionality": "Gaming / Streaming",
+        "palette": "Cool Blues",
+        "clutter": "Organized but Lived-in",
+        "additional_prompt": "",
+        "items": [],
+    }
+    start = time.perf_counter()
+    result = await get_app_graph().ainvoke(state)
+    elapsed = time.perf_counter() - start
+
+    assert result["items"][0]["name"] == "Armchair"
+    assert mock_invoke_model.call_args.kwargs["image_base64"] == base64.b64encode(b"photo")
+    # Sequential would be >= 2 * delay; overlapped branches finish in about one delay
+    assert elapsed < 1.6 * delay
+
+
+def test_get_app_graph_compiles_once_per_checkpointer():
+    saver = InMemorySaver()
+    assert get_app_graph(saver) is get_app_graph(saver)
+    assert get_app_graph(InMemorySaver()) is not get_app_graph(saver)
@@ -0,0 +1,72 @@
+import io
+
+from PIL import Image
+
+from utils.image_helpers import encode_derivatives, preprocess_image, resize_image
+
+
+def _jpeg(size, exif=None, color=(120, 90, 60)):
+    buffer = io.BytesIO()
+    image = Image.new("RGB", size, color)
+    if exif is not None:
+        image.save(buffer, format="JPEG", exif=exif.tobytes())
+    else:
+        image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_preprocess_applies_orientation_downscales_and_strips_metadata():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees: stored landscape, displayed portrait
+    exif[0x010F] = "PhoneMaker"
+    original = _jpeg((4000, 3000), exif=exif)
+
+    processed = preprocess_image(original, max_pixels=1024 * 1024)
+
+    with Image.open(io.BytesIO(processed)) as image:
+        width, height = image.size
+        assert width < height
+        assert width * height <= 1024 * 1024
+        assert abs(width / height - 3 / 4) < 0.01
+        assert len(image.getexif()) == 0
+        assert "icc_profile" not in image.info
+
+
+def test_preprocess_respects_size_budget():
+    noise = Image.effect_noise((1600, 1200), 100).convert("RGB")
+    buffer = io.BytesIO()
+    noise.save(buffer, format="PNG")
+
+    processed = preprocess_image(buffer.getvalue(), max_bytes=400 * 1024)
+
+    assert len(processed) <= 400 * 1024
+    assert processed[:2] == b"\xff\xd8"
+
+
+def test_preprocess_passes_through_undecodable_bytes():
+    assert preprocess_image(b"not an image") == b"not an image"
+
+
+def test_resize_image_fits_box():
+    resized = resize_image(_jpeg((3000, 1000)), size=(512, 512))
+
+    with Image.open(io.BytesIO(resized)) as image:
+        assert image.size == (512, 171)
+
+
+def test_encode_derivatives_downscales_and_compresses():
+    buffer = io.BytesIO()
+    Image.effect_noise((1200, 800), 20).convert("RGB").save(buffer, format="PNG")
+    png = buffer.getvalue()
+    specs = {
+        "display": {"format": "webp", "max_edge": 1024, "quality": 80},
+        "thumbnail": {"format": "webp", "max_edge": 200, "quality": 70},
+    }
+
+    derived = encode_derivatives(png, specs)
+
+    with Image.open(io.BytesIO(derived["display"])) as image:
+        assert image.format == "WEBP" and image.size == (1024, 683)
+    with Image.open(io.BytesIO(derived["thumbnail"])) as image:
+        assert image.size == (200, 133)
+    assert len(derived["thumbnail"]) < len(derived["display"]) < len(png)
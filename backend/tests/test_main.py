@@ -1,14 +1,58 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
 
 from main import app
+from services.jobs import QueueFull
+from services.session_store import InMemorySessionStore
+from services.single_flight import InMemoryLeaseStore
+from services.url_signer import url_signer
+from utils.startup_profile import import_times
+
+
+@contextmanager
+def patched_backends(graph=None):
+    # No real Mongo: stub both clients and the checkpointer, and hand lifespan a mock graph
+    async_client = MagicMock()
+    async_client.close = AsyncMock()
+    async_client.admin.command = AsyncMock(return_value={"ok": 1})
+    with (
+        patch("main.MongoClient"),
+        patch("main.AsyncMongoClient", return_value=async_client),
+        patch("services.checkpointer.AsyncMongoDBSaver") as saver,
+    ):
+        saver.return_value.setup = AsyncMock()
+        with patch("main.get_app_graph", return_value=graph or MagicMock()):
+            yield async_client
+
+
+@pytest.fixture(autouse=True)
+def in_memory_session_store():
+    # lifespan would otherwise install Mongo-backed stores over the stubbed MongoClient
+    with (
+        patch("main.MongoSessionStore", side_effect=lambda collection: InMemorySessionStore()),
+        patch("main.MongoLeaseStore", side_effect=lambda collection: InMemoryLeaseStore()),
+    ):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def fake_presign():
+    with patch("services.url_signer.create_presigned_url", side_effect=lambda key, expiration=3600: f"https://mock-s3/{key}") as mock_presign:
+        yield mock_presign
 
 
 @pytest.fixture
 def client():
-    with patch("main.MongoClient"), patch("main.MongoDBSaver"), patch("main.get_app_graph"):
+    with patched_backends():
         with TestClient(app) as c:
             yield c
 
@@ -19,34 +63,34 @@ def test_read_root(client):
     assert response.json() == {"message": "AI Room Designer API is running"}
 
 
-@patch("main.upload_file")
-@patch("main.create_presigned_url")
-def test_generate_room(mock_create_presigned_url, mock_upload_file, client):
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_fileobj")
+def test_generate_room(mock_upload_fileobj, mock_object_exists, client):
     # Mock S3 upload
-    mock_upload_file.return_value = "mock_original_key"
-
-    # Mock Presigned URL
-    mock_create_presigned_url.side_effect = lambda key: f"https://mock-s3/{key}"
+    mock_upload_fileobj.return_value = "mock_original_key"
 
     # Mock Graph Logic (stored in app.state)
     mock_graph = MagicMock()
-    mock_graph.invoke.return_value = {
-        "generated_image_url": "https://mock-s3/mock_generated_key",
-        "items": [{"name": "Sofa", "price": 100, "link": "http://amazon.com"}],
-    }
+    mock_graph.ainvoke = AsyncMock(
+        return_value={
+            "generated_image_key": "mock_generated_key",
+            "items": [{"name": "Sofa", "price": 100, "link": "http://amazon.com"}],
+        }
+    )
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
 
-    # Let's patch imports used in lifespan to avoid real DB connection
-    with patch("main.MongoClient"), patch("main.MongoDBSaver"), patch("main.get_app_graph", return_value=mock_graph):
+    # Stub the backends used in lifespan to avoid real DB connection
+    with patched_backends(mock_graph):
         # We need a new client here to trigger lifespan with mocks
         with TestClient(app) as test_client:
             # Create a mock file
             files = {"file": ("test.jpg", b"fake_image_content", "image/jpeg")}
             data = {
-                "style": "Modern",
-                "mood": "Cozy",
-                "functionality": "Living",
-                "palette": "Neutral",
-                "clutter": "Low",
+                "style": "Modern Minimalist",
+                "mood": "Cozy & Warm",
+                "functionality": "Relaxation / Lounge",
+                "palette": "Warm Neutrals",
+                "clutter": "Organized but Lived-in",
                 "additional_prompt": "Test prompt",
                 "thread_id": "test-thread-123",
             }
@@ -62,18 +106,174 @@ def test_generate_room(mock_create_presigned_url, mock_upload_file, client):
             assert json_response["thread_id"] == "test-thread-123"
 
 
+@patch("services.blob_store.MAX_UPLOAD_BYTES", 1024)
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_fileobj", side_effect=lambda fileobj, key: key)
+def test_upload_is_streamed_and_rejected_over_limit(mock_upload_fileobj, mock_object_exists):
+    mock_graph = MagicMock()
+    mock_graph.aupdate_state = AsyncMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as client:
+            photo = b"p" * 1000
+            response = client.post("/init-session", files={"file": ("room.JPG", photo, "image/jpeg")})
+            assert response.status_code == 200
+            response = client.post("/init-session", files={"file": ("room.jpg", b"p" * 1025, "image/jpeg")})
+            assert response.status_code == 413
+
+    # The S3 upload gets the spooled file itself, keyed by the hash computed while streaming
+    fileobj, key = mock_upload_fileobj.call_args.args
+    assert key == f"uploads/{hashlib.sha256(photo).hexdigest()}.jpg"
+    assert not isinstance(fileobj, (bytes, bytearray))
+    assert mock_upload_fileobj.call_count == 1
+
+
+@patch("main.MAX_UPLOAD_BYTES", 1024)
+def test_oversized_body_rejected_before_parsing(client):
+    files = {"file": ("room.jpg", b"p" * (200 * 1024), "image/jpeg")}
+    response = client.post("/generate", files=files, data={"style": "Japandi"}, headers={"Origin": "http://localhost:3000"})
+    assert response.status_code == 413
+    # The frontend can only read the error if the rejection carries CORS headers
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+
+@patch("main.store_upload", new_callable=AsyncMock)
+def test_generate_rejects_unknown_options_before_upload(mock_store_upload):
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
+    mock_graph.ainvoke = AsyncMock()
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            files = {"file": ("room.jpg", b"room-bytes", "image/jpeg")}
+            data = {"style": "Art Deco", "mood": "Calm & Zen", "functionality": "Sleeping / Rest", "palette": "Pastel", "clutter": "Spotless"}
+            response = test_client.post("/generate", files=files, data=data)
+
+    assert response.status_code == 422
+    assert {tuple(error["loc"]) for error in response.json()["detail"]} == {("body", "style"), ("body", "clutter")}
+    mock_store_upload.assert_not_awaited()
+    mock_graph.aget_state.assert_not_awaited()
+    mock_graph.ainvoke.assert_not_awaited()
+
+
+def test_catalog_lists_options_without_prompts_and_honours_etag(client):
+    response = client.get("/catalog")
+    assert response.status_code == 200
+    body = response.json()
+    assert [field["id"] for field in body["fields"]] == ["style", "mood", "functionality", "palette", "clutter"]
+    style = body["fields"][0]
+    assert {"value": "Japandi", "label": "Japandi"}.items() <= next(o for o in style["options"] if o["value"] == "Japandi").items()
+    assert "prompt" not in json.dumps(body)
+
+    etag = response.headers["ETag"]
+    assert body["version"] in etag
+    assert client.get("/catalog", headers={"If-None-Match": etag}).status_code == 304
+
+
+@patch("services.blob_store.object_exists", return_value=True)
+def test_duplicate_generate_requests_share_one_graph_run(mock_object_exists):
+    async def slow_ainvoke(state, config=None):
+        await asyncio.sleep(0.2)
+        return {"generated_image_key": "generated", "items": [{"name": "Futon", "price": "400", "link": "https://www.amazon.com/s?k=Futon"}]}
+
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
+    mock_graph.ainvoke = AsyncMock(side_effect=slow_ainvoke)
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            data = {
+                "style": "Japandi",
+                "mood": "Calm & Zen",
+                "functionality": "Sleeping / Rest",
+                "palette": "Pastel",
+                "clutter": "Showroom Perfect",
+                "thread_id": "double-click",
+            }
+
+            def post():
+                return test_client.post("/generate", files={"file": ("room.jpg", b"room-bytes", "image/jpeg")}, data=data)
+
+            before = test_client.get("/cache/stats").json()["single_flight"]
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                responses = list(pool.map(lambda _: post(), range(3)))
+            after = test_client.get("/cache/stats").json()["single_flight"]
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert all(response.json()["items"][0]["name"] == "Futon" for response in responses)
+    assert mock_graph.ainvoke.await_count == 1
+    assert after["leaders"] - before["leaders"] == 1
+    assert after["local_followers"] - before["local_followers"] == 2
+
+
+def test_back_to_back_bypass_cache_requests_each_call_the_model():
+    from benchmarks.bench_load import synthetic_photo
+    from benchmarks.fakes import in_process_backends
+
+    with in_process_backends() as fakes:
+        with TestClient(app) as test_client:
+            data = {
+                "style": "Japandi",
+                "mood": "Calm & Zen",
+                "functionality": "Sleeping / Rest",
+                "palette": "Pastel",
+                "clutter": "Showroom Perfect",
+                "thread_id": "regenerate",
+                "bypass_cache": "true",
+            }
+            photo = synthetic_photo(1, size=(64, 48))
+            for _ in range(2):
+                response = test_client.post("/generate", files={"file": ("room.jpg", photo, "image/jpeg")}, data=data)
+                assert response.status_code == 200
+
+    assert fakes.bedrock.calls == 2
+
+
+def test_session_serves_derivatives_recorded_in_its_summary_without_s3_calls():
+    from benchmarks.bench_load import synthetic_photo
+    from benchmarks.fakes import in_process_backends
+    from services.blob_store import blob_store
+    from services.derivatives import derivatives
+
+    with in_process_backends(image_size=256):
+        with TestClient(app) as test_client:
+            data = {
+                "style": "Japandi",
+                "mood": "Calm & Zen",
+                "functionality": "Sleeping / Rest",
+                "palette": "Pastel",
+                "clutter": "Showroom Perfect",
+                "thread_id": "derived-thread",
+            }
+            response = test_client.post("/generate", files={"file": ("room.jpg", synthetic_photo(1, size=(64, 48)), "image/jpeg")}, data=data)
+            assert response.status_code == 200
+            test_client.portal.call(derivatives.drain)
+            # As seen from a worker that didn't build them
+            derivatives.ready.clear()
+            blob_store.known_keys.clear()
+
+            with patch("services.blob_store.object_exists") as mock_object_exists:
+                session = test_client.get("/session/derived-thread")
+            mock_object_exists.assert_not_called()
+
+    body = session.json()
+    assert body["display_url"] and body["thumbnail_url"]
+    assert session.headers["ETag"].endswith('-d"')
+
+
 def test_get_session_history(client):
     # Mock Graph Logic
     mock_graph = MagicMock()
     # Mock snapshot object
     mock_snapshot = MagicMock()
     mock_snapshot.values = {
-        "generated_image_url": "https://mock-s3/history_image",
+        "generated_image_key": "history_image",
         "items": [{"name": "Lamp", "price": 50}],
     }
-    mock_graph.get_state.return_value = mock_snapshot
+    mock_graph.aget_state = AsyncMock(return_value=mock_snapshot)
 
-    with patch("main.MongoClient"), patch("main.MongoDBSaver"), patch("main.get_app_graph", return_value=mock_graph):
+    with patched_backends(mock_graph):
         with TestClient(app) as test_client:
             response = test_client.get("/session/history-thread-1")
 
@@ -82,5 +282,336 @@ def test_get_session_history(client):
             assert json_response["generated_url"] == "https://mock-s3/history_image"
             assert json_response["items"][0]["name"] == "Lamp"
 
-            # Verify get_state was called with correct config
-            mock_graph.get_state.assert_called_with({"configurable": {"thread_id": "history-thread-1"}})
+            # Verify aget_state was awaited with correct config
+            mock_graph.aget_state.assert_awaited_with({"configurable": {"thread_id": "history-thread-1"}})
+
+
+@patch("services.blob_store.object_exists", return_value=True)
+def test_session_reads_summary_with_etag(mock_object_exists, fake_presign):
+    snapshot = MagicMock(
+        values={
+            "original_image_key": "room",
+            "generated_image_key": "generated",
+            "items": [{"name": "Rug", "price": "120"}],
+        },
+        config={"configurable": {"thread_id": "etag-thread", "checkpoint_id": "cp-2"}},
+    )
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=snapshot)
+    mock_graph.ainvoke = AsyncMock(return_value=snapshot.values)
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            data = {"style": "Japandi", "mood": "Calm & Zen", "functionality": "Sleeping / Rest", "palette": "Pastel", "clutter": "Showroom Perfect"}
+            assert test_client.post("/generate", data={**data, "thread_id": "etag-thread"}).status_code == 200
+
+            # The summary written after the run answers reads without touching the checkpoint
+            mock_graph.aget_state.reset_mock()
+            response = test_client.get("/session/etag-thread")
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+            assert etag.startswith('"cp-2-')
+            assert response.json()["generated_url"] == "https://mock-s3/generated"
+            assert response.json()["items"][0]["name"] == "Rug"
+            mock_graph.aget_state.assert_not_awaited()
+            # Both URLs were signed once for the /generate response and reused for the read
+            assert fake_presign.call_count == 2
+
+            response = test_client.get("/session/etag-thread", headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.content == b""
+
+            # Another worker mints its own URLs at another moment of the same epoch: the tag still matches
+            epoch_start = url_signer.epoch() * url_signer.period
+            with patch("services.url_signer.time") as clock:
+                clock.time.return_value = epoch_start + 7
+                etag = test_client.get("/session/etag-thread").headers["ETag"]
+                url_signer.urls.clear()
+                clock.time.return_value = epoch_start + 42
+                assert test_client.get("/session/etag-thread", headers={"If-None-Match": etag}).status_code == 304
+
+            mock_graph.aget_state.return_value = MagicMock(values={}, config={})
+            assert test_client.get("/session/unknown-thread").status_code == 404
+
+
+@patch("services.blob_store.object_exists", return_value=False)
+@patch("services.blob_store.upload_fileobj", side_effect=lambda fileobj, key: key)
+def test_generate_job_mode_enqueues_and_reports_result(mock_upload_fileobj, mock_object_exists):
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
+    mock_graph.ainvoke = AsyncMock(return_value={"generated_image_key": "generated", "items": []})
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            files = {"file": ("room.jpg", b"room-bytes", "image/jpeg")}
+            data = {
+                "style": "Japandi",
+                "mood": "Calm & Zen",
+                "functionality": "Sleeping / Rest",
+                "palette": "Earth Tones",
+                "clutter": "Showroom Perfect",
+                "thread_id": "job-thread",
+                "async_job": "true",
+            }
+            response = test_client.post("/generate", files=files, data=data)
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            for _ in range(50):
+                job = test_client.get(f"/jobs/{job_id}").json()
+                if job["status"] == "succeeded":
+                    break
+                time.sleep(0.02)
+
+            assert job["status"] == "succeeded"
+            assert job["thread_id"] == "job-thread"
+            assert job["result"]["generated_url"] == "https://mock-s3/generated"
+            assert test_client.get("/jobs/unknown").status_code == 404
+
+
+@patch("services.blob_store.object_exists", return_value=True)
+def test_generate_job_mode_rejects_with_retry_after_when_full(mock_object_exists):
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={}))
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            test_client.app.state.job_queue.submit = AsyncMock(side_effect=QueueFull(retry_after=7))
+            files = {"file": ("room.jpg", b"room-bytes", "image/jpeg")}
+            data = {"style": "Japandi", "mood": "Calm & Zen", "functionality": "Sleeping / Rest", "palette": "Pastel", "clutter": "Showroom Perfect"}
+            response = test_client.post("/generate", files=files, data={**data, "async_job": "true"})
+
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "7"
+
+
+def test_generate_stream_emits_node_progress_without_image_data():
+    async def fake_astream(state, config=None, stream_mode=None):
+        assert stream_mode == "updates"
+        yield {"build_prompt": {"generated_prompt": "Japandi style"}}
+        yield {"prepare_image": {"original_image_hash": "abc123"}}
+        yield {"select_items": {"items": [{"name": "Futon", "price": "400", "link": "https://www.amazon.com/s?k=Futon"}]}}
+        yield {"generate_image": {"generated_image_key": "generated/xyz.png"}}
+
+    mock_graph = MagicMock()
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={"original_image_key": "room"}))
+    mock_graph.astream = fake_astream
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            data = {
+                "style": "Japandi",
+                "mood": "Calm & Zen",
+                "functionality": "Sleeping / Rest",
+                "palette": "Earth Tones",
+                "clutter": "Showroom Perfect",
+                "thread_id": "stream-thread",
+            }
+            with test_client.stream("POST", "/generate/stream", data=data) as response:
+                assert response.status_code == 200
+                assert response.headers["content-type"].startswith("text/event-stream")
+                body = "".join(response.iter_text())
+
+    events = _sse_events(body)
+    names = [name for name, _ in events]
+    assert names == ["started", "prompt_built", "items_selected", "generation_started", "image_ready", "done"]
+    assert events[2][1]["items"][0]["price"] == "400"
+    assert events[-1][1]["generated_url"] == "https://mock-s3/generated/xyz.png"
+    assert "original_image_hash" not in body
+
+
+def _sse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event_line, data_line = block.split("\n")
+        events.append((event_line.removeprefix("event: "), json.loads(data_line.removeprefix("data: "))))
+    return events
+
+
+@patch("main.BATCH_MAX_CONCURRENCY", 2)
+@patch("main.aprepare_image", new_callable=AsyncMock)
+def test_generate_batch_prepares_once_and_streams_variants_as_they_finish(mock_prepare):
+    running = 0
+    peak = 0
+
+    async def fake_ainvoke(state, config=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        # The first variant is the slowest, so it should be reported last
+        await asyncio.sleep(0.05 if state["style"] == "Japandi" else 0.01)
+        running -= 1
+        if state["style"] == "Industrial Loft":
+            raise RuntimeError("Bedrock throttled")
+        return {"generated_image_key": state["style"], "items": []}
+
+    mock_graph = MagicMock()
+    # A real config dict: building child mocks on the session-summary path is slow enough to reorder variants
+    mock_graph.aget_state = AsyncMock(return_value=MagicMock(values={"original_image_key": "room"}, config={}))
+    mock_graph.ainvoke = fake_ainvoke
+
+    base = {"mood": "Calm & Zen", "functionality": "Sleeping / Rest", "palette": "Earth Tones", "clutter": "Showroom Perfect"}
+    variants = [{**base, "style": style} for style in ("Japandi", "Scandinavian / Hygge", "Industrial Loft")]
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            data = {"variants": json.dumps(variants), "thread_id": "batch-thread"}
+            with test_client.stream("POST", "/generate/batch", data=data) as response:
+                assert response.status_code == 200
+                body = "".join(response.iter_text())
+
+            assert test_client.post("/generate/batch", data={"variants": "[]", "thread_id": "batch-thread"}).status_code == 400
+            assert test_client.post("/generate/batch", data={"variants": json.dumps([{"style": "Japandi"}])}).status_code == 400
+            unknown = test_client.post("/generate/batch", data={"variants": json.dumps([{**base, "style": "Art Deco"}])})
+            assert unknown.status_code == 422
+            assert unknown.json()["detail"][0]["loc"] == ["body", "variants", 0, "style"]
+
+    mock_prepare.assert_awaited_once_with({"original_image_key": "room"})
+    assert peak == 2
+
+    events = _sse_events(body)
+    assert [name for name, _ in events] == ["started", "variant_ready", "variant_error", "variant_ready", "done"]
+    assert events[1][1]["thread_id"] == "batch-thread-v1"
+    assert events[2][1] == {"index": 2, "detail": "Bedrock throttled"}
+    assert events[3][1]["generated_url"] == "https://mock-s3/Japandi"
+    assert events[-1][1] == {"thread_id": "batch-thread", "succeeded": 2, "failed": 1}
+
+
+@patch("main.aprepare_image", new_callable=AsyncMock)
+@patch("main.store_upload", new_callable=AsyncMock, return_value="uploads/room.jpg")
+def test_batch_without_thread_id_links_its_variants_to_a_base_session(mock_store_upload, mock_prepare):
+    checkpoints = {}
+
+    async def fake_ainvoke(state, config=None):
+        result = {**state, "generated_image_key": f"generated/{state['style']}.png", "items": []}
+        checkpoints[config["configurable"]["thread_id"]] = result
+        return result
+
+    async def fake_aget_state(config):
+        thread_id = config["configurable"]["thread_id"]
+        return MagicMock(values=checkpoints.get(thread_id, {}), config={"configurable": {"checkpoint_id": f"{thread_id}-cp"}})
+
+    mock_graph = MagicMock()
+    mock_graph.aget_state = fake_aget_state
+    mock_graph.ainvoke = fake_ainvoke
+
+    base = {"mood": "Calm & Zen", "functionality": "Sleeping / Rest", "palette": "Earth Tones", "clutter": "Showroom Perfect"}
+    variants = [{**base, "style": style} for style in ("Japandi", "Scandinavian / Hygge")]
+
+    with patched_backends(mock_graph):
+        with TestClient(app) as test_client:
+            files = {"file": ("room.jpg", b"room-bytes", "image/jpeg")}
+            with test_client.stream("POST", "/generate/batch", files=files, data={"variants": json.dumps(variants)}) as response:
+                body = "".join(response.iter_text())
+            thread_id = _sse_events(body)[0][1]["thread_id"]
+
+            session = test_client.get(f"/session/{thread_id}")
+            assert session.status_code == 200
+            assert session.json()["original_url"] == "https://mock-s3/uploads/room.jpg"
+            assert session.json()["variant_thread_ids"] == [f"{thread_id}-v0", f"{thread_id}-v1"]
+
+            # Generating on the base thread refreshes its summary without dropping the links
+            response = test_client.post("/generate", files=files, data={**base, "style": "Japandi", "thread_id": thread_id})
+            assert response.status_code == 200
+            session = test_client.get(f"/session/{thread_id}")
+
+    assert session.json()["generated_url"] == "https://mock-s3/generated/Japandi.png"
+    assert session.json()["variant_thread_ids"] == [f"{thread_id}-v0", f"{thread_id}-v1"]
+
+
+def test_ready_reports_mongo_and_index_state():
+    with patched_backends() as async_client:
+        with TestClient(app) as test_client:
+            for _ in range(50):
+                response = test_client.get("/ready")
+                if response.json()["checks"]["indexes"] != "pending":
+                    break
+                time.sleep(0.01)
+            assert response.status_code == 200
+            assert response.json()["status"] == "ready"
+            assert response.json()["checks"]["mongo"] == "ok"
+
+            async_client.admin.command.side_effect = ConnectionError("no primary")
+            response = test_client.get("/ready")
+            assert response.status_code == 503
+            assert response.json()["checks"]["mongo"].startswith("error")
+
+
+def test_import_main_stays_within_cold_start_budget():
+    rows = import_times("main")
+    imported = {name for name, _, _, _ in rows}
+    # The Bedrock chat model and the graph builder load after startup / in lifespan
+    assert "langchain_aws" not in imported
+    assert "langgraph.graph" not in imported
+    # Nor do the checkpointer and retention's langgraph dependencies
+    assert "langgraph" not in imported
+    assert "langchain_core" not in imported
+
+    total = next(cumulative for name, _, cumulative, depth in reversed(rows) if name == "main" and depth == 0)
+    assert total < float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", 1.5))
+
+
+def test_load_benchmark_runs_against_in_process_fakes(capsys):
+    from argparse import Namespace
+
+    from benchmarks.bench_load import compare, run
+
+    args = Namespace(
+        concurrency=2,
+        iterations=2,
+        repeat_prompts=False,
+        s3_latency_ms=0,
+        image_latency_ms=0,
+        items_latency_ms=0,
+        image_px=256,
+        bedrock_rpm=1_000_000,
+    )
+    results = asyncio.run(run(args))
+
+    for endpoint in ("init_session", "generate", "session"):
+        assert results["endpoints"][endpoint]["count"] == 4
+        assert results["endpoints"][endpoint]["errors"] == 0
+    assert results["bedrock_image_calls"] == 4
+    assert results["requests_per_second"] > 0
+    assert results["peak_rss_mb"] > 0
+    # Every session view was served the display copy, not the PNG
+    view = results["session_view_bytes"]
+    assert 0 < view["thumbnail"] and view["display"] < view["png"]
+    assert compare(results, results, tolerance=0.1) == []
+
+
+@patch("main.SERVER_TIMING", True)
+def test_metrics_and_server_timing_cover_graph_s3_and_bedrock():
+    from benchmarks.bench_load import synthetic_photo
+    from benchmarks.fakes import in_process_backends
+
+    with in_process_backends():
+        with TestClient(app) as client:
+            response = client.post("/init-session", files={"file": ("room.jpg", synthetic_photo(1, size=(64, 48)), "image/jpeg")})
+            assert "Server-Timing" not in response.headers
+            thread_id = response.json()["thread_id"]
+
+            options = {"style": "Japandi", "mood": "Calm & Zen", "functionality": "Relaxation / Lounge", "palette": "Earth Tones"}
+            data = {**options, "clutter": "Showroom Perfect", "thread_id": thread_id}
+            response = client.post("/generate", data=data, headers={"X-Server-Timing": "1"})
+            assert response.status_code == 200
+
+            timing = response.headers["Server-Timing"]
+            for entry in (
+                "node.select_items;dur=",
+                "node.generate_image;dur=",
+                "s3.put_object;dur=",
+                "bedrock.stability.sd3-5-large-v1_0;dur=",
+                "total;dur=",
+            ):
+                assert entry in timing
+
+            metrics = client.get("/metrics")
+            assert metrics.headers["content-type"].startswith("text/plain")
+            body = metrics.text
+            assert 'graph_node_seconds_count{node="generate_image"}' in body
+            assert 'bedrock_request_seconds_count{model="stability.sd3-5-large-v1:0"}' in body
+            assert 'bedrock_payload_bytes_count{model="stability.sd3-5-large-v1:0",direction="request"}' in body
+            assert 's3_object_bytes_count{operation="upload_fileobj"}' in body
+            assert 'http_request_seconds_count{method="POST",route="/generate",status="200"}' in body
+            assert 'bedrock_queue_depth{model="stability.sd3-5-large-v1:0"} 0' in body
@@ -0,0 +1,397 @@
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from services import aws_clients
+from services.aws_bedrock import image_governor, invoke_model
+from services.bedrock_governor import BATCH, INTERACTIVE, ModelBusy, ModelGovernor, bedrock_priority
+from services.blob_store import BlobStore, content_key
+from services.executors import get_executor, run_in_executor
+from services.jobs import JobQueue, LocalJobQueue, QueueFull
+from services.result_cache import InMemoryResultStore, ResultCache
+from services.retention import CheckpointRetention, InMemoryRetentionBackend
+from services.single_flight import InMemoryLeaseStore, SingleFlight, generation_key
+from services.url_signer import UrlSigner
+
+
+def test_client_registry_reuses_one_client_across_threads(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    monkeypatch.setenv("S3_MAX_POOL_CONNECTIONS", "64")
+    aws_clients.reset_clients()
+
+    built = []
+
+    def fake_build(service):
+        built.append(service)
+        return MagicMock(name=service)
+
+    with patch.object(aws_clients, "_build_client", side_effect=fake_build):
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(aws_clients.get_client("s3"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert built == ["s3"]
+    assert all(client is seen[0] for client in seen)
+
+    config = aws_clients._client_config("s3")
+    assert config.max_pool_connections == 64
+    assert config.retries["mode"] == "adaptive"
+    assert config.tcp_keepalive is True
+    aws_clients.reset_clients()
+
+
+@patch("services.blob_store.object_exists")
+@patch("services.blob_store.upload_file")
+def test_put_content_deduplicates_identical_uploads(mock_upload_file, mock_object_exists):
+    mock_upload_file.side_effect = lambda data, key: key
+    mock_object_exists.return_value = False
+    store = BlobStore()
+
+    first = store.put_content(b"room-photo", "Room.JPG")
+    second = store.put_content(b"room-photo", "renamed.jpg")
+
+    assert first == second == content_key(b"room-photo", "x.jpg")
+    assert first.startswith("uploads/")
+    mock_upload_file.assert_called_once()
+    # The local index answers the second call without a HEAD request either
+    mock_object_exists.assert_called_once()
+
+
+@patch("services.blob_store.object_exists", return_value=True)
+@patch("services.blob_store.upload_file")
+def test_put_content_skips_put_when_object_already_in_s3(mock_upload_file, mock_object_exists):
+    store = BlobStore()
+
+    key = store.put_content(b"stored-by-another-worker", "room.png")
+
+    assert key == content_key(b"stored-by-another-worker", "room.png")
+    mock_upload_file.assert_not_called()
+    assert store.get(key) == b"stored-by-another-worker"
+
+
+def test_invoke_model_streams_payload_through_codec():
+    runtime = MagicMock()
+    runtime.invoke_model.return_value = {"body": io.BytesIO(json.dumps({"images": [base64.b64encode(b"generated-png").decode()]}).encode())}
+    aws_clients.set_client("bedrock-runtime", runtime)
+    try:
+        result = invoke_model("cozy loft", b"room-jpeg", strength=0.5, output_format="webp")
+    finally:
+        aws_clients.reset_clients()
+
+    assert bytes(result) == b"generated-png"
+    sent = json.loads(runtime.invoke_model.call_args.kwargs["body"])
+    assert sent == {"prompt": "cozy loft", "strength": 0.5, "output_format": "webp", "image": base64.b64encode(b"room-jpeg").decode()}
+
+
+class ThrottlingBedrock:
+    """
+    Stand-in bedrock-runtime client that throttles the first `throttles` calls.
+    """
+
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "InvokeModel")
+        return {"body": io.BytesIO(json.dumps({"images": [base64.b64encode(b"generated-png").decode()]}).encode())}
+
+
+def test_governor_retries_throttled_calls_and_backs_off(monkeypatch):
+    monkeypatch.setattr(image_governor, "base_delay", 0.001)
+    monkeypatch.setattr(image_governor, "requests_per_minute", 6000)
+    monkeypatch.setattr(image_governor, "rate", 100.0)
+    runtime = ThrottlingBedrock(throttles=2)
+    aws_clients.set_client("bedrock-runtime", runtime)
+    try:
+        before = image_governor.stats()
+        assert bytes(invoke_model("cozy loft", b"room-jpeg")) == b"generated-png"
+        stats = image_governor.stats()
+        assert runtime.calls == 3
+        assert stats["throttled"] - before["throttled"] == 2
+        assert stats["retries"] - before["retries"] == 2
+        # Halved twice, then one additive step back up
+        assert stats["requests_per_minute"] == (100 / 4 + 100 / 20) * 60
+
+        # Throttled on every attempt: the caller gets ModelBusy instead of a silent None
+        aws_clients.set_client("bedrock-runtime", ThrottlingBedrock(throttles=100))
+        monkeypatch.setattr(image_governor, "max_retries", 1)
+        monkeypatch.setattr(image_governor, "rate", 100.0)
+        with pytest.raises(ModelBusy) as busy:
+            invoke_model("cozy loft", b"room-jpeg")
+        assert busy.value.retry_after >= 1
+    finally:
+        aws_clients.reset_clients()
+
+
+def test_governor_serves_interactive_calls_before_batch():
+    governor = ModelGovernor("test-model", requests_per_minute=6000, max_concurrency=1)
+    release = threading.Event()
+    order = []
+
+    def blocked():
+        release.wait(5)
+
+    holder = threading.Thread(target=governor.call, args=(blocked,))
+    holder.start()
+    while governor.stats()["active"] == 0:
+        time.sleep(0.001)
+
+    waiters = []
+    for priority in (BATCH, BATCH, INTERACTIVE):
+        waiter = threading.Thread(target=governor.call, args=(order.append, priority), kwargs={"priority": priority})
+        waiter.start()
+        waiters.append(waiter)
+        while governor.stats()["queue_depth"] < len(waiters):
+            time.sleep(0.001)
+
+    release.set()
+    for thread in [holder, *waiters]:
+        thread.join(5)
+
+    assert order == [INTERACTIVE, BATCH, BATCH]
+    stats = governor.stats()
+    assert stats["requests"] == 4
+    assert stats["queue_depth"] == 0
+    assert stats["wait_seconds_max"] > 0
+
+
+@pytest.mark.asyncio
+async def test_governor_admission_keeps_interactive_ahead_of_a_saturated_batch_pool():
+    governor = ModelGovernor("test-admission-model", requests_per_minute=600_000, max_concurrency=1)
+    pool_size = get_executor("bedrock")._max_workers
+    release = threading.Event()
+    order = []
+
+    async def until(predicate):
+        deadline = time.monotonic() + 5
+        while not predicate():
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.001)
+
+    async def governed(func, *args, priority):
+        async with governor.admission(priority):
+            return await run_in_executor("bedrock", governor.call, func, *args)
+
+    holder = asyncio.create_task(governed(release.wait, 5, priority=INTERACTIVE))
+    await until(lambda: governor.stats()["active"] == 1)
+
+    # More queued batch calls than the pool has threads; none of them may hold one while waiting
+    with bedrock_priority(BATCH):
+        batch = [asyncio.create_task(governed(order.append, BATCH, priority=BATCH)) for _ in range(pool_size + 8)]
+    await until(lambda: governor.stats()["queue_depth"] == len(batch))
+    interactive = asyncio.create_task(governed(order.append, INTERACTIVE, priority=INTERACTIVE))
+    await until(lambda: governor.stats()["queue_depth"] == len(batch) + 1)
+
+    release.set()
+    await asyncio.wait_for(asyncio.gather(holder, interactive, *batch), 10)
+
+    assert order[0] == INTERACTIVE
+    assert order.count(BATCH) == len(batch)
+    assert governor.stats()["requests"] == len(batch) + 2
+
+
+@pytest.mark.asyncio
+async def test_local_job_queue_bounds_admission_and_serializes_threads():
+    running = {"now": 0, "max": 0}
+    release = asyncio.Event()
+
+    async def handler(thread_id, payload):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await release.wait()
+        running["now"] -= 1
+        return {"value": payload}
+
+    queue = LocalJobQueue(max_workers=2, max_queue=2, retry_after=3)
+    await queue.start(handler)
+    try:
+        first = await queue.submit("same-thread", 1)
+        second = await queue.submit("same-thread", 2)
+        await asyncio.sleep(0.01)
+        # Both workers picked a job up, so the queue has room again; fill it
+        await queue.submit("other", 3)
+        await queue.submit("other", 4)
+        with pytest.raises(QueueFull) as excinfo:
+            await queue.submit("other", 5)
+        assert excinfo.value.retry_after == 3
+
+        # Same thread_id never runs concurrently
+        assert running["max"] == 1
+        release.set()
+        await asyncio.sleep(0.05)
+        assert (await queue.get(first))["result"] == {"value": 1}
+        assert (await queue.get(second))["status"] == "succeeded"
+    finally:
+        await queue.stop()
+
+
+def test_job_queue_backends_must_implement_the_whole_interface():
+    class PartialQueue(JobQueue):
+        async def submit(self, thread_id, payload):
+            return {}
+
+    with pytest.raises(TypeError):
+        PartialQueue()
+    assert isinstance(LocalJobQueue(), JobQueue)
+
+
+@patch("services.url_signer.create_presigned_url", side_effect=lambda key, expiration: f"https://mock-s3/{key}?expires={expiration}")
+def test_url_signer_reuses_urls_until_refresh_margin(mock_presign):
+    signer = UrlSigner(expires_in=3600, refresh_margin=300)
+
+    signed = signer.sign(["a", "b", None, "a"])
+    assert set(signed) == {"a", "b"}
+    assert signer.url("a") == "https://mock-s3/a?expires=3600"
+    assert mock_presign.call_count == 2
+
+    # Inside the refresh margin the URL is re-minted instead of handed out nearly expired
+    later = time.monotonic() + 3301
+    with patch("utils.cache.time.monotonic", return_value=later):
+        signer.url("a")
+    assert mock_presign.call_count == 3
+
+    # A new epoch starts afresh, so URLs minted late in the last one are not carried into it
+    with patch("services.url_signer.time.time", return_value=(signer.epoch() + 1) * signer.period):
+        signer.url("a")
+    assert mock_presign.call_count == 4
+
+
+def test_checkpoint_retention_keeps_last_checkpoints_and_expires_idle_threads():
+    from typing import TypedDict
+
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.graph import END, StateGraph
+
+    class CounterState(TypedDict):
+        count: int
+
+    workflow = StateGraph(CounterState)
+    workflow.add_node("bump", lambda state: {"count": state["count"] + 1})
+    workflow.set_entry_point("bump")
+    workflow.add_edge("bump", END)
+    saver = InMemorySaver()
+    app = workflow.compile(checkpointer=saver)
+
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        for run in range(4):
+            app.invoke({"count": run * 10}, config)
+
+    retention = CheckpointRetention(InMemoryRetentionBackend(saver), keep_last=2, idle_seconds=3600)
+    run = retention.run_once()
+
+    assert run["threads_pruned"] == 2
+    assert run["checkpoints_deleted"] == 2 * (12 - 2)
+    assert run["bytes_reclaimed"] > 0
+    for thread_id in ("a", "b"):
+        config = {"configurable": {"thread_id": thread_id}}
+        assert len(list(saver.list(config))) == 2
+        # The latest state is untouched
+        assert app.get_state(config).values == {"count": 31}
+
+    # A second pass has nothing left to do; an hour later both threads are gone
+    assert retention.run_once()["checkpoints_deleted"] == 0
+    run = retention.run_once(now=time.time() + 3601)
+    assert run["threads_expired"] == 2
+    assert not list(saver.list(None))
+    assert not saver.writes and not saver.blobs
+    assert retention.stats()["checkpoints_deleted"] == 24
+
+
+def test_result_cache_keeps_only_keys_and_promotes_shared_hits():
+    shared = InMemoryResultStore()
+    worker_a = ResultCache(persistent=shared)
+    worker_b = ResultCache(persistent=shared)
+
+    worker_a.set("cache-key", "generated/abc.png")
+    assert worker_a.get("cache-key") == "generated/abc.png"
+    # Another worker finds it in the shared tier, then serves it from memory
+    assert worker_b.get("cache-key") == "generated/abc.png"
+    assert worker_b.get("cache-key") == "generated/abc.png"
+    assert worker_b.get("other-key") is None
+
+    stats = worker_b.stats()
+    assert (stats["persistent_hits"], stats["memory_hits"], stats["misses"], stats["memory_items"]) == (1, 1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_duplicates_within_and_across_workers():
+    store = InMemoryLeaseStore()
+    worker_a = SingleFlight(store, poll_interval=0.01)
+    worker_b = SingleFlight(store, poll_interval=0.01)
+    runs = []
+
+    async def produce():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"generated_image_key": f"generated/{len(runs)}.png"}
+
+    state = {"original_image_key": "uploads/" + "a" * 64 + ".jpg", "style": "Japandi", "additional_prompt": " big   window "}
+    key = generation_key("thread-1", state)
+    # Whitespace in the additional prompt doesn't make a request different
+    assert key == generation_key("thread-1", {**state, "additional_prompt": "big window"})
+    assert key != generation_key("thread-2", state)
+
+    results = await asyncio.gather(worker_a.run(key, produce), worker_a.run(key, produce), worker_b.run(key, produce))
+
+    assert len(runs) == 1
+    assert results == [{"generated_image_key": "generated/1.png"}] * 3
+    assert worker_a.stats()["local_followers"] == 1
+    assert worker_b.stats()["remote_followers"] == 1
+    # Only runs in flight are shared: a request after it finished generates again
+    assert await worker_b.run(key, produce) == {"generated_image_key": "generated/2.png"}
+    assert await worker_a.run(key, produce) == {"generated_image_key": "generated/3.png"}
+    assert len(runs) == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_failure_releases_lease_and_expired_leases_are_taken_over():
+    store = InMemoryLeaseStore()
+    flight = SingleFlight(store, lease_seconds=0.05, poll_interval=0.01)
+
+    async def fail():
+        raise RuntimeError("Bedrock throttled")
+
+    async def succeed():
+        return {"generated_image_key": "generated/ok.png"}
+
+    with pytest.raises(RuntimeError):
+        await flight.run("key", fail)
+    # Nothing is left holding the key after a failure
+    assert await flight.run("key", succeed) == {"generated_image_key": "generated/ok.png"}
+
+    # A worker that died mid-run stops renewing; its lease expires and another worker runs it
+    store.acquire("orphaned", "dead-worker", 0.05)
+    assert await flight.run("orphaned", succeed) == {"generated_image_key": "generated/ok.png"}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_keeps_running_while_a_duplicate_still_waits():
+    flight = SingleFlight(InMemoryLeaseStore())
+    finished = asyncio.Event()
+
+    async def produce():
+        await asyncio.sleep(0.05)
+        finished.set()
+        return {}
+
+    first = asyncio.create_task(flight.run("key", produce))
+    second = asyncio.create_task(flight.run("key", produce))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == {}
+    assert finished.is_set()
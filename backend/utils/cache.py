@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and, optionally, total size in bytes
+    and entry age (ttl, in seconds). Tracks hits and misses so callers can report
+    cache effectiveness.
+    """
+
+    def __init__(self, max_items=1024, max_bytes=None, sizeof=len, ttl=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._expires = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            if self.ttl is not None and self._expires[key] <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Never evict the whole cache for a single oversized entry
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self._total_bytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key]
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._expires.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self._data), "bytes": self._total_bytes}
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            return self.ttl is None or self._expires[key] > time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _evict(self):
+        while len(self._data) > self.max_items or (self.max_bytes is not None and self._total_bytes > self.max_bytes):
+            self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        del self._data[key]
+        self._total_bytes -= self._sizes.pop(key)
+        self._expires.pop(key, None)
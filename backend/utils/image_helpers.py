@@ -1,8 +1,109 @@
-# Placeholder for image helpers if needed
-# Currently, resizing/formatting is handled implicitly or not required by the prompt's specific logic yet.
-# But we'll create the file as requested.
+import io
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# Stable Diffusion 3.5 works at roughly one megapixel; anything larger is decoded
+# by Bedrock only to be thrown away, and inflates the base64 request body.
+MAX_PIXELS = int(os.getenv("PREPROCESS_MAX_PIXELS", 1024 * 1024))
+MAX_ENCODED_BYTES = int(os.getenv("PREPROCESS_MAX_BYTES", 1536 * 1024))
+JPEG_QUALITY_STEPS = (90, 85, 80, 75, 70, 60)
+
+
+def preprocess_signature():
+    """
+    Settings that change the preprocessed output; part of every generation cache key.
+    """
+    return {"max_pixels": MAX_PIXELS, "max_bytes": MAX_ENCODED_BYTES, "format": "JPEG"}
 
 
 def resize_image(image_bytes, size=(1024, 1024)):
-    # Implement resizing logic here if needed using Pillow
-    pass
+    """
+    Downscale an image to fit inside size, preserving aspect ratio. Returns JPEG bytes.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        return _encode_jpeg(_to_rgb(image), MAX_ENCODED_BYTES)
+
+
+def preprocess_image(image_bytes, max_pixels=MAX_PIXELS, max_bytes=MAX_ENCODED_BYTES):
+    """
+    Prepare a user photo for image-to-image generation:
+    apply EXIF orientation, downscale to at most max_pixels (aspect ratio preserved),
+    drop all metadata and re-encode as JPEG within max_bytes.
+    Falls back to the original bytes if the image cannot be decoded.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = ImageOps.exif_transpose(image)
+            width, height = image.size
+            if width * height > max_pixels:
+                scale = math.sqrt(max_pixels / (width * height))
+                target = (max(1, int(width * scale)), max(1, int(height * scale)))
+                image = image.resize(target, Image.Resampling.LANCZOS)
+            return _encode_jpeg(_to_rgb(image), max_bytes)
+    except Exception as e:
+        logger.warning("Could not preprocess image, sending original: %s", e)
+        return image_bytes
+
+
+def _to_rgb(image):
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white rather than black
+        from PIL import Image
+
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _encode_jpeg(image, max_bytes):
+    from PIL import Image
+
+    # Drop EXIF/ICC/XMP and anything else carried over from the source file
+    image.info = {}
+    while True:
+        for quality in JPEG_QUALITY_STEPS:
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            data = buffer.getvalue()
+            if len(data) <= max_bytes:
+                return data
+        # Even the lowest quality is over budget (very noisy photo): shrink and retry
+        width, height = image.size
+        if width <= 64 or height <= 64:
+            return data
+        image = image.resize((int(width * 0.75), int(height * 0.75)), Image.Resampling.LANCZOS)
+
+
+def encode_derivatives(image_bytes, specs):
+    """
+    Compressed, downscaled copies of a generated image for display.
+    specs maps a name to {"format", "max_edge", "quality"}; returns {name: bytes}.
+    Runs in the "images" process pool, so it must stay importable without the app.
+    """
+    from PIL import Image
+
+    derived = {}
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        current = _to_rgb(image)
+        current.info = {}
+        # Largest first: each smaller size is resampled from the previous one, not the full PNG
+        for name, spec in sorted(specs.items(), key=lambda item: -item[1]["max_edge"]):
+            current = current.copy()
+            current.thumbnail((spec["max_edge"], spec["max_edge"]), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            current.save(buffer, format=spec["format"].upper(), quality=spec["quality"])
+            derived[name] = buffer.getvalue()
+    return derived
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import sys
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+def _extras(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_FIELDS}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the extra={...} fields as top-level keys.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extras(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Human-readable lines with the extra={...} fields appended as key=value.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extras = _extras(record)
+        if extras:
+            line += " " + " ".join(f"{key}={value}" for key, value in extras.items())
+        return line
+
+
+def configure_logging():
+    """
+    Route application logs to stderr. LOG_LEVEL (default INFO) gates what is emitted;
+    LOG_FORMAT=json switches to one JSON object per line for log aggregation.
+    Safe to call more than once.
+    """
+    root = logging.getLogger()
+    if any(getattr(handler, "_room_designer", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else TextFormatter())
+    handler._room_designer = True
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
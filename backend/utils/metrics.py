@@ -0,0 +1,206 @@
+import bisect
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds: from a cache hit to a slow SD3.5 call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+
+# Set per request by the Server-Timing middleware; None (the default) means nobody is collecting
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+_TIMING_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() bumps one bucket under a per-histogram lock;
+    the cumulative counts Prometheus expects are only computed when rendered.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One slot per bucket plus +Inf, then sum and count
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(str(labels[name]) for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else _number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {values[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge read from a callback at scrape time, for values other components already track.
+    The callback returns {label values tuple: value}.
+    """
+
+    def __init__(self, name, help, labelnames, callback):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Modules can be re-imported (tests, reloads); keep the first instance
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return registry.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, labelnames, callback):
+    return registry.register(Gauge(name, help, labelnames, callback))
+
+
+def record_timing(name, seconds):
+    """
+    Add one entry to the current request's Server-Timing breakdown, if one is being collected.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def timed(metric, timing_name=None, **labels):
+    """
+    Observe the duration of the block in metric and, under timing_name, in the request's
+    Server-Timing breakdown.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metric.observe(elapsed, **labels)
+        if timing_name:
+            record_timing(timing_name, elapsed)
+
+
+def collect_timings():
+    """
+    Start collecting Server-Timing entries for the current context.
+    Returns the list entries are appended to; the executors share it with their threads.
+    """
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings):
+    """
+    Format collected timings as a Server-Timing header value. Repeated names
+    (e.g. two S3 reads) are summed and shown with their count.
+    """
+    totals = {}
+    for name, seconds in list(timings):
+        total, count = totals.get(name, (0.0, 0))
+        totals[name] = (total + seconds, count + 1)
+    entries = []
+    for name, (total, count) in totals.items():
+        entry = f"{_TIMING_NAME_RE.sub('_', name)};dur={total * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="x{count}"'
+        entries.append(entry)
+    return ", ".join(entries)
@@ -0,0 +1,73 @@
+import logging
+import os
+import re
+import subprocess  # nosec B404
+import sys
+import time
+from contextlib import contextmanager
+
+# STARTUP_PROFILE=1 prints per-phase startup timings once lifespan has finished
+ENABLED = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+logger = logging.getLogger(__name__)
+
+phases = []
+
+
+@contextmanager
+def phase(name):
+    """
+    Time one startup phase. Always recorded (it is a few perf_counter calls), reported when ENABLED.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - started))
+
+
+def report():
+    """
+    Log the recorded phases, slowest first.
+    """
+    total = sum(seconds for _, seconds in phases)
+    lines = [f"  {seconds * 1000:8.1f} ms  {name}" for name, seconds in sorted(phases, key=lambda p: p[1], reverse=True)]
+    logger.info("Startup phases (%.1f ms total):\n%s", total * 1000, "\n".join(lines))
+
+
+def import_times(module="main"):
+    """
+    Import module in a fresh interpreter with -X importtime.
+    Returns [(name, self_seconds, cumulative_seconds, depth)] in import order.
+    """
+    # Runs the current interpreter on a module name, never on user input
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent) // 2))
+    return rows
+
+
+def print_import_report(module="main", top=25):
+    rows = import_times(module)
+    total = next(cumulative for name, _, cumulative, depth in reversed(rows) if name == module and depth == 0)
+    print(f"import {module}: {total * 1000:.1f} ms")
+    print("Slowest imports (cumulative):")
+    for name, self_seconds, cumulative, _ in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"  {cumulative * 1000:8.1f} ms  (self {self_seconds * 1000:6.1f} ms)  {name}")
+
+
+if __name__ == "__main__":
+    # python -m utils.startup_profile [module]
+    print_import_report(sys.argv[1] if len(sys.argv) > 1 else "main")
@@ -240,6 +240,7 @@ export default function Wizard() {
   const [result, setResult] = useState<{
     original_url: string;
     generated_url: string;
+    display_url?: string | null;
     items: Item[];
   } | null>(null);
   const [error, setError] = useState<string | null>(null);
@@ -307,6 +308,7 @@ export default function Wizard() {
             setResult({
               original_url: history.original_url,
               generated_url: history.generated_url,
+              display_url: history.display_url,
               items: history.items,
             });
             // Jump to result
@@ -509,7 +511,7 @@ export default function Wizard() {
     return result ? (
       <ResultViewer
         originalUrl={result.original_url}
-        generatedUrl={result.generated_url}
+        generatedUrl={result.display_url || result.generated_url}
         items={result.items}
         onStartOver={handleStartOver}
       />
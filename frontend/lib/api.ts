@@ -8,6 +8,9 @@ export interface Item {
 export interface DesignResult {
   original_url: string;
   generated_url: string;
+  // Compressed WebP/AVIF copies; null until the backend has encoded them
+  display_url?: string | null;
+  thumbnail_url?: string | null;
   items: Item[];
   thread_id?: string;
 }